@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  background_task.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# timed spans for traces
+from instrumentation import tracer
+
+# tasks that have been started but whose result has not been delivered yet
+pendingTasks = set()
+
+## BackgroundTaskSignals
+#
+#  Carries the result of a BackgroundTask back to the thread that started it.
+class BackgroundTaskSignals(QtCore.QObject):
+    # result of the function
+    finished = QtCore.pyqtSignal(object)
+    # the exception raised by the function
+    failed = QtCore.pyqtSignal(object)
+
+## BackgroundTask
+#
+#  Runs a function on the shared thread pool.
+class BackgroundTask(QtCore.QRunnable):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param function The function to run.
+    #  @param args The arguments of the function.
+    def __init__(self, function, args=()):
+        super(BackgroundTask, self).__init__()
+        self.function = function
+        self.args = args
+        self.signals = BackgroundTaskSignals()
+
+        # done
+
+    ## Run the function and report the result
+    #  @param self The object pointer.
+    def run(self):
+        try:
+            with tracer.span(getattr(self.function, '__qualname__', 'task'), "background"):
+                result = self.function(*self.args)
+        except Exception as error:
+            self.signals.failed.emit(error)
+            return
+        self.signals.finished.emit(result)
+
+        # done
+
+## Run a function in the background
+#  The callbacks are called in the thread that started the task (normally the GUI thread).
+#  @param function The function to run.
+#  @param args The arguments of the function.
+#  @param onFinished Called with the result.
+#  @param onFailed Called with the exception, if the function raises one.
+#  @return The task.
+def startBackgroundTask(function, args=(), onFinished=None, onFailed=None):
+    task = BackgroundTask(function, args)
+    pendingTasks.add(task)
+
+    # forget the task once it has reported back
+    task.signals.finished.connect(lambda result: pendingTasks.discard(task))
+    task.signals.failed.connect(lambda error: pendingTasks.discard(task))
+    if onFinished is not None:
+        task.signals.finished.connect(onFinished)
+    if onFailed is not None:
+        task.signals.failed.connect(onFailed)
+
+    QtCore.QThreadPool.globalInstance().start(task)
+    return task
+
+# end
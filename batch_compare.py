@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  batch_compare.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Headless comparison of many image pairs, e.g. rendered frames against golden images.
+#  Pairs are compared on a pool of worker processes, each holding one pair at a time,
+#  and results are written as soon as each pair is done.
+#
+
+# command line
+import argparse
+import csv
+import json
+import multiprocessing
+import sys
+
+# comparison
+import image_diff
+import mapped_image
+
+# finding the pairs
+from pair_playlist import pairsFromDirectories, pairsFromManifest
+
+# constants
+kResultFields = ('imageA', 'imageB', 'width', 'height', 'sizeMismatch', 'maxDiff', 'meanAbsDiff', 'psnr', 'differingPixels', 'bbox', 'error')
+kExitIdentical = 0
+kExitDifferent = 1
+kExitError = 2
+
+## Compare one pair; runs in a worker process
+#  @param task Tuple of (pathA, pathB, threshold).
+#  @return A result dictionary with the keys in kResultFields.
+def comparePair(task):
+    pathA, pathB, threshold = task
+    result = dict.fromkeys(kResultFields)
+    result['imageA'] = pathA
+    result['imageB'] = pathB
+    if pathB is None:
+        result['error'] = "no matching image"
+        return result
+
+    try:
+        arrayA, ownerA = mapped_image.loadImageArray(pathA)
+        arrayB, ownerB = mapped_image.loadImageArray(pathB)
+        result['height'], result['width'] = image_diff.commonShape(arrayA, arrayB)
+        result['sizeMismatch'] = arrayA.shape[:2] != arrayB.shape[:2]
+        result.update(image_diff.computeMetrics(arrayA, arrayB, threshold))
+    except Exception as error:
+        # any failure is reported for this pair, rather than ending the whole run
+        result['error'] = type(error).__name__ + ": " + str(error)
+    return result
+
+## Writes results as JSON Lines
+class JsonLinesWriter(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param stream The output stream.
+    def __init__(self, stream):
+        self.stream = stream
+
+    ## Write one result and flush, so that partial results survive a crash
+    #  @param self The object pointer.
+    #  @param result The result dictionary.
+    def write(self, result):
+        self.stream.write(json.dumps(result, sort_keys=True) + '\n')
+        self.stream.flush()
+
+## Writes results as CSV
+class CsvWriter(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param stream The output stream.
+    def __init__(self, stream):
+        self.stream = stream
+        self.writer = csv.DictWriter(stream, fieldnames=kResultFields)
+        self.writer.writeheader()
+
+    ## Write one result and flush, so that partial results survive a crash
+    #  @param self The object pointer.
+    #  @param result The result dictionary.
+    def write(self, result):
+        row = dict(result)
+        if row['bbox'] is not None:
+            row['bbox'] = ' '.join(str(value) for value in row['bbox'])
+        self.writer.writerow(row)
+        self.stream.flush()
+
+## Compare all pairs on a process pool and write the results as they arrive
+#  At most one pair per worker is in memory at a time.
+#  @param pairs Iterable of (pathA, pathB).
+#  @param writer A JsonLinesWriter or CsvWriter.
+#  @param jobs Number of worker processes.
+#  @param threshold Largest difference still considered equal.
+#  @return The exit code: kExitIdentical, kExitDifferent or kExitError.
+def runBatch(pairs, writer, jobs=None, threshold=0):
+    tasks = ((pathA, pathB, threshold) for pathA, pathB in pairs)
+    exitCode = kExitIdentical
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        for result in pool.imap_unordered(comparePair, tasks, chunksize=1):
+            writer.write(result)
+            if result['error'] is not None:
+                exitCode = kExitError
+            elif exitCode == kExitIdentical and (result['differingPixels'] or result['sizeMismatch']):
+                exitCode = kExitDifferent
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return exitCode
+
+## Command line entry point
+#  @param argv The arguments, without the program name.
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='image_comparator.py --batch', description="Compare image pairs without a GUI. Exit code 0: all pairs identical, 1: some differ, 2: errors.")
+    parser.add_argument('directories', nargs='*', metavar='DIR', help="two directories; files with the same relative path are compared")
+    parser.add_argument('--manifest', help="file listing one pair per line, separated by a tab or a comma")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+    parser.add_argument('--threshold', type=float, default=0, help="largest per-channel difference still counted as equal")
+    parser.add_argument('--output', '-o', help="result file (default: standard output)")
+    parser.add_argument('--format', choices=('jsonl', 'csv'), help="result format (default: from the output file extension, else jsonl)")
+    args = parser.parse_args(argv)
+
+    if args.manifest:
+        if args.directories:
+            parser.error("give either a manifest or two directories")
+        pairs = pairsFromManifest(args.manifest)
+    elif len(args.directories) == 2:
+        pairs = pairsFromDirectories(args.directories[0], args.directories[1])
+    else:
+        parser.error("two directories or --manifest are required")
+
+    resultFormat = args.format
+    if resultFormat is None:
+        resultFormat = 'csv' if args.output and args.output.lower().endswith('.csv') else 'jsonl'
+
+    stream = open(args.output, 'w', newline='') if args.output else sys.stdout
+    try:
+        writer = CsvWriter(stream) if resultFormat == 'csv' else JsonLinesWriter(stream)
+        return runBatch(pairs, writer, args.jobs, args.threshold)
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# end
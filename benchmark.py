@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  benchmark.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Performance benchmarks on synthetic images. With Qt 5 they run without a screen, on the offscreen
+#  platform; Qt 4 has no such platform and needs an X display, e.g. a virtual one from xvfb-run.
+#  Measures decoding, time to first paint, startup from the command line, per-frame pan and zoom
+#  latency, peak memory and difference throughput, writes the results as JSON, and compares them
+#  with a stored baseline and the startup budget.
+#
+
+# command line
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# peak memory; not available on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# synthetic images and percentiles
+import numpy
+
+# GUI, run on the offscreen platform where Qt has one
+from PyQt4 import QtCore, QtGui
+
+# the code being measured
+import image_comparator
+import image_diff
+import mapped_image
+
+# optional: comparison on all cores needs shared memory (Python 3.8)
+try:
+    import parallel_diff
+except ImportError:
+    parallel_diff = None
+from image_cache import decodedImageCache
+from image_loader import decodeImage
+
+# constants
+kDefaultSizes = (1, 16, 100, 500)
+kDefaultFrames = 200
+kDefaultTolerance = 0.25
+kMaxPngMegapixels = 100
+kPanStep = 7
+kPanFramesPerDirection = 20
+kZoomSteps = 8
+kWheelDelta = 120
+kStripeRows = 512
+kResultFormat = 1
+kExitPassed = 0
+kExitRegressed = 1
+kExitNoDisplay = 3
+kStartupRuns = 3
+kStartupTimeout = 120
+kStartupBudget = 1500.0
+
+## Width and height of a 3:2 image with the given number of megapixels
+#  @param megapixels The number of pixels, in millions.
+def syntheticShape(megapixels):
+    width = int(round((megapixels * 1e6 * 1.5) ** 0.5))
+    height = int(round(megapixels * 1e6 / width))
+    return height, width
+
+## Write a pair of synthetic RGB images as .npy files, one stripe at a time
+#  The content is a gradient with a texture and some noise, so that it neither compresses to nothing
+#  nor looks like pure noise. The second image differs in a block in the middle.
+#  @param directory The directory to write to.
+#  @param megapixels The size of the images, in millions of pixels.
+#  @return The paths to both files.
+def writeSyntheticPair(directory, megapixels):
+    height, width = syntheticShape(megapixels)
+    pathA = os.path.join(directory, str(megapixels) + 'mp_a.npy')
+    pathB = os.path.join(directory, str(megapixels) + 'mp_b.npy')
+    arrayA = numpy.lib.format.open_memmap(pathA, mode='w+', dtype=numpy.uint8, shape=(height, width, 3))
+    arrayB = numpy.lib.format.open_memmap(pathB, mode='w+', dtype=numpy.uint8, shape=(height, width, 3))
+
+    random = numpy.random.RandomState(megapixels)
+    x = numpy.arange(width, dtype=numpy.int32)
+    changedRows = slice(height * 2 // 5, height * 3 // 5)
+    changedColumns = slice(width * 2 // 5, width * 3 // 5)
+    for top in range(0, height, kStripeRows):
+        y = numpy.arange(top, min(top + kStripeRows, height), dtype=numpy.int32)[:, numpy.newaxis]
+        stripe = numpy.empty((len(y), width, 3), numpy.uint8)
+        stripe[:, :, 0] = (x * 255 // width + random.randint(0, 8, (len(y), width))) & 0xFF
+        stripe[:, :, 1] = (y * 255 // height + (x >> 3 ^ y >> 3) % 32) & 0xFF
+        stripe[:, :, 2] = (x + y) >> 4 & 0xFF
+        arrayA[top:top + len(y)] = stripe
+
+        # a changed block: brighter by a little
+        rows = slice(max(changedRows.start - top, 0), max(min(changedRows.stop - top, len(y)), 0))
+        stripe[rows, changedColumns] = numpy.minimum(stripe[rows, changedColumns].astype(numpy.int32) + 16, 255)
+        arrayB[top:top + len(y)] = stripe
+
+    arrayA.flush()
+    arrayB.flush()
+    return pathA, pathB
+
+## Write an .npy image as a PNG file, for measuring decoding
+#  @param npyPath The path to the .npy file.
+#  @return The path to the PNG file.
+def writePng(npyPath):
+    pngPath = os.path.splitext(npyPath)[0] + '.png'
+    if not mapped_image.arrayToQImage(mapped_image.mapImage(npyPath)).save(pngPath, 'PNG'):
+        raise IOError("could not write " + pngPath)
+    return pngPath
+
+## Peak resident memory of this process so far, in megabytes
+#  @return The peak, or None where it cannot be measured.
+def peakMemory():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    if sys.platform == 'darwin':
+        peak /= 1024.0
+    return peak / 1024.0
+
+## Time a function call
+#  @param function The function.
+#  @param args The arguments.
+#  @return The time in milliseconds, and the result.
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return (time.perf_counter() - start) * 1000.0, result
+
+## Benchmarks
+#
+#  Runs each measurement on one comparison dialog, as the user would see it, and collects metrics.
+#  Metric names are prefixed with the image size, e.g. "16mp.decode_ms".
+class Benchmark(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param workDir Directory for the synthetic images.
+    #  @param frames Number of frames per pan and zoom measurement.
+    def __init__(self, workDir, frames=kDefaultFrames):
+        self.workDir = workDir
+        self.frames = frames
+        self.metrics = {}
+        self.failures = {}
+
+        # the application must exist before any image or widget is made
+        self.app = QtGui.QApplication.instance() or QtGui.QApplication(sys.argv[:1])
+        self.dialog = QtGui.QDialog()
+        self.ui = image_comparator.Ui_Dialog()
+        self.ui.setupUi(self.dialog)
+        self.dialog.show()
+        self.app.processEvents()
+
+        # done
+
+    ## Record one metric
+    #  @param self The object pointer.
+    #  @param name The name of the metric.
+    #  @param value The measured value.
+    #  @param better "lower" or "higher".
+    #  @param note Extra information, e.g. how it was measured.
+    def record(self, name, value, better="lower", note=None):
+        if value is None:
+            return
+        self.metrics[name] = {'value': round(float(value), 3), 'better': better}
+        if note is not None:
+            self.metrics[name]['note'] = note
+
+        # done
+
+    ## Run all measurements for one image size
+    #  Sizes should be run from small to large, so that the peak memory belongs to the largest size so far.
+    #  @param self The object pointer.
+    #  @param megapixels The size of the images, in millions of pixels.
+    def run(self, megapixels):
+        prefix = str(megapixels) + 'mp.'
+        pathA, pathB = writeSyntheticPair(self.workDir, megapixels)
+        pngPath = writePng(pathA) if megapixels <= kMaxPngMegapixels else None
+
+        self.measureLoading(prefix, pathA, pngPath)
+        self.measureFirstPaint(prefix, pngPath or pathA, pathB)
+        self.measureStartup(prefix, pngPath or pathA, pathB)
+        self.measureNavigation(prefix)
+        self.measureDifference(prefix, megapixels, pathA, pathB)
+        self.ui.clearAll(self.dialog)
+        self.record(prefix + 'peak_rss_mb', peakMemory())
+
+        # the files can be large
+        for path in (pathA, pathB, pngPath):
+            if path is not None:
+                os.remove(path)
+
+        # done
+
+    ## Decoding a PNG, and mapping an .npy file
+    #  @param self The object pointer.
+    #  @param prefix The metric name prefix.
+    #  @param npyPath The path to the .npy file.
+    #  @param pngPath The path to the PNG file, or None if there is none at this size.
+    def measureLoading(self, prefix, npyPath, pngPath):
+        if pngPath is not None:
+            elapsed, image = timed(decodeImage, pngPath)
+            self.record(prefix + 'decode_ms', elapsed)
+            del image
+        elapsed, array = timed(mapped_image.mapImage, npyPath)
+        self.record(prefix + 'map_ms', elapsed)
+
+        # done
+
+    ## Time from loading an image to its first frame on screen
+    #  @param self The object pointer.
+    #  @param prefix The metric name prefix.
+    #  @param pathA The image to load into the first view.
+    #  @param pathB The image to load into the second view.
+    def measureFirstPaint(self, prefix, pathA, pathB):
+        decodedImageCache.clear()
+        container = self.ui.containerViewFirstImage
+
+        start = time.perf_counter()
+        container.loadSceneForImage(pathA)
+        container.applyViewport()
+        container.viewport().repaint()
+        elapsed = (time.perf_counter() - start) * 1000.0
+        self.record(prefix + 'first_paint_ms', elapsed, note=os.path.splitext(pathA)[1][1:])
+
+        self.ui.containerViewSecondImage.loadSceneForImage(pathB)
+
+        # done
+
+    ## Time from starting the program with two images to the first frame showing them
+    #  The program is started as from the command line, in a process of its own, so that imports,
+    #  creating the window and decoding all count. The median of a few runs is recorded.
+    #  @param self The object pointer.
+    #  @param prefix The metric name prefix.
+    #  @param pathA The first image.
+    #  @param pathB The second image.
+    def measureStartup(self, prefix, pathA, pathB):
+        command = [sys.executable, os.path.abspath(image_comparator.__file__), pathA, pathB, '--report-first-paint']
+        elapsed = []
+        for run in range(kStartupRuns):
+            start = time.time()
+            try:
+                output = subprocess.check_output(command, stderr=subprocess.DEVNULL, timeout=kStartupTimeout)
+            except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as error:
+                sys.stderr.write("startup not measured: " + str(error) + "\n")
+                self.failures[prefix + 'startup_first_paint_ms'] = str(error)
+                return
+            elapsed.append((float(output.split()[-1]) - start) * 1000.0)
+        self.record(prefix + 'startup_first_paint_ms', numpy.median(elapsed), note=os.path.splitext(pathA)[1][1:])
+
+        # done
+
+    ## Latency of single frames while dragging and zooming both views
+    #  Each frame goes the way of mouse events: the pending change is applied to the viewport model,
+    #  which moves both views, and the visible views are painted.
+    #  @param self The object pointer.
+    #  @param prefix The metric name prefix.
+    def measureNavigation(self, prefix):
+        size = self.ui.containerViewFirstImage.imageSize
+        self.ui.viewportModel.reset()
+        self.ui.respondToPress(QtCore.QPointF(size.width() / 2.0, size.height() / 2.0))
+        self.frame()
+
+        # drag back and forth at 1:1
+        steps = [kPanStep if (frame // kPanFramesPerDirection) % 2 == 0 else -kPanStep for frame in range(self.frames)]
+        self.recordLatencies(prefix + 'pan', [self.frame(lambda step=step: self.ui.respondToPan(step, step / 2.0)) for step in steps])
+
+        # zoom out and in again, one wheel notch per frame
+        factors = [2.0 ** (kWheelDelta / 240.0)] * kZoomSteps + [2.0 ** (-kWheelDelta / 240.0)] * kZoomSteps
+        steps = [factors[frame % len(factors)] for frame in range(self.frames)]
+        self.recordLatencies(prefix + 'zoom', [self.frame(lambda step=step: self.ui.respondToWheel(step)) for step in steps])
+
+        # done
+
+    ## Apply one input event and paint the visible views
+    #  @param self The object pointer.
+    #  @param event Function delivering the input, or None.
+    #  @return The time taken, in milliseconds.
+    def frame(self, event=None):
+        scheduler = self.ui.syncScheduler
+        start = time.perf_counter()
+        if event is not None:
+            event()
+        scheduler.frameTimer.stop()
+        scheduler.applyPending()
+        for container in self.ui.imageContainers:
+            if container.isVisible():
+                container.viewport().repaint()
+        return (time.perf_counter() - start) * 1000.0
+
+    ## Record percentiles of frame times
+    #  @param self The object pointer.
+    #  @param name The metric name, without the percentile.
+    #  @param latencies The frame times, in milliseconds.
+    def recordLatencies(self, name, latencies):
+        for percentile in (50, 95, 99):
+            self.record(name + '_p' + str(percentile) + '_ms', numpy.percentile(latencies, percentile))
+        self.record(name + '_max_ms', max(latencies))
+
+        # done
+
+    ## Throughput of full-frame difference metrics
+    #  @param self The object pointer.
+    #  @param prefix The metric name prefix.
+    #  @param megapixels The size of the images, in millions of pixels.
+    #  @param pathA The path to the first .npy file.
+    #  @param pathB The path to the second .npy file.
+    def measureDifference(self, prefix, megapixels, pathA, pathB):
+        arrayA = mapped_image.mapImage(pathA)
+        arrayB = mapped_image.mapImage(pathB)
+        elapsed, metrics = timed(image_diff.computeMetrics, arrayA, arrayB)
+        self.record(prefix + 'diff_mpixels_per_s', megapixels / (elapsed / 1000.0), better="higher")
+        
+        # the same on all cores, once the worker processes are running
+        if parallel_diff is not None:
+            parallel_diff.getWorkerPool()
+            elapsed, metrics = timed(parallel_diff.parallelMetrics, arrayA, arrayB)
+            self.record(prefix + 'parallel_diff_mpixels_per_s', megapixels / (elapsed / 1000.0), better="higher")
+
+        # done
+
+## Where the benchmark ran, for telling results apart
+#  @param sizes The image sizes.
+#  @param frames The number of frames per measurement.
+def environment(sizes, frames):
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'machine': platform.machine(),
+            'cpus': os.cpu_count(), 'qt': QtCore.QT_VERSION_STR, 'numpy': numpy.__version__,
+            'qpa': os.environ.get('QT_QPA_PLATFORM'), 'sizes': list(sizes), 'frames': frames}
+
+## Compare results with a baseline
+#  A metric regresses when it is worse than the baseline by more than the tolerance.
+#  A metric of the baseline missing from this run fails too, e.g. when it could not be measured;
+#  new metrics are reported, but never fail the comparison.
+#  @param metrics The metrics of this run.
+#  @param baseline The metrics of the baseline run.
+#  @param tolerance Allowed relative change for the worse, e.g. 0.25 for 25 %.
+#  @return A list of (name, baseline value, value, relative change, status) and whether everything passed.
+def compareResults(metrics, baseline, tolerance=kDefaultTolerance):
+    rows = []
+    passed = True
+    for name in sorted(set(metrics) | set(baseline)):
+        if name not in baseline:
+            rows.append((name, None, metrics[name]['value'], None, "new"))
+            continue
+        if name not in metrics:
+            rows.append((name, baseline[name]['value'], None, None, "missing"))
+            passed = False
+            continue
+        value = metrics[name]['value']
+        reference = baseline[name]['value']
+        change = (value - reference) / reference if reference else 0.0
+        if metrics[name]['better'] == "higher":
+            regressed = value < reference * (1.0 - tolerance)
+        else:
+            regressed = value > reference * (1.0 + tolerance)
+        passed = passed and not regressed
+        rows.append((name, reference, value, change, "FAIL" if regressed else "ok"))
+    return rows, passed
+
+## Print a comparison table
+#  @param rows The rows returned by compareResults.
+#  @param stream The output stream.
+def printComparison(rows, stream):
+    for name, reference, value, change, status in rows:
+        columns = [name.ljust(32), '-' if reference is None else '%12.3f' % reference, '-' if value is None else '%12.3f' % value,
+                   '' if change is None else '%+7.1f%%' % (100.0 * change), status]
+        stream.write('  '.join(columns) + '\n')
+
+## Whether Qt can create its application here
+#  Qt 5 falls back to the offscreen platform set by main; Qt 4 on X11 needs a display.
+def hasDisplay():
+    if int(QtCore.QT_VERSION_STR.split('.')[0]) >= 5 or sys.platform in ('win32', 'darwin'):
+        return True
+    return bool(os.environ.get('DISPLAY'))
+
+## Command line entry point
+#  @param argv The arguments, without the program name.
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='image_comparator.py --benchmark', description="Measure loading, startup, painting, navigation and difference performance on synthetic images. Exit code 0: no regression against the baseline and startup within its budget, 1: regressions or metrics that could not be measured, 3: no display (Qt 4).")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in kDefaultSizes), help="image sizes in megapixels, comma separated (default: %(default)s)")
+    parser.add_argument('--frames', type=int, default=kDefaultFrames, help="frames per pan and zoom measurement (default: %(default)s)")
+    parser.add_argument('--output', '-o', help="result file (default: standard output)")
+    parser.add_argument('--baseline', help="result file of an earlier run to compare with")
+    parser.add_argument('--tolerance', type=float, default=kDefaultTolerance, help="allowed relative change for the worse (default: %(default)s)")
+    parser.add_argument('--work-dir', help="directory for the synthetic images (default: a temporary directory)")
+    parser.add_argument('--startup-budget', type=float, default=kStartupBudget, help="longest allowed startup to the first painted frame, at the smallest size, in ms (default: %(default)s)")
+    args = parser.parse_args(argv)
+    sizes = sorted(int(size) for size in args.sizes.split(','))
+
+    # no screen needed with Qt 5; set before the application is created
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    if not hasDisplay():
+        sys.stderr.write("The benchmark needs an X display with Qt " + QtCore.QT_VERSION_STR + ", which has no offscreen platform; run it under xvfb-run.\n")
+        return kExitNoDisplay
+
+    workDir = args.work_dir or tempfile.mkdtemp(prefix='image_comparator_benchmark_')
+    try:
+        benchmark = Benchmark(workDir, args.frames)
+        for megapixels in sizes:
+            sys.stderr.write("benchmarking " + str(megapixels) + " MP\n")
+            benchmark.run(megapixels)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    results = {'format': kResultFormat, 'environment': environment(sizes, args.frames), 'metrics': benchmark.metrics,
+               'failures': benchmark.failures}
+    if args.output:
+        with open(args.output, 'w') as stream:
+            json.dump(results, stream, indent=2, sort_keys=True)
+    else:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+
+    # the startup budget holds with or without a baseline
+    startup = benchmark.metrics.get(str(sizes[0]) + 'mp.startup_first_paint_ms')
+    passed = startup is not None and startup['value'] <= args.startup_budget
+    if startup is None:
+        sys.stderr.write("startup was not measured, so the budget of %.0f ms cannot be checked\n" % args.startup_budget)
+    elif not passed:
+        sys.stderr.write("startup took %.0f ms, over the budget of %.0f ms\n" % (startup['value'], args.startup_budget))
+
+    if args.baseline is None:
+        return kExitPassed if passed else kExitRegressed
+    with open(args.baseline) as stream:
+        baseline = json.load(stream)
+    rows, comparedPassed = compareResults(benchmark.metrics, baseline['metrics'], args.tolerance)
+    printComparison(rows, sys.stderr)
+    return kExitPassed if passed and comparedPassed else kExitRegressed
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# end
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  change_index.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Index of the areas where two images differ. Both images are split into tiles and each tile
+#  is hashed over its raw bytes; only tiles whose hashes differ are compared pixel by pixel.
+#  Neighbouring changed tiles are merged into one area, so navigation jumps from change to change.
+#
+
+# hashing
+import zlib
+
+# calculations
+import numpy
+
+# image helpers
+from image_diff import commonShape, differenceMask
+
+# constants
+kTileSize = 256
+
+## Whether two arrays are views of the same pixels, so that they cannot differ
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+def sameBuffer(arrayA, arrayB):
+    if arrayA.shape != arrayB.shape or arrayA.dtype != arrayB.dtype or arrayA.strides != arrayB.strides:
+        return False
+    return arrayA.__array_interface__['data'][0] == arrayB.__array_interface__['data'][0]
+
+## Hash of every tile of an image, over its raw bytes
+#  @param array The image array, height x width (x channels).
+#  @param tileSize Edge length of a tile, in pixels.
+#  @param height Height of the area to hash; the whole image by default.
+#  @param width Width of the area to hash; the whole image by default.
+#  @return A rows x columns array of CRC-32 values.
+def tileHashes(array, tileSize=kTileSize, height=None, width=None):
+    height = array.shape[0] if height is None else height
+    width = array.shape[1] if width is None else width
+    rows = -(-height // tileSize)
+    columns = -(-width // tileSize)
+    hashes = numpy.zeros((rows, columns), numpy.uint32)
+    for row in range(rows):
+        top = row * tileSize
+        for column in range(columns):
+            left = column * tileSize
+            tile = array[top:min(top + tileSize, height), left:min(left + tileSize, width)]
+            hashes[row, column] = zlib.crc32(numpy.ascontiguousarray(tile))
+    return hashes
+
+## Group neighbouring tiles (diagonals included) into connected areas
+#  @param tiles Set of (row, column) tuples.
+#  @return List of lists of (row, column), in reading order of their first tile.
+def connectedTiles(tiles):
+    remaining = set(tiles)
+    groups = []
+    for start in sorted(tiles):
+        if start not in remaining:
+            continue
+        remaining.discard(start)
+        group = [start]
+        pending = [start]
+        while pending:
+            row, column = pending.pop()
+            for neighbour in ((row + dy, column + dx) for dy in (-1, 0, 1) for dx in (-1, 0, 1)):
+                if neighbour in remaining:
+                    remaining.discard(neighbour)
+                    group.append(neighbour)
+                    pending.append(neighbour)
+        groups.append(group)
+    return groups
+
+## ChangeIndex
+#
+#  Areas where two images differ, as bounding rectangles of the differing pixels.
+#  Only the area covered by both images is compared.
+class ChangeIndex(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, arrayA, arrayB, tileSize=kTileSize):
+        self.tileSize = tileSize
+        self.height, self.width = commonShape(arrayA, arrayB)
+        self.tilesCompared = 0
+        self.regions = []
+
+        # the same pixels cannot differ: no work at all
+        if sameBuffer(arrayA, arrayB):
+            self.tileCount = 0
+            return
+
+        # identical tiles are skipped by their hashes
+        if arrayA.dtype == arrayB.dtype and arrayA.shape[2:] == arrayB.shape[2:]:
+            hashesA = tileHashes(arrayA, tileSize, self.height, self.width)
+            hashesB = tileHashes(arrayB, tileSize, self.height, self.width)
+            candidates = zip(*numpy.nonzero(hashesA != hashesB))
+        else:
+            candidates = numpy.ndindex(-(-self.height // tileSize), -(-self.width // tileSize))
+        self.tileCount = (-(-self.height // tileSize)) * (-(-self.width // tileSize))
+
+        # differing pixels of the remaining tiles
+        changed = {}
+        for row, column in candidates:
+            row, column = int(row), int(column)
+            top, left = row * tileSize, column * tileSize
+            bottom, right = min(top + tileSize, self.height), min(left + tileSize, self.width)
+            mask = differenceMask(arrayA[top:bottom, left:right], arrayB[top:bottom, left:right])
+            self.tilesCompared += 1
+            count = int(mask.sum())
+            if count:
+                rows = numpy.flatnonzero(mask.any(axis=1))
+                columns = numpy.flatnonzero(mask.any(axis=0))
+                changed[(row, column)] = (left + int(columns[0]), top + int(rows[0]), left + int(columns[-1]) + 1, top + int(rows[-1]) + 1, count)
+
+        # one area per group of neighbouring tiles
+        for group in connectedTiles(changed):
+            boxes = [changed[tile] for tile in group]
+            left = min(box[0] for box in boxes)
+            top = min(box[1] for box in boxes)
+            right = max(box[2] for box in boxes)
+            bottom = max(box[3] for box in boxes)
+            self.regions.append({'x': left, 'y': top, 'width': right - left, 'height': bottom - top, 'differingPixels': sum(box[4] for box in boxes)})
+
+        # done
+
+    ## Whether the compared areas are identical
+    #  @param self The object pointer.
+    def isIdentical(self):
+        return not self.regions
+
+    ## Number of areas that differ
+    #  @param self The object pointer.
+    def regionCount(self):
+        return len(self.regions)
+
+    ## One of the areas that differ, in reading order
+    #  @param self The object pointer.
+    #  @param index The position of the area; wraps around at both ends.
+    #  @return Dictionary with x, y, width, height and differingPixels.
+    def region(self, index):
+        return self.regions[index % len(self.regions)]
+
+# end
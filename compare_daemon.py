@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  compare_daemon.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Long-running headless comparison service. Recently used images stay decoded, and recently
+#  compared pairs keep their metrics and statistics tables, so repeated queries against the same
+#  golden images are answered without decoding or scanning again. Clients send JSON-RPC 2.0
+#  requests, one per line, over a local Unix socket; connections are served by a pool of threads.
+#
+
+# command line and service
+import argparse
+import base64
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# calculations
+import numpy
+
+# GUI classes, used without a screen for decoding
+from PyQt4 import QtGui
+
+# images, comparison and statistics
+import image_diff
+import mapped_image
+import region_stats
+from image_cache import cacheKey, decodedImageCache
+
+# constants
+kDefaultWorkers = 8
+kMaxPairs = 8
+kSocketEnvironment = 'IMAGE_COMPARATOR_SOCKET'
+kErrorParse = -32700
+kErrorInvalidRequest = -32600
+kErrorMethodNotFound = -32601
+kErrorInvalidParams = -32602
+kErrorServer = -32000
+
+## Path of the daemon's socket, unless one is given
+def defaultSocketPath():
+    return os.environ.get(kSocketEnvironment) or os.path.join(tempfile.gettempdir(), "image-comparator-" + str(os.getuid()) + ".sock")
+
+## DaemonError
+#
+#  An error to be reported to the client as a JSON-RPC error.
+class DaemonError(Exception):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param code The JSON-RPC error code.
+    #  @param message The error message.
+    def __init__(self, code, message):
+        super(DaemonError, self).__init__(message)
+        self.code = code
+
+## Pixels of an image file, kept decoded in the shared image cache
+#  Mappable files are mapped again on every call; the operating system keeps their pages.
+#  @param filePath The path to the image.
+#  @return The height x width (x channels) array, and the image that owns its memory (None for mapped files).
+def loadArray(filePath):
+    if mapped_image.isMappable(filePath):
+        try:
+            return mapped_image.mapImage(filePath), None
+        except (ValueError, IOError, OSError, KeyError):
+            # not something we can map; decode it instead
+            pass
+    image = decodedImageCache.get(filePath)
+    if image is None:
+        image = QtGui.QImageReader(filePath).read()
+        if image.isNull():
+            raise IOError("could not decode image: " + filePath)
+        # stored in the layout the arrays are viewed in, so that later views need no conversion
+        if image.format() != QtGui.QImage.Format_RGB32 and image.format() != QtGui.QImage.Format_ARGB32:
+            image = image.convertToFormat(QtGui.QImage.Format_RGB32)
+        decodedImageCache.put(filePath, image)
+    return mapped_image.qimageToArray(image)
+
+## ComparedPair
+#
+#  Two images and what has been computed about them so far; each result is computed once.
+class ComparedPair(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    #  @param owners The objects that own the memory of the arrays; kept even if the image cache drops them.
+    def __init__(self, arrayA, arrayB, owners=()):
+        self.arrayA = arrayA
+        self.arrayB = arrayB
+        self.owners = owners
+        self.height, self.width = image_diff.commonShape(arrayA, arrayB)
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self.regionStats = None
+
+        # done
+
+    ## Size and sample type of the pair
+    #  @param self The object pointer.
+    def describe(self):
+        return {'width': self.width, 'height': self.height, 'sizeMismatch': self.arrayA.shape[:2] != self.arrayB.shape[:2],
+                'channels': image_diff.colorChannels(self.arrayA[:1, :1]).shape[2], 'dtype': str(self.arrayA.dtype)}
+
+    ## Global difference metrics, computed once per threshold
+    #  @param self The object pointer.
+    #  @param threshold Largest difference still considered equal.
+    def globalMetrics(self, threshold):
+        with self.lock:
+            if threshold not in self.metrics:
+                self.metrics[threshold] = image_diff.computeMetrics(self.arrayA, self.arrayB, threshold)
+            return self.metrics[threshold]
+
+    ## Statistics of a rectangle, from tables built on first use
+    #  @param self The object pointer.
+    #  @param x Left edge, in image pixels.
+    #  @param y Top edge, in image pixels.
+    #  @param width Width, in image pixels.
+    #  @param height Height, in image pixels.
+    def statistics(self, x, y, width, height):
+        with self.lock:
+            if self.regionStats is None:
+                self.regionStats = region_stats.RegionStatistics(self.arrayA, self.arrayB)
+        return self.regionStats.regionStatistics(x, y, width, height)
+
+    ## Difference mask of a rectangle
+    #  @param self The object pointer.
+    #  @param x Left edge, in image pixels.
+    #  @param y Top edge, in image pixels.
+    #  @param width Width, in image pixels.
+    #  @param height Height, in image pixels.
+    #  @param threshold Largest difference still considered equal.
+    #  @return The rectangle used, the number and bounding box of differing pixels, and the mask as
+    #          base64 of its rows packed to bits (numpy.packbits, most significant bit first).
+    def differenceMask(self, x, y, width, height, threshold):
+        left, top = max(0, int(x)), max(0, int(y))
+        right, bottom = min(self.width, int(x + width)), min(self.height, int(y + height))
+        if right <= left or bottom <= top:
+            return None
+        mask = image_diff.differenceMask(self.arrayA[top:bottom, left:right], self.arrayB[top:bottom, left:right], threshold)
+        result = {'rect': [left, top, right - left, bottom - top], 'differingPixels': int(mask.sum()), 'bbox': None,
+                  'mask': base64.b64encode(numpy.packbits(mask, axis=1).tobytes()).decode('ascii')}
+        if result['differingPixels']:
+            rows = numpy.flatnonzero(mask.any(axis=1))
+            columns = numpy.flatnonzero(mask.any(axis=0))
+            result['bbox'] = [left + int(columns[0]), top + int(rows[0]), int(columns[-1] - columns[0]) + 1, int(rows[-1] - rows[0]) + 1]
+        return result
+
+## ComparisonService
+#
+#  Answers the requests; safe to call from several threads.
+#  Pairs are kept by file version, the least recently used are dropped first.
+class ComparisonService(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param maxPairs The number of pairs to keep.
+    def __init__(self, maxPairs=kMaxPairs):
+        self.maxPairs = maxPairs
+        self.pairs = OrderedDict()
+        self.lock = threading.Lock()
+        self.pairHits = 0
+        self.pairMisses = 0
+        self.methods = {
+            'loadPair': self.loadPair,
+            'metrics': self.metrics,
+            'regionStats': self.regionStats,
+            'diffMask': self.diffMask,
+            'cacheStatus': self.cacheStatus,
+        }
+
+        # done
+
+    ## The pair of two files, loaded on first use
+    #  @param self The object pointer.
+    #  @param imageA The path to the first image.
+    #  @param imageB The path to the second image.
+    #  @return The ComparedPair, and whether it was already loaded.
+    def pair(self, imageA, imageB):
+        keyA, keyB = cacheKey(imageA), cacheKey(imageB)
+        if keyA is None or keyB is None:
+            raise DaemonError(kErrorInvalidParams, "no such file: " + (imageA if keyA is None else imageB))
+        key = (keyA, keyB)
+        with self.lock:
+            pair = self.pairs.pop(key, None)
+            if pair is not None:
+                self.pairs[key] = pair
+                self.pairHits += 1
+                return pair, True
+            self.pairMisses += 1
+
+        # decoded outside the lock, so that other clients are not held up
+        arrayA, ownerA = loadArray(imageA)
+        arrayB, ownerB = loadArray(imageB)
+        pair = ComparedPair(arrayA, arrayB, (ownerA, ownerB))
+        with self.lock:
+            pair = self.pairs.setdefault(key, pair)
+            while len(self.pairs) > self.maxPairs:
+                self.pairs.popitem(last=False)
+        return pair, False
+
+    ## Load a pair ahead of the queries
+    #  @param self The object pointer.
+    #  @param imageA The path to the first image.
+    #  @param imageB The path to the second image.
+    def loadPair(self, imageA, imageB):
+        pair, cached = self.pair(imageA, imageB)
+        result = pair.describe()
+        result['cached'] = cached
+        return result
+
+    ## Global difference metrics of a pair
+    #  @param self The object pointer.
+    #  @param imageA The path to the first image.
+    #  @param imageB The path to the second image.
+    #  @param threshold Largest difference still considered equal.
+    def metrics(self, imageA, imageB, threshold=0):
+        return self.pair(imageA, imageB)[0].globalMetrics(threshold)
+
+    ## Statistics of both images and their difference over a rectangle
+    #  @param self The object pointer.
+    #  @param imageA The path to the first image.
+    #  @param imageB The path to the second image.
+    #  @param x Left edge, in pixels.
+    #  @param y Top edge, in pixels.
+    #  @param width Width, in pixels.
+    #  @param height Height, in pixels.
+    def regionStats(self, imageA, imageB, x, y, width, height):
+        return self.pair(imageA, imageB)[0].statistics(x, y, width, height)
+
+    ## Difference mask of a pair over a rectangle
+    #  @param self The object pointer.
+    #  @param imageA The path to the first image.
+    #  @param imageB The path to the second image.
+    #  @param x Left edge, in pixels.
+    #  @param y Top edge, in pixels.
+    #  @param width Width, in pixels.
+    #  @param height Height, in pixels.
+    #  @param threshold Largest difference still considered equal.
+    def diffMask(self, imageA, imageB, x, y, width, height, threshold=0):
+        return self.pair(imageA, imageB)[0].differenceMask(x, y, width, height, threshold)
+
+    ## Contents of the caches
+    #  @param self The object pointer.
+    def cacheStatus(self):
+        with self.lock:
+            pairs = {'entries': len(self.pairs), 'limit': self.maxPairs, 'hits': self.pairHits, 'misses': self.pairMisses}
+        return {'images': decodedImageCache.statistics(), 'pairs': pairs}
+
+    ## Answer one JSON-RPC request
+    #  @param self The object pointer.
+    #  @param line The request, as a line of JSON.
+    #  @return The response, as a dictionary; None for a notification.
+    def handle(self, line):
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return {'jsonrpc': '2.0', 'id': None, 'error': {'code': kErrorParse, 'message': str(error)}}
+
+        requestId = request.get('id') if isinstance(request, dict) else None
+        try:
+            if not isinstance(request, dict) or not isinstance(request.get('method'), str):
+                raise DaemonError(kErrorInvalidRequest, "expected an object with a method")
+            method = self.methods.get(request['method'])
+            if method is None:
+                raise DaemonError(kErrorMethodNotFound, "unknown method: " + request['method'])
+            params = request.get('params', {})
+            try:
+                result = method(*params) if isinstance(params, list) else method(**params)
+            except TypeError as error:
+                raise DaemonError(kErrorInvalidParams, str(error))
+        except DaemonError as error:
+            response = {'error': {'code': error.code, 'message': str(error)}}
+        except Exception as error:
+            # e.g. a file that cannot be decoded; the daemon keeps serving
+            response = {'error': {'code': kErrorServer, 'message': str(error)}}
+        else:
+            response = {'result': result}
+
+        if isinstance(request, dict) and 'id' not in request:
+            return None
+        response.update({'jsonrpc': '2.0', 'id': requestId})
+        return response
+
+    ## Answer the requests of one client until it disconnects
+    #  @param self The object pointer.
+    #  @param connection The client socket.
+    def serveConnection(self, connection):
+        with connection, connection.makefile('rwb') as stream:
+            for line in stream:
+                if not line.strip():
+                    continue
+                response = self.handle(line.decode('utf-8'))
+                if response is not None:
+                    stream.write(json.dumps(response).encode('utf-8') + b'\n')
+                    stream.flush()
+
+        # done
+
+## Open the listening socket, replacing a stale one left by a daemon that did not exit cleanly
+#  @param socketPath The path of the socket.
+#  @return The socket, or None if another daemon is answering on it.
+def listenOn(socketPath):
+    if os.path.exists(socketPath):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(socketPath)
+            return None
+        except socket.error:
+            os.unlink(socketPath)
+        finally:
+            probe.close()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socketPath)
+    server.listen(socket.SOMAXCONN)
+    return server
+
+## Send one request to a running daemon
+#  @param method The method name.
+#  @param params The parameters, as a dictionary.
+#  @param socketPath The path of the socket.
+#  @return The result.
+def callDaemon(method, params=None, socketPath=None):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    with client, client.makefile('rwb') as stream:
+        client.connect(socketPath or defaultSocketPath())
+        stream.write(json.dumps({'jsonrpc': '2.0', 'id': 1, 'method': method, 'params': params or {}}).encode('utf-8') + b'\n')
+        stream.flush()
+        response = json.loads(stream.readline().decode('utf-8'))
+    if 'error' in response:
+        raise DaemonError(response['error']['code'], response['error']['message'])
+    return response['result']
+
+## Command line entry point
+#  @param argv The arguments, without the program name.
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='image_comparator.py --daemon', description="Serve comparisons of recently used images over a Unix socket, as JSON-RPC 2.0 (one request per line).")
+    parser.add_argument('--socket', default=defaultSocketPath(), help="path of the socket (default: $" + kSocketEnvironment + ", else in the temporary directory)")
+    parser.add_argument('--workers', type=int, default=kDefaultWorkers, help="number of clients served at the same time")
+    parser.add_argument('--pairs', type=int, default=kMaxPairs, help="number of compared pairs kept with their metrics and tables")
+    parser.add_argument('--cache-mb', type=int, default=None, help="memory for decoded images, in megabytes")
+    args = parser.parse_args(argv)
+
+    if args.cache_mb is not None:
+        decodedImageCache.setBudget(args.cache_mb * 1024 * 1024)
+    server = listenOn(args.socket)
+    if server is None:
+        sys.stderr.write("another daemon is listening on " + args.socket + "\n")
+        return 1
+
+    # stopped with Ctrl+C or a termination signal, the socket is removed
+    signal.signal(signal.SIGTERM, lambda signalNumber, frame: sys.exit(0))
+    service = ComparisonService(args.pairs)
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    sys.stderr.write("listening on " + args.socket + "\n")
+    try:
+        while True:
+            connection, address = server.accept()
+            pool.submit(service.serveConnection, connection)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        os.unlink(args.socket)
+        pool.shutdown(wait=False)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# end
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  histogram_stats.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Per-channel histograms of an image, or of the absolute difference of two images, for the
+#  whole image or any rectangle. The image is binned once, one stripe of tiles at a time, into a
+#  histogram per tile; a rectangle is answered from a summed-area table over the tiles, so only
+#  the histograms are added up, never the pixels.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# calculations
+import numpy
+
+# image helpers
+from image_diff import absoluteDifference, colorChannels, commonShape
+from tone_mapping import autoWindow
+
+# constants
+kHistogramBits = 8
+kHistogramBins = 1 << kHistogramBits
+kTileSize = 256
+kPercentiles = (1, 50, 99)
+kPlotWidth = kHistogramBins
+kPlotHeight = 64
+kPanelSpacing = 6
+kChannelColors = (QtGui.QColor(255, 80, 80), QtGui.QColor(80, 255, 80), QtGui.QColor(100, 140, 255))
+kCumulativeColor = QtGui.QColor(255, 255, 255, 160)
+
+## Range of values covered by the bins of an image's histogram
+#  Integer samples get a power-of-two range, so that every bin covers the same number of values;
+#  floating point samples get the range of values in the image.
+#  @param array The image array.
+#  @return (low, high); values are binned over [low, high).
+def histogramRange(array):
+    if array.dtype.kind == 'u':
+        # e.g. 12-bit data stored in 16-bit samples uses the bins for 12 bits;
+        # the largest value of all pixels, as a sample of them could miss the brightest
+        largest = int(array.max()) if array.size else 0
+        high = 1 << max(8, largest.bit_length())
+        return 0, min(high, int(numpy.iinfo(array.dtype).max) + 1)
+    if array.dtype.kind == 'i':
+        return int(numpy.iinfo(array.dtype).min), int(numpy.iinfo(array.dtype).max) + 1
+    low, high = autoWindow(array)
+    return low, high + (high - low) / (kHistogramBins - 1)
+
+## Bin of every sample of one channel
+#  @param plane The samples, height x width.
+#  @param low The lowest value of the first bin.
+#  @param high The end of the last bin; larger values go to the last bin.
+def binIndices(plane, low, high):
+    span = high - low
+    if plane.dtype.kind == 'u' and low == 0 and span & (span - 1) == 0:
+        # power-of-two ranges are binned by a shift
+        return numpy.minimum(plane >> (span.bit_length() - 1 - kHistogramBits), kHistogramBins - 1).astype(numpy.intp)
+    if plane.dtype.kind in 'ui':
+        bins = (plane.astype(numpy.int64) - low) * kHistogramBins // int(span)
+    else:
+        bins = numpy.nan_to_num((plane.astype(numpy.float32) - numpy.float32(low)) * numpy.float32(kHistogramBins / span), nan=0.0)
+    return numpy.clip(bins, 0, kHistogramBins - 1).astype(numpy.intp)
+
+## HistogramIndex
+#
+#  Per-channel histograms over tiles of an image, or of the absolute difference of two images.
+class HistogramIndex(object):
+    ## The constructor. Building the index takes one pass over the image(s).
+    #  @param self The object pointer.
+    #  @param array The image array.
+    #  @param arrayB If given, the index is of the absolute difference from array, over the area both cover.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, array, arrayB=None, tileSize=kTileSize):
+        self.tileSize = tileSize
+        if arrayB is None:
+            self.height, self.width = array.shape[:2]
+            self.low, self.high = histogramRange(array)
+        else:
+            self.height, self.width = commonShape(array, arrayB)
+            rangeA, rangeB = histogramRange(array), histogramRange(arrayB)
+            self.low = 0
+            self.high = max(rangeA[1] - rangeA[0], rangeB[1] - rangeB[0])
+        self.channels = colorChannels(array[:1, :1]).shape[2]
+        # the largest value in a bin of integers is one less than the start of the next bin
+        self.step = 1 if array.dtype.kind in 'ui' and (arrayB is None or arrayB.dtype.kind in 'ui') else 0
+
+        # histograms of the tiles, one stripe of tile rows at a time
+        rows = -(-self.height // tileSize)
+        columns = -(-self.width // tileSize)
+        tileOffsets = (numpy.arange(self.width) // tileSize * kHistogramBins)[numpy.newaxis, :]
+        tiles = numpy.zeros((rows, columns, self.channels, kHistogramBins), numpy.int64)
+        for row in range(rows):
+            stripe = slice(row * tileSize, min((row + 1) * tileSize, self.height))
+            if arrayB is None:
+                region = colorChannels(array[stripe])
+            else:
+                region = absoluteDifference(array[stripe, :self.width], arrayB[stripe, :self.width])
+            for channel in range(self.channels):
+                bins = binIndices(region[:, :, channel], self.low, self.high)
+                counts = numpy.bincount((bins + tileOffsets).ravel(), minlength=columns * kHistogramBins)
+                tiles[row, :, channel] = counts.reshape(columns, kHistogramBins)
+
+        # summed-area table over the tiles
+        self.table = numpy.zeros((rows + 1, columns + 1, self.channels, kHistogramBins), numpy.int64)
+        numpy.cumsum(tiles, axis=0, out=self.table[1:, 1:])
+        numpy.cumsum(self.table[1:, 1:], axis=1, out=self.table[1:, 1:])
+
+        # done
+
+    ## Histograms over a rectangle, snapped outwards to whole tiles
+    #  @param self The object pointer.
+    #  @param rect The rectangle (QRectF), in pixels of the image; None for the whole image.
+    #  @return A channels x kHistogramBins array of counts, or None if the rectangle is outside the image.
+    def histogram(self, rect=None):
+        if rect is None:
+            return self.table[-1, -1]
+        left = max(0, int(rect.left()) // self.tileSize)
+        top = max(0, int(rect.top()) // self.tileSize)
+        right = min(self.table.shape[1] - 1, -(-int(rect.right()) // self.tileSize))
+        bottom = min(self.table.shape[0] - 1, -(-int(rect.bottom()) // self.tileSize))
+        if right <= left or bottom <= top:
+            return None
+        table = self.table
+        return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+    ## Value at the start of each bin
+    #  @param self The object pointer.
+    def binEdges(self):
+        return self.low + numpy.arange(kHistogramBins + 1) * (float(self.high - self.low) / kHistogramBins)
+
+    ## Per-channel statistics of a histogram, to the resolution of the bins
+    #  @param self The object pointer.
+    #  @param histogram A channels x kHistogramBins array of counts.
+    #  @return Dictionary with the pixel count, and per channel lists of mean, min, max and the kPercentiles.
+    def statistics(self, histogram):
+        edges = self.binEdges()
+        centers = edges[:-1] + (edges[1] - edges[0] - self.step) / 2.0
+        count = int(histogram[0].sum())
+        stats = {'count': count, 'mean': [], 'min': [], 'max': [], 'percentiles': []}
+        if count == 0:
+            return stats
+        cumulative = numpy.cumsum(histogram, axis=1)
+        for channel in range(histogram.shape[0]):
+            filled = numpy.flatnonzero(histogram[channel])
+            stats['mean'].append(float(numpy.dot(histogram[channel], centers)) / count)
+            stats['min'].append(float(edges[filled[0]]))
+            stats['max'].append(float(edges[filled[-1] + 1]) - self.step)
+            stats['percentiles'].append([float(edges[numpy.searchsorted(cumulative[channel], count * percentile / 100.0) + 1]) - self.step for percentile in kPercentiles])
+        return stats
+
+## Statistics as text, one line per channel
+#  @param stats Dictionary returned by HistogramIndex.statistics.
+def formatStatistics(stats):
+    if stats['count'] == 0:
+        return "no pixels"
+    lines = []
+    for channel in range(len(stats['mean'])):
+        line = ("RGB"[channel] + ": " if len(stats['mean']) == 3 else "") + "mean %.4g, min %.4g, max %.4g" % (stats['mean'][channel], stats['min'][channel], stats['max'][channel])
+        line += ", " + ", ".join("p%d %.4g" % (percentile, value) for percentile, value in zip(kPercentiles, stats['percentiles'][channel]))
+        lines.append(line)
+    return '\n'.join(lines)
+
+## HistogramPlot
+#
+#  Per-channel histograms, scaled to their highest bin, with the cumulative histogram over them.
+class HistogramPlot(QtGui.QWidget):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The parent widget.
+    def __init__(self, parent=None):
+        super(HistogramPlot, self).__init__(parent)
+        self.setFixedSize(kPlotWidth, kPlotHeight)
+        self.histogram = None
+
+        # done
+
+    ## Show another histogram
+    #  @param self The object pointer.
+    #  @param histogram A channels x kHistogramBins array of counts, or None.
+    def setHistogram(self, histogram):
+        self.histogram = histogram
+        self.update()
+
+        # done
+
+    ## Draw the histograms as lines, one per channel
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        if self.histogram is not None and self.histogram.sum() > 0:
+            height = kPlotHeight - 1
+            counts = self.histogram.astype(numpy.float64)
+            scale = height / max(1.0, counts.max())
+            xs = numpy.arange(kHistogramBins) * (kPlotWidth / float(kHistogramBins))
+            channels = counts.shape[0]
+            for channel in range(channels):
+                painter.setPen(kChannelColors[channel] if channels == 3 else QtCore.Qt.white)
+                ys = height - counts[channel] * scale
+                painter.drawPolyline(QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in zip(xs, ys)]))
+
+            # cumulative histogram of all channels, 0 to 1
+            cumulative = numpy.cumsum(counts.sum(axis=0))
+            ys = height - cumulative * (height / cumulative[-1])
+            painter.setPen(QtGui.QPen(kCumulativeColor, 1, QtCore.Qt.DashLine))
+            painter.drawPolyline(QtGui.QPolygonF([QtCore.QPointF(x, y) for x, y in zip(xs, ys)]))
+        painter.end()
+
+        # done
+
+## HistogramPanel
+#
+#  Semi-transparent panel with the histograms and statistics of the images and their difference,
+#  over the whole images or over the visible area.
+class HistogramPanel(QtGui.QFrame):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The dialog to show the panel on.
+    def __init__(self, parent=None):
+        super(HistogramPanel, self).__init__(parent)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QFrame { background-color: rgba(0, 0, 0, 160); } QLabel { color: white; font-family: monospace; }")
+        self.layout = QtGui.QVBoxLayout(self)
+        self.layout.setContentsMargins(kPanelSpacing, kPanelSpacing, kPanelSpacing, kPanelSpacing)
+        self.rows = []
+        self.setVisible(False)
+
+        # the whole images, until switched to the visible area
+        self.visibleOnly = False
+
+        # done
+
+    ## Show the histograms of some images
+    #  @param self The object pointer.
+    #  @param entries Sequence of (name, HistogramIndex, rect); rect is None for the whole image,
+    #         and the index is None while it is being built.
+    def showHistograms(self, entries):
+        # one title, plot and statistics per entry
+        while len(self.rows) < len(entries):
+            title, plot, text = QtGui.QLabel(self), HistogramPlot(self), QtGui.QLabel(self)
+            for widget in (title, plot, text):
+                self.layout.addWidget(widget)
+            self.rows.append((title, plot, text))
+        for index, (title, plot, text) in enumerate(self.rows):
+            shown = index < len(entries)
+            for widget in (title, plot, text):
+                widget.setVisible(shown)
+            if not shown:
+                continue
+            name, histogramIndex, rect = entries[index]
+            histogram = histogramIndex.histogram(rect) if histogramIndex is not None else None
+            title.setText(name + (" (visible area)" if rect is not None else ""))
+            plot.setHistogram(histogram)
+            if histogramIndex is None:
+                text.setText("computing...")
+            elif histogram is None:
+                text.setText("not visible")
+            else:
+                text.setText(formatStatistics(histogramIndex.statistics(histogram)))
+        self.adjustSize()
+        self.raise_()
+
+        # done
+
+# end
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  image_cache.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# file handling
+import os
+import threading
+from collections import OrderedDict
+
+# constants
+kDefaultCacheBudget = 1024 * 1024 * 1024
+
+# directory of the on-disk pyramid cache (see pyramid_cache.py); the cache is off when it is not set
+kPyramidCacheVariable = 'IMAGE_COMPARATOR_PYRAMID_CACHE'
+
+# decoded images this large are kept in shared memory (see parallel_diff.py)
+kSharedPixelThreshold = 16 * 1024 * 1024
+
+# files memory-mapped rather than decoded (see mapped_image.py); decided before NumPy is imported
+kMappedExtensions = ('.npy', '.raw', '.tif', '.tiff')
+
+## Whether a file can be memory-mapped, judging by its extension
+#  @param filePath The path to the file.
+def isMappable(filePath):
+    return os.path.splitext(filePath)[1].lower() in kMappedExtensions
+
+## Key identifying a file version: absolute path, size and modification time
+#  @param filePath The path to the file.
+#  @return The key, or None if the file cannot be accessed.
+def cacheKey(filePath):
+    filePath = os.path.abspath(filePath)
+    try:
+        status = os.stat(filePath)
+    except OSError:
+        return None
+    return (filePath, status.st_size, status.st_mtime)
+
+## DecodedImageCache
+#
+#  Keeps recently decoded images (QImage) in memory, within a byte budget.
+#  The least recently used images are evicted first. Safe to use from worker threads.
+class DecodedImageCache(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param budget The maximum number of bytes of image data to keep.
+    def __init__(self, budget=kDefaultCacheBudget):
+        self.budget = budget
+        self.images = OrderedDict()
+        self.usedBytes = 0
+        self.lock = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        # done
+
+    ## Cached image for a file, if the same version was decoded before
+    #  @param self The object pointer.
+    #  @param filePath The path to the file.
+    #  @return The QImage, or None.
+    def get(self, filePath):
+        key = cacheKey(filePath)
+        with self.lock:
+            image = self.images.pop(key, None) if key is not None else None
+            if image is None:
+                self.misses += 1
+                return None
+            # most recently used goes to the end
+            self.images[key] = image
+            self.hits += 1
+            return image
+
+    ## Store a decoded image
+    #  Images larger than the whole budget are not stored.
+    #  @param self The object pointer.
+    #  @param filePath The path to the file.
+    #  @param image The decoded QImage.
+    def put(self, filePath, image):
+        key = cacheKey(filePath)
+        size = image.byteCount()
+        if key is None or image.isNull() or size > self.budget:
+            return
+        with self.lock:
+            previous = self.images.pop(key, None)
+            if previous is not None:
+                self.usedBytes -= previous.byteCount()
+            self.images[key] = image
+            self.usedBytes += size
+            self.evict()
+
+        # done
+
+    ## Drop least recently used images until the budget is met; call with the lock held
+    #  @param self The object pointer.
+    def evict(self):
+        while self.usedBytes > self.budget and self.images:
+            key, image = self.images.popitem(last=False)
+            self.usedBytes -= image.byteCount()
+            self.evictions += 1
+
+        # done
+
+    ## Change the byte budget
+    #  @param self The object pointer.
+    #  @param budget The maximum number of bytes of image data to keep.
+    def setBudget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self.evict()
+
+        # done
+
+    ## Remove all images
+    #  @param self The object pointer.
+    def clear(self):
+        with self.lock:
+            self.images.clear()
+            self.usedBytes = 0
+
+        # done
+
+    ## Counters and memory use
+    #  @param self The object pointer.
+    def statistics(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self.images), 'bytes': self.usedBytes, 'budget': self.budget}
+
+    ## Counters and memory use, for display
+    #  @param self The object pointer.
+    def formatStatistics(self):
+        stats = self.statistics()
+        return ("image cache: " + str(stats['entries']) + " images, " + str(stats['bytes'] // (1024 * 1024)) + " of " + str(stats['budget'] // (1024 * 1024)) + " MB; "
+                + str(stats['hits']) + " hits, " + str(stats['misses']) + " misses, " + str(stats['evictions']) + " evictions")
+
+## The cache shared by all image containers
+decodedImageCache = DecodedImageCache()
+
+# end
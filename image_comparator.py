@@ -12,9 +12,60 @@
 # GUI
 from PyQt4 import QtGui, QtCore
 import os
+import math
+
+# command line
+import argparse
+import sys
+import time
 
 # cusnot class for graphics view
-from image_container import ImageContainerView
+from image_container import ImageContainerView, kScaleFactorMin, kScaleFactorMax
+
+# ways of compositing the overlay layout
+from image_overlay import kOverlayModes, kFlickerInterval
+
+# optional subsystems, imported when first used so that the window comes up without waiting for NumPy
+from lazy_import import lazyImport
+
+# optional: difference view, statistics, alignment, the change index and high bit depth display need NumPy
+image_diff = lazyImport('image_diff', 'numpy')
+region_stats = lazyImport('region_stats', 'numpy')
+image_registration = lazyImport('image_registration', 'numpy')
+change_index = lazyImport('change_index', 'numpy')
+tone_mapping = lazyImport('tone_mapping', 'numpy')
+
+# optional: the pixel inspector reads the image arrays, with NumPy
+pixel_inspector = lazyImport('pixel_inspector', 'numpy')
+
+# optional: full-frame comparison on all cores needs shared memory (Python 3.8)
+parallel_diff = lazyImport('parallel_diff', 'numpy')
+
+# optional: histograms of the images and their difference are built with NumPy
+histogram_stats = lazyImport('histogram_stats', 'numpy')
+
+# optional: the difference of every frame of a sequence is measured with NumPy
+sequence_compare = lazyImport('sequence_compare', 'numpy')
+
+# optional: structural similarity (SSIM, MS-SSIM) of the pair is computed with NumPy
+structural_similarity = lazyImport('structural_similarity', 'numpy')
+
+# long computations
+from background_task import startBackgroundTask
+
+# applying navigation once per frame, to a viewport shared by all views
+from view_sync import SyncScheduler
+from viewport_model import ViewportModel
+
+# recently decoded images
+from image_cache import decodedImageCache, isMappable
+from image_loader import decodeImageCached
+
+# stepping through many pairs
+from pair_playlist import PairPlaylist
+
+# timings of the hot paths
+from instrumentation import FirstPaintProbe, InstrumentationHud, traced, tracer
 
 # UI layout constants
 kMenuBarHeight = 40
@@ -27,12 +78,31 @@ kControlSpacing = 10
 kLabelIndent = 40
 kLabelHeight = 30
 kLayoutGroupWidth = 250
+kMaxImages = 9
+kDifferenceTag = -2
+kOverlayTag = -3
+kBlendSteps = 100
+kWindowDragPixels = 200.0
+
+# layouts that can be chosen on the command line
+kLayoutOptions = {'side-by-side': "Side-by-side", 'overlay': "Overlay", 'difference': "Difference"}
 
 # messages
 kFilePathInitial = "No image selected"
 kInfoInitial = "Load two images of identical size, to compare them."
 kInfoSizeErrorTitle = "Image size mismatch"
 kInfoSizeError = "This program is designed to handle images of equal size. Image navigation may behave oddly. Do you want to continue?"
+kInfoLoading = "Loading..."
+kInfoLoadError = "Could not load the image"
+kInfoPlaylistTitle = "Select a playlist manifest (cancel to match files in two folders)"
+kInfoPlaylistEmpty = "No image pairs found."
+kInfoTraceSaved = "Trace saved to "
+kInfoAligning = "Aligning the images..."
+kInfoAligned = "Image 2 aligned: "
+kInfoAlignFailed = "Could not align the images; they are compared as they are."
+kInfoIdentical = "The images are identical."
+kInfoChanges = " differing areas (F3: next, Shift+F3: previous)"
+kInfoPairMetrics = "whole image: "
 kInfoBothLoaded = "Use mouse wheel to zoom-in/zoom-out either image.Click and drag to move the image around. The other image will mirror the movement so that you can compare fine details between the images."
 
 # handling Unicode characters
@@ -60,7 +130,7 @@ class Ui_Dialog(QtGui.QWidget):
         Dialog.setObjectName(_fromUtf8("Image Comparison Tool"))
         
         # get screen dimensitons for laying out the other controls
-        geometry = app.desktop().availableGeometry()
+        geometry = QtGui.QApplication.desktop().availableGeometry()
     
         # resize dialog to use all available space
         Dialog.resize(geometry.width(), geometry.height() - kMenuBarHeight)
@@ -84,6 +154,34 @@ class Ui_Dialog(QtGui.QWidget):
         self.containerViewSecondImage.setContainingDialog(self)
         self.containerViewSecondImage.tag = 1
         
+        # graphics view for the difference of the two, shown in its own layout
+        self.containerViewDifference = ImageContainerView(Dialog)
+        self.containerViewDifference.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing, self.containerWidthOverlay, self.containerHeight))
+        self.containerViewDifference.setObjectName(_fromUtf8("containerViewDifference"))
+        self.containerViewDifference.setContainingDialog(self)
+        self.containerViewDifference.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
+        self.containerViewDifference.tag = kDifferenceTag
+        self.containerViewDifference.setVisible(False)
+        
+        # graphics view that composites two images, for the overlay layout
+        self.containerViewOverlay = ImageContainerView(Dialog)
+        self.containerViewOverlay.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing, self.containerWidthOverlay, self.containerHeight))
+        self.containerViewOverlay.setObjectName(_fromUtf8("containerViewOverlay"))
+        self.containerViewOverlay.setContainingDialog(self)
+        self.containerViewOverlay.tag = kOverlayTag
+        self.containerViewOverlay.setVisible(False)
+        
+        # all image views, in order; more can be added for an N-way comparison
+        self.imageContainers = [self.containerViewFirstImage, self.containerViewSecondImage]
+        self.overlayIndex = 1
+        
+        # all views follow one viewport model, which navigation events update once per frame
+        self.viewportModel = ViewportModel(Dialog)
+        for container in self.imageContainers + [self.containerViewDifference, self.containerViewOverlay]:
+            container.setViewportModel(self.viewportModel)
+        self.syncScheduler = SyncScheduler(self.viewportModel, self.referenceView, self.updateInfo, Dialog)
+        self.dialog = Dialog
+        
         ## group box 1 for control inputs
         self.groupBox = QtGui.QGroupBox(Dialog)
         self.groupBox.setGeometry(QtCore.QRect(0, 0, self.containerWidth, kGroupBoxHeight))
@@ -126,9 +224,14 @@ class Ui_Dialog(QtGui.QWidget):
         self.label_4.setGeometry(QtCore.QRect(kButtonWidth + kControlSpacing + kDialogMargin, kLabelIndent, 481, kLabelHeight))
         self.label_4.setObjectName(_fromUtf8("label_4"))
         
+        # button for adding more images to compare
+        self.pushButton_5 = QtGui.QPushButton(self.groupBox2)
+        self.pushButton_5.setGeometry(QtCore.QRect(self.containerWidth - kButtonWidth - kDialogMargin, kControlSpacing, kButtonWidth, kButtonHeight))
+        self.pushButton_5.setObjectName(_fromUtf8("pushButton_5"))
+        
         # selection info and hints
         infoLabelTop = geometry.height() - kDialogMargin - kButtonHeight - kMenuBarHeight
-        infoLabelWidth = geometry.width() - (kButtonWidth + kControlSpacing + kLayoutGroupWidth + 3*kDialogMargin)
+        infoLabelWidth = geometry.width() - (2*kButtonWidth + kControlSpacing + kLayoutGroupWidth + 4*kDialogMargin)
         
         self.label_5 = QtGui.QLabel(Dialog)
         self.label_5.setGeometry(QtCore.QRect(kDialogMargin, infoLabelTop, infoLabelWidth, kButtonHeight))
@@ -150,17 +253,93 @@ class Ui_Dialog(QtGui.QWidget):
         layoutRB = QtGui.QGridLayout()
         self.groupBoxLayout.setLayout(layoutRB)
 
+        # the buttons by layout, for choosing one from the command line
+        self.layoutButtons = {}
+
         radiobutton = QtGui.QRadioButton("Side-by-side")
         radiobutton.setChecked(True)
         radiobutton.layoutType = "Side-by-side"
         radiobutton.toggled.connect(self.radioButtonClicked)
         layoutRB.addWidget(radiobutton, 0, 0)
+        self.layoutButtons[radiobutton.layoutType] = radiobutton
 
         radiobutton = QtGui.QRadioButton("Overlay")
         radiobutton.layoutType = "Overlay"
         radiobutton.toggled.connect(self.radioButtonClicked)
         layoutRB.addWidget(radiobutton, 0, 1)
+        self.layoutButtons[radiobutton.layoutType] = radiobutton
 
+        if image_diff is not None:
+            radiobutton = QtGui.QRadioButton("Difference")
+            radiobutton.layoutType = "Difference"
+            radiobutton.toggled.connect(self.radioButtonClicked)
+            layoutRB.addWidget(radiobutton, 1, 0)
+            self.layoutButtons[radiobutton.layoutType] = radiobutton
+        
+        # opacity of the second image in the blended overlay
+        self.sliderBlend = QtGui.QSlider(QtCore.Qt.Horizontal)
+        self.sliderBlend.setRange(0, kBlendSteps)
+        self.sliderBlend.setValue(kBlendSteps // 2)
+        self.sliderBlend.setToolTip("Blend: opacity of the overlaid image")
+        self.sliderBlend.valueChanged.connect(lambda value: self.updateOverlay())
+        layoutRB.addWidget(self.sliderBlend, 1, 1)
+        
+        # alignment of shifted, cropped or scaled images
+        self.checkBoxAlign = QtGui.QCheckBox("Align")
+        self.checkBoxAlign.setEnabled(image_registration is not None)
+        self.checkBoxAlign.toggled.connect(lambda checked: self.startRegistration())
+        layoutRB.addWidget(self.checkBoxAlign, 2, 0)
+        self.checkBoxAlignScale = QtGui.QCheckBox("Scale")
+        self.checkBoxAlignScale.setEnabled(image_registration is not None)
+        self.checkBoxAlignScale.toggled.connect(lambda checked: self.checkBoxAlign.isChecked() and self.startRegistration())
+        layoutRB.addWidget(self.checkBoxAlignScale, 2, 1)
+        
+        # playlist button: step through a list of image pairs
+        self.pushButton_4 = QtGui.QPushButton(Dialog)
+        self.pushButton_4.setGeometry(QtCore.QRect(geometry.width() - 2*kDialogMargin - 2*kButtonWidth, infoLabelTop, kButtonWidth, kButtonHeight))
+        self.pushButton_4.setObjectName(_fromUtf8("pushButton_4"))
+        
+        # playlist navigation
+        for key in ("N", "PgDown"):
+            QtGui.QShortcut(QtGui.QKeySequence(key), Dialog, lambda: self.stepPlaylist(1))
+        for key in ("P", "PgUp"):
+            QtGui.QShortcut(QtGui.QKeySequence(key), Dialog, lambda: self.stepPlaylist(-1))
+        
+        # instrumentation: F12 shows recent timings and records spans, Ctrl+T saves them as a trace
+        self.hud = InstrumentationHud(Dialog, kGroupHeight + 2*kControlSpacing)
+        QtGui.QShortcut(QtGui.QKeySequence("F12"), Dialog, self.toggleInstrumentation)
+        QtGui.QShortcut(QtGui.QKeySequence("Ctrl+T"), Dialog, lambda: self.saveTrace(Dialog))
+        
+        # window of high bit depth images: W for the full range, Shift+W for the next tone curve, Ctrl+drag to adjust
+        QtGui.QShortcut(QtGui.QKeySequence("W"), Dialog, self.resetToneMap)
+        QtGui.QShortcut(QtGui.QKeySequence("Shift+W"), Dialog, self.cycleToneCurve)
+        
+        # pixels zoomed in far: G toggles a grid between them, Shift+G their values
+        self.pixelGrid = False
+        self.pixelLabels = False
+        QtGui.QShortcut(QtGui.QKeySequence("G"), Dialog, lambda: self.setPixelOverlays(not self.pixelGrid, self.pixelLabels))
+        QtGui.QShortcut(QtGui.QKeySequence("Shift+G"), Dialog, lambda: self.setPixelOverlays(self.pixelGrid, not self.pixelLabels))
+        
+        # the panels below are made when they are first shown, so their modules are imported only then
+        
+        # pixel under the mouse: I toggles the readout, L the loupe
+        self.pixelInspector = None
+        if pixel_inspector is not None:
+            QtGui.QShortcut(QtGui.QKeySequence("I"), Dialog, lambda: self.inspectorPanel().toggle())
+            QtGui.QShortcut(QtGui.QKeySequence("L"), Dialog, lambda: self.inspectorPanel().toggleLoupe())
+        
+        # histograms and statistics: H toggles the panel, Shift+H switches between whole images and the visible area
+        self.histogramPanel = None
+        if histogram_stats is not None:
+            QtGui.QShortcut(QtGui.QKeySequence("H"), Dialog, self.toggleHistograms)
+            QtGui.QShortcut(QtGui.QKeySequence("Shift+H"), Dialog, self.toggleHistogramArea)
+        
+        # difference of every pair of a playlist; a frame is chosen on it
+        self.sequenceTimeline = None
+        
+        # navigation between the areas where the images differ
+        QtGui.QShortcut(QtGui.QKeySequence("F3"), Dialog, lambda: self.stepChange(1))
+        QtGui.QShortcut(QtGui.QKeySequence("Shift+F3"), Dialog, lambda: self.stepChange(-1))
         
         # clear button: remove images and clean up everything
         self.pushButton_3 = QtGui.QPushButton(Dialog)
@@ -180,9 +359,56 @@ class Ui_Dialog(QtGui.QWidget):
         self.visibleRegion = None
         self.pixelUnderMouse = None
         
+        # playlist of image pairs
+        self.playlist = None
+        self.prefetching = set()
+        self.sequenceScan = None
+        
+        # statistics of the visible region, available once the tables are built
+        self.regionStats = None
+        self.regionStatsGeneration = 0
+        self.regionStatsOrigin = (0, 0)
+        
+        # difference metrics of the whole compared area
+        self.pairMetrics = None
+        self.pairMetricsError = None
+        self.pairMetricsGeneration = 0
+        self.pairMetricsOrigin = (0, 0)
+        
+        # structural similarity of the compared area: tiles are measured when the map shows them, the scores in the background
+        self.similarity = None
+        self.similarityScores = None
+        self.similarityError = None
+        self.similarityGeneration = 0
+        self.similarityOrigin = (0, 0)
+        
+        # areas where the compared images differ, and the one last visited
+        self.changeIndex = None
+        self.changeIndexGeneration = 0
+        self.changeIndexOrigin = (0, 0)
+        self.changeCursor = -1
+        
+        # arrays whose histograms are being built, by container; those of the difference are built from the compared pair
+        self.histogramSources = {}
+        self.histogramOrigin = (0, 0)
+        
+        # window and tone curve shared by all images of more than 8 bits per sample
+        self.toneMap = None
+        
+        # alignment of the images with the first one; the aligned parts of the first pair are compared
+        self.registrationGeneration = 0
+        self.alignedPair = None
+        
         # other UI settings
         self.workingDir = '../samples'
         self.imgLayout = "Side-by-side"
+        self.diffMode = "Absolute"
+        self.overlayMode = kOverlayModes[0]
+        
+        # the flicker overlay alternates between the images
+        self.flickerTimer = QtCore.QTimer(Dialog)
+        self.flickerTimer.setInterval(kFlickerInterval)
+        self.flickerTimer.timeout.connect(self.flickerOverlay)
         
         # apply selected layout to images
         self.layoutImages()
@@ -214,30 +440,122 @@ class Ui_Dialog(QtGui.QWidget):
         self.pushButton_3.setText(_translate("Dialog", "Clear", None))
         self.pushButton_3.setEnabled(False)
         
+        # playlist
+        self.pushButton_4.setText(_translate("Dialog", "Playlist", None))
+        
+        # more images
+        self.pushButton_5.setText(_translate("Dialog", "Add image", None))
+        self.pushButton_5.setEnabled(False)
+        
         # events
         self.pushButton.clicked.connect(lambda:self.setImage(Dialog, 0))
         self.pushButton_2.clicked.connect(lambda:self.setImage(Dialog, 1))
         self.pushButton_3.clicked.connect(lambda:self.clearAll(Dialog))
+        self.pushButton_4.clicked.connect(lambda:self.openPlaylist(Dialog))
+        self.pushButton_5.clicked.connect(lambda:self.addImage(Dialog))
     
         # done
     
     ## adjust the image containers according to the selected layout
     #  @param self The object pointer.
+    @traced("layout")
     def layoutImages(self):
-        if self.imgLayout == "Overlay":
-            # change the indicator label
-            self.label_6.setText(_translate("Dialog", "Layout (overlay: image 2)", None))
-            self.containerViewFirstImage.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing, self.containerWidthOverlay, self.containerHeight))
-            self.containerViewSecondImage.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing, self.containerWidthOverlay, self.containerHeight))
-        else:
+        # the difference and the overlay have views of their own
+        showDifference = self.imgLayout == "Difference"
+        self.containerViewDifference.setVisible(showDifference)
+        self.containerViewOverlay.setVisible(self.imgLayout == "Overlay")
+        self.sliderBlend.setEnabled(self.imgLayout == "Overlay" and self.overlayMode == "Blend")
+        
+        # the image views are shown side by side only; the overlay paints from them while they are hidden
+        count = len(self.imageContainers)
+        for index, container in enumerate(self.imageContainers):
+            container.setGeometry(self.gridGeometry(index, count))
+            container.setVisible(self.imgLayout == "Side-by-side")
+        
+        self.updateOverlay()
+        if showDifference:
+            self.updateDifference()
+        elif self.imgLayout == "Side-by-side":
             # change the indicator label
             self.label_6.setText(_translate("Dialog", "Layout", None))
-            self.containerViewFirstImage.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing, self.containerWidth, self.containerHeight))
-            self.containerViewSecondImage.setGeometry(QtCore.QRect(self.containerWidth + kDialogMargin + kControlSpacing, kGroupHeight + kControlSpacing, self.containerWidth, self.containerHeight))
         
         # done
+    
+    ## Geometry of an image container in the side-by-side grid
+    #  @param self The object pointer.
+    #  @param index The position of the container.
+    #  @param count The number of containers.
+    def gridGeometry(self, index, count):
+        columns = int(math.ceil(math.sqrt(count)))
+        rows = int(math.ceil(count / float(columns)))
+        cellWidth = (self.containerWidthOverlay - (columns - 1)*kControlSpacing) // columns
+        cellHeight = (self.containerHeight - (rows - 1)*kControlSpacing) // rows
+        row, column = divmod(index, columns)
+        return QtCore.QRect(int(kDialogMargin + column*(cellWidth + kControlSpacing)), int(kGroupHeight + kControlSpacing + row*(cellHeight + kControlSpacing)), int(cellWidth), int(cellHeight))
+    
+    ## Recompute the difference view for the loaded pair
+    #  Only the tiles that get painted are actually computed.
+    #  @param self The object pointer.
+    @traced("diff")
+    def updateDifference(self):
+        # change the indicator label
+        self.label_6.setText(_translate("Dialog", "Layout (difference: " + self.diffMode.lower() + ")", None))
+        
+        compared = self.comparedArrays()
+        if compared is None:
+            self.containerViewDifference.clearContainer()
+            return
+        arrayA, arrayB, origin = compared
+        
+        # the shared viewport says where to look; the difference starts at the origin of the compared area
+        if structural_similarity is not None and self.diffMode == structural_similarity.kSsimMode and self.similarity is not None:
+            self.containerViewDifference.showSimilarity(self.similarity)
+        else:
+            self.containerViewDifference.showDifference(arrayA, arrayB, self.diffMode)
+        self.containerViewDifference.setRegistration(image_registration.Registration(-origin[0], -origin[1]) if origin != (0, 0) else None)
+        
+        # done
+    
+    ## Composite the first image and the overlaid one, in the overlay layout
+    #  @param self The object pointer.
+    def updateOverlay(self):
+        if self.imgLayout != "Overlay":
+            self.flickerTimer.stop()
+            return
+        
+        # change the indicator label
+        self.label_6.setText(_translate("Dialog", "Layout (overlay: " + self.overlayMode.lower() + ", image " + str(self.overlayIndex + 1) + ")", None))
+        
+        overlayItem = self.containerViewOverlay.showOverlay(self.containerViewFirstImage, self.imageContainers[self.overlayIndex])
+        overlayItem.setMode(self.overlayMode)
+        overlayItem.setOpacity(self.sliderBlend.value() / float(kBlendSteps))
+        if self.overlayMode == "Flicker":
+            if not self.flickerTimer.isActive():
+                self.flickerTimer.start()
+        else:
+            self.flickerTimer.stop()
+        
+        # done
+    
+    ## Show the other image in the flicker overlay
+    #  @param self The object pointer.
+    def flickerOverlay(self):
+        if self.containerViewOverlay.overlayItem is not None:
+            self.containerViewOverlay.overlayItem.flicker()
+        
+        # done
+    
+    ## The view that navigation info is taken from
+    #  @param self The object pointer.
+    def referenceView(self):
+        if self.imgLayout == "Difference":
+            return self.containerViewDifference
+        if self.imgLayout == "Overlay":
+            return self.containerViewOverlay
+        return self.containerViewFirstImage
         
     ## set an image
+    #  The image is decoded in the background; respondToImageLoaded is called when it is ready.
     #  @param self The object pointer.
     #  @param Dialog The dialog pointer.
     #  @param imageId An integer tag indicating where the image should go to.
@@ -245,16 +563,40 @@ class Ui_Dialog(QtGui.QWidget):
         # get foldername from dialog
         imgFilename = QtGui.QFileDialog.getOpenFileName(Dialog, "Select the first image", self.workingDir)
         
+        # the dialog was canceled
+        if not imgFilename:
+            return
+        
         # set the working directory
         self.workingDir = os.path.dirname(os.path.abspath(imgFilename))        
         
-        if imageId == 0:
+        self.loadImage(imageId, imgFilename)
+        
+        # done
+    
+    ## Start loading an image into one of the containers
+    #  @param self The object pointer.
+    #  @param imageId An integer tag indicating where the image should go to.
+    #  @param imgFilename The path to the image.
+    @traced("load")
+    def loadImage(self, imageId, imgFilename):
+        if imageId >= 2:
+            # additional images only show their path and size as a tooltip
+            container = self.imageContainers[imageId]
+            container.setToolTip(imgFilename)
+            container.loadSceneForImageAsync(imgFilename)
+            container.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
+        
+        elif imageId == 0:
             # load the first image
             self.label.setText(imgFilename)
+            self.label_2.setText(_translate("Dialog", kInfoLoading, None))
+            self.imageSize = None
+            self.bothLoaded = False
+            self.startRegistration()
                 
             # set the scene
-            self.imageSize = self.containerViewFirstImage.loadSceneForImage(imgFilename)  
-            self.label_2.setText(str(self.imageSize.width()) + 'x' + str(self.imageSize.height()) + ' pixels')
+            self.containerViewFirstImage.loadSceneForImageAsync(imgFilename)
                 
             # this one can be dragged around
             self.containerViewFirstImage.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
@@ -265,55 +607,658 @@ class Ui_Dialog(QtGui.QWidget):
             # or clear everything
             self.pushButton_3.setEnabled(True)
             
-        else:
-            # we have to load the image first :-\
-            self.secondImageSize = self.containerViewSecondImage.loadSceneForImage(imgFilename)
-            
-            # complain if sizes are not identical
-            if self.secondImageSize.width() != self.imageSize.width() or self.secondImageSize.height() != self.imageSize.height():
-                # size mismatch
-                
-                # if the dialog was canceled, size would be [0,0]
-                if self.secondImageSize.width() == 0 and self.secondImageSize.height() == 0:
-                    # just quit
-                    return
-                else:
-                    # display warning
-                    msgBox = QtGui.QMessageBox( self )
-                    msgBox.setIcon( QtGui.QMessageBox.Information )
-                    msgBox.setText(kInfoSizeErrorTitle)
-    
-                    msgBox.setInformativeText(kInfoSizeError)
-                    msgBox.addButton( QtGui.QMessageBox.Yes )
-                    msgBox.addButton( QtGui.QMessageBox.No )
-    
-                    msgBox.setDefaultButton( QtGui.QMessageBox.No ) 
-                    ret = msgBox.exec_()
-    
-                    if ret == QtGui.QMessageBox.No:
-                        # clear the image and abandon
-                        self.containerViewSecondImage.clearContainer()
-                        self.second_image_size = None
-                        self.label_3.setText(_translate("Dialog", kFilePathInitial, None))
-                        self.label_4.setText(_translate("Dialog", "", None))
-                        self.bothLoaded = False
-                        self.secondImageSize = None
-                        self.roi = None
-            
-                        return
+            # or add more
+            self.pushButton_5.setEnabled(True)
             
-            # if we are here, we should keep the second image
+        else:
+            # load the second image
             self.label_3.setText(imgFilename)
-            self.label_4.setText(str(self.secondImageSize.width()) + 'x' + str(self.secondImageSize.height()) + ' pixels')
+            self.label_4.setText(_translate("Dialog", kInfoLoading, None))
+            self.secondImageSize = None
+            self.bothLoaded = False
+            self.startRegistration()
+            
+            # set the scene
+            self.containerViewSecondImage.loadSceneForImageAsync(imgFilename)
             
             # this too can be dragged around
             self.containerViewSecondImage.setDragMode(QtGui.QGraphicsView.ScrollHandDrag)
-            
-            # there must be two images available now
-            self.bothLoaded = True    
-            
-            # show relevant info
-            self.label_5.setText(kInfoBothLoaded)
+        
+        # done
+    
+    ## An image has been decoded in the background
+    #  @param self The object pointer.
+    #  @param imageId An integer tag indicating which image was loaded.
+    #  @param size The size of the image, empty if it could not be decoded.
+    @traced("load")
+    def respondToImageLoaded(self, imageId, size):
+        # cache counters are shown on the info label
+        self.label_5.setToolTip(decodedImageCache.formatStatistics())
+        
+        # the overlay covers the new image
+        self.containerViewOverlay.refreshOverlay()
+        
+        # images of more than 8 bits per sample are all shown through the same window
+        if 0 <= imageId < len(self.imageContainers):
+            toneMap = self.imageContainers[imageId].currentToneMap()
+            if toneMap is not None:
+                self.setToneMap(self.toneMap if self.toneMap is not None else toneMap)
+        
+        # histograms of the new image, if they are shown
+        self.startHistograms()
+        
+        if imageId >= 2:
+            container = self.imageContainers[imageId]
+            container.applyViewport()
+            container.setToolTip(container.imagePath + "\n" + str(size.width()) + 'x' + str(size.height()) + ' pixels')
+            if self.bothLoaded and image_registration is not None and self.checkBoxAlign.isChecked():
+                container.setRegistration(None)
+                self.startContainerRegistration(imageId)
+            elif self.imageSize is not None and size != self.imageSize:
+                self.label_5.setText(_translate("Dialog", kInfoSizeErrorTitle + " (image " + str(imageId + 1) + ")", None))
+            return
+        
+        if imageId == 0:
+            if size.isEmpty():
+                self.label_2.setText(_translate("Dialog", kInfoLoadError, None))
+                return
+            self.imageSize = size
+            self.label_2.setText(str(size.width()) + 'x' + str(size.height()) + ' pixels')
+            self.containerViewFirstImage.applyViewport()
+        else:
+            if size.isEmpty():
+                self.clearSecondImage()
+                self.label_4.setText(_translate("Dialog", kInfoLoadError, None))
+                return
+            self.secondImageSize = size
+            self.label_4.setText(str(size.width()) + 'x' + str(size.height()) + ' pixels')
+            self.containerViewSecondImage.applyViewport()
+        
+        # the sizes can be compared once both images are in
+        if self.imageSize is not None and self.secondImageSize is not None:
+            self.checkImageSizes()
+        
+        # done
+    
+    ## Compare the sizes of the two loaded images
+    #  Images of different sizes are aligned automatically when possible.
+    #  @param self The object pointer.
+    def checkImageSizes(self):
+        sizeMismatch = self.secondImageSize.width() != self.imageSize.width() or self.secondImageSize.height() != self.imageSize.height()
+        
+        # complain if sizes are not identical, and we cannot align them
+        if sizeMismatch and image_registration is None:
+            # display warning
+            msgBox = QtGui.QMessageBox( self )
+            msgBox.setIcon( QtGui.QMessageBox.Information )
+            msgBox.setText(kInfoSizeErrorTitle)
+
+            msgBox.setInformativeText(kInfoSizeError)
+            msgBox.addButton( QtGui.QMessageBox.Yes )
+            msgBox.addButton( QtGui.QMessageBox.No )
+
+            msgBox.setDefaultButton( QtGui.QMessageBox.No ) 
+            ret = msgBox.exec_()
+
+            if ret == QtGui.QMessageBox.No:
+                # clear the image and abandon
+                self.clearSecondImage()
+                return
+        
+        # there must be two images available now
+        self.bothLoaded = True    
+        
+        # show relevant info
+        self.label_5.setText(kInfoBothLoaded)
+        
+        # align (if asked to), then update the difference and prepare the statistics tables
+        if sizeMismatch and not self.checkBoxAlign.isChecked():
+            self.checkBoxAlign.setChecked(True)
+        else:
+            self.startRegistration()
+        
+        # done
+    
+    ## Align the images with the first one in the background, if alignment is on
+    #  Until the results are in, the images are shown and compared as they are.
+    #  @param self The object pointer.
+    def startRegistration(self):
+        # results for an earlier pair are of no use
+        self.registrationGeneration += 1
+        self.alignedPair = None
+        for container in self.imageContainers:
+            container.setRegistration(None)
+        self.containerViewOverlay.refreshOverlay()
+        
+        if image_registration is None or not self.bothLoaded or not self.checkBoxAlign.isChecked():
+            self.alignmentChanged()
+            return
+        
+        self.label_5.setText(_translate("Dialog", kInfoAligning, None))
+        for index in range(1, len(self.imageContainers)):
+            self.startContainerRegistration(index)
+        
+        # done
+    
+    ## Align one image with the first one in the background
+    #  @param self The object pointer.
+    #  @param index The position of the image container.
+    def startContainerRegistration(self, index):
+        arrayA = self.containerViewFirstImage.imageArray()
+        array = self.imageContainers[index].imageArray()
+        if arrayA is None or array is None:
+            return
+        
+        # the second image is also compared pixel by pixel, so its aligned part is prepared too
+        generation = self.registrationGeneration
+        withScale = self.checkBoxAlignScale.isChecked()
+        function = image_registration.registerAndAlign if index == 1 else image_registration.register
+        startBackgroundTask(function, (arrayA, array, withScale), lambda result: self.registrationReady(generation, index, result))
+        
+        # done
+    
+    ## An image has been aligned with the first one
+    #  @param self The object pointer.
+    #  @param generation The value of registrationGeneration when the alignment started.
+    #  @param index The position of the image container.
+    #  @param result The Registration; for the second image, also the aligned arrays.
+    def registrationReady(self, generation, index, result):
+        if generation != self.registrationGeneration or index >= len(self.imageContainers):
+            return
+        registration, alignedPair = result if index == 1 else (result, None)
+        if registration.confidence < image_registration.kMinPeak:
+            if index == 1:
+                self.label_5.setText(_translate("Dialog", kInfoAlignFailed, None))
+            return
+        
+        self.imageContainers[index].setRegistration(registration)
+        self.containerViewOverlay.refreshOverlay()
+        if index == 1:
+            self.alignedPair = alignedPair
+            self.label_5.setText(_translate("Dialog", kInfoAligned + registration.describe(), None))
+            self.alignmentChanged()
+        
+        # done
+    
+    ## Update everything that compares the two images pixel by pixel
+    #  @param self The object pointer.
+    def alignmentChanged(self):
+        self.startSimilarity()
+        if self.imgLayout == "Difference":
+            self.updateDifference()
+        self.startRegionStatistics()
+        self.startChangeIndex()
+        self.startPairMetrics()
+        
+        # the histograms of the difference are of the new pair
+        self.containerViewDifference.histogramIndex = None
+        self.histogramSources.pop(self.containerViewDifference, None)
+        self.startHistograms()
+        self.updateHistograms()
+        
+        # done
+    
+    ## The parts of the first two images that are compared pixel by pixel
+    #  @param self The object pointer.
+    #  @return The two arrays and the position of their area in the first image, or None.
+    def comparedArrays(self):
+        if not self.bothLoaded:
+            return None
+        if self.alignedPair is not None:
+            return self.alignedPair
+        arrayA = self.containerViewFirstImage.imageArray()
+        arrayB = self.containerViewSecondImage.imageArray()
+        if arrayA is None or arrayB is None:
+            return None
+        return arrayA, arrayB, (0, 0)
+    
+    ## Build the statistics tables for the loaded pair in the background
+    #  @param self The object pointer.
+    @traced("stats")
+    def startRegionStatistics(self):
+        # results for an earlier pair are of no use
+        self.regionStatsGeneration += 1
+        self.regionStats = None
+        compared = self.comparedArrays() if region_stats is not None else None
+        if compared is None:
+            return
+        arrayA, arrayB, self.regionStatsOrigin = compared
+        
+        generation = self.regionStatsGeneration
+        startBackgroundTask(region_stats.RegionStatistics, (arrayA, arrayB), lambda stats: self.regionStatisticsReady(generation, stats))
+        
+        # done
+    
+    ## The statistics tables have been built
+    #  @param self The object pointer.
+    #  @param generation The value of regionStatsGeneration when the build started.
+    #  @param stats The RegionStatistics.
+    def regionStatisticsReady(self, generation, stats):
+        if generation == self.regionStatsGeneration:
+            self.regionStats = stats
+            self.updateInfo()
+        
+        # done
+    
+    ## Compute the difference metrics of the whole compared area in the background
+    #  Large pairs are compared on all cores; the worker processes read the images in place.
+    #  @param self The object pointer.
+    def startPairMetrics(self):
+        # results for an earlier pair are of no use
+        self.pairMetricsGeneration += 1
+        self.pairMetrics = None
+        self.pairMetricsError = None
+        compared = self.comparedArrays() if image_diff is not None else None
+        if compared is None:
+            return
+        arrayA, arrayB, self.pairMetricsOrigin = compared
+        
+        generation = self.pairMetricsGeneration
+        if parallel_diff is not None:
+            startBackgroundTask(parallel_diff.parallelMetrics, (arrayA, arrayB), lambda metrics: self.pairMetricsReady(generation, metrics),
+                                lambda error: self.parallelMetricsFailed(generation, arrayA, arrayB))
+        else:
+            startBackgroundTask(image_diff.computeMetrics, (arrayA, arrayB), lambda metrics: self.pairMetricsReady(generation, metrics),
+                                lambda error: self.pairMetricsFailed(generation, error))
+        
+        # done
+    
+    ## The worker processes could not compute the metrics; compute them in this process instead
+    #  @param self The object pointer.
+    #  @param generation The value of pairMetricsGeneration when the computation started.
+    #  @param arrayA The first compared array.
+    #  @param arrayB The second compared array.
+    def parallelMetricsFailed(self, generation, arrayA, arrayB):
+        if generation == self.pairMetricsGeneration:
+            startBackgroundTask(image_diff.computeMetrics, (arrayA, arrayB), lambda metrics: self.pairMetricsReady(generation, metrics),
+                                lambda error: self.pairMetricsFailed(generation, error))
+        
+        # done
+    
+    ## The difference metrics of the whole compared area could not be computed
+    #  @param self The object pointer.
+    #  @param generation The value of pairMetricsGeneration when the computation started.
+    #  @param error The exception raised.
+    def pairMetricsFailed(self, generation, error):
+        if generation == self.pairMetricsGeneration:
+            self.pairMetricsError = str(error)
+            self.updateInfo()
+        
+        # done
+    
+    ## The difference metrics of the whole compared area have been computed
+    #  @param self The object pointer.
+    #  @param generation The value of pairMetricsGeneration when the computation started.
+    #  @param metrics The metrics dictionary, as image_diff.computeMetrics.
+    def pairMetricsReady(self, generation, metrics):
+        if generation == self.pairMetricsGeneration:
+            self.pairMetrics = metrics
+            self.updateInfo()
+        
+        # done
+    
+    ## Start measuring the structural similarity of the compared area
+    #  Tiles of the SSIM map are measured as they are shown; the scores of the whole area are computed
+    #  in the background, one stripe at a time, and fill in the tiles not seen yet.
+    #  @param self The object pointer.
+    def startSimilarity(self):
+        # results for an earlier pair are of no use
+        self.similarityGeneration += 1
+        if self.similarity is not None:
+            self.similarity.cancel()
+        self.similarity = None
+        self.similarityScores = None
+        self.similarityError = None
+        compared = self.comparedArrays() if structural_similarity is not None else None
+        if compared is None:
+            return
+        arrayA, arrayB, self.similarityOrigin = compared
+        self.similarity = structural_similarity.SimilarityIndex(arrayA, arrayB)
+        
+        generation = self.similarityGeneration
+        startBackgroundTask(self.similarity.computeGlobal, (), lambda scores: self.similarityReady(generation, scores),
+                            lambda error: self.similarityFailed(generation, error))
+        
+        # done
+    
+    ## The structural similarity of the whole compared area has been computed
+    #  @param self The object pointer.
+    #  @param generation The value of similarityGeneration when the computation started.
+    #  @param scores The scores, as structural_similarity.SimilarityIndex.computeGlobal.
+    def similarityReady(self, generation, scores):
+        if generation == self.similarityGeneration:
+            self.similarityScores = scores
+            self.updateInfo()
+        
+        # done
+    
+    ## The structural similarity of the whole compared area could not be computed
+    #  The tiles shown are still measured; only the scores of the whole area are missing.
+    #  @param self The object pointer.
+    #  @param generation The value of similarityGeneration when the computation started.
+    #  @param error The exception raised.
+    def similarityFailed(self, generation, error):
+        if generation == self.similarityGeneration:
+            self.similarityError = str(error)
+            self.updateInfo()
+        
+        # done
+    
+    ## Find the areas where the compared images differ, in the background
+    #  @param self The object pointer.
+    def startChangeIndex(self):
+        # results for an earlier pair are of no use
+        self.changeIndexGeneration += 1
+        self.changeIndex = None
+        self.changeCursor = -1
+        compared = self.comparedArrays() if change_index is not None else None
+        if compared is None:
+            return
+        arrayA, arrayB, self.changeIndexOrigin = compared
+        
+        generation = self.changeIndexGeneration
+        startBackgroundTask(change_index.ChangeIndex, (arrayA, arrayB), lambda index: self.changeIndexReady(generation, index))
+        
+        # done
+    
+    ## The change index has been built
+    #  @param self The object pointer.
+    #  @param generation The value of changeIndexGeneration when the build started.
+    #  @param index The ChangeIndex.
+    def changeIndexReady(self, generation, index):
+        if generation == self.changeIndexGeneration:
+            self.changeIndex = index
+            self.updateInfo()
+        
+        # done
+    
+    ## Build the histograms of the images and of their difference in the background, if the panel is shown
+    #  Histograms are kept with the image, in its container, and only built once per image.
+    #  @param self The object pointer.
+    def startHistograms(self):
+        if self.histogramPanel is None or not self.histogramPanel.isVisible():
+            return
+        sources = [(container, container.imageArray()) for container in self.imageContainers]
+        if self.containerViewDifference.histogramIndex is None and self.containerViewDifference not in self.histogramSources:
+            compared = self.comparedArrays()
+            if compared is not None:
+                self.histogramOrigin = compared[2]
+            sources.append((self.containerViewDifference, compared))
+        
+        for container, source in sources:
+            if source is None or container.histogramIndex is not None or self.histogramSources.get(container) is source:
+                continue
+            self.histogramSources[container] = source
+            arguments = (source,) if container is not self.containerViewDifference else source[:2]
+            startBackgroundTask(histogram_stats.HistogramIndex, arguments, lambda index, container=container, source=source: self.histogramsReady(container, source, index),
+                                lambda error, container=container, source=source: self.histogramsFailed(container, source))
+        
+        # done
+    
+    ## The histograms of an image or of the difference have been built
+    #  @param self The object pointer.
+    #  @param container The container the histograms belong to.
+    #  @param source The array, or the compared pair, they were built from.
+    #  @param index The HistogramIndex.
+    def histogramsReady(self, container, source, index):
+        # a result for an image that has since been replaced is dropped
+        if self.histogramSources.get(container) is source:
+            del self.histogramSources[container]
+            container.histogramIndex = index
+            self.updateHistograms()
+        
+        # done
+    
+    ## The histograms of an image or of the difference could not be built
+    #  @param self The object pointer.
+    #  @param container The container the histograms were for.
+    #  @param source The array, or the compared pair, they were built from.
+    def histogramsFailed(self, container, source):
+        if self.histogramSources.get(container) is source:
+            del self.histogramSources[container]
+            self.updateHistograms()
+        
+        # done
+    
+    ## The histogram panel, made on first use
+    #  @param self The object pointer.
+    def histogramsPanel(self):
+        if self.histogramPanel is None:
+            self.histogramPanel = histogram_stats.HistogramPanel(self.dialog)
+        return self.histogramPanel
+    
+    ## Show or hide the histogram panel
+    #  @param self The object pointer.
+    def toggleHistograms(self):
+        panel = self.histogramsPanel()
+        panel.setVisible(not panel.isVisible())
+        self.startHistograms()
+        self.updateHistograms()
+        
+        # done
+    
+    ## Switch the histogram panel between the whole images and the visible area
+    #  @param self The object pointer.
+    def toggleHistogramArea(self):
+        panel = self.histogramsPanel()
+        panel.visibleOnly = not panel.visibleOnly
+        self.updateHistograms()
+        
+        # done
+    
+    ## Show the histograms of the whole images, or of the visible area, from their indexes
+    #  @param self The object pointer.
+    def updateHistograms(self):
+        if self.histogramPanel is None or not self.histogramPanel.isVisible():
+            return
+        visibleRect = self.referenceView().visibleModelRect() if self.histogramPanel.visibleOnly else None
+        
+        entries = []
+        for index, container in enumerate(self.imageContainers):
+            if container.imageSize is None:
+                continue
+            rect = None
+            if visibleRect is not None:
+                # the visible area in pixels of this image
+                rect = QtCore.QRectF(container.modelToScene(visibleRect.topLeft()), container.modelToScene(visibleRect.bottomRight())).normalized()
+            entries.append(("Image " + str(index + 1), container.histogramIndex, rect))
+        if self.containerViewDifference.histogramIndex is not None or self.containerViewDifference in self.histogramSources:
+            rect = visibleRect.translated(-self.histogramOrigin[0], -self.histogramOrigin[1]) if visibleRect is not None else None
+            entries.append(("Difference", self.containerViewDifference.histogramIndex, rect))
+        
+        self.histogramPanel.showHistograms(entries)
+        self.histogramPanel.move(self.containerWidthOverlay + kDialogMargin - kControlSpacing - self.histogramPanel.width(), kGroupHeight + 2*kControlSpacing)
+        
+        # done
+    
+    ## Center the views on the next or previous area where the images differ
+    #  @param self The object pointer.
+    #  @param step 1 for the next area, -1 for the previous one.
+    def stepChange(self, step):
+        if self.changeIndex is None or self.changeIndex.isIdentical():
+            return
+        self.changeCursor = (self.changeCursor + step) % self.changeIndex.regionCount()
+        region = self.changeIndex.region(self.changeCursor)
+        left, top = self.changeIndexOrigin
+        
+        # the info is updated with the frame
+        self.syncScheduler.setCenter(QtCore.QPointF(left + region['x'] + region['width'] / 2.0, top + region['y'] + region['height'] / 2.0))
+        
+        # done
+    
+    ## Remove the second image only
+    #  @param self The object pointer.
+    def clearSecondImage(self):
+        self.containerViewSecondImage.clearContainer()
+        self.label_3.setText(_translate("Dialog", kFilePathInitial, None))
+        self.label_4.setText(_translate("Dialog", "", None))
+        self.bothLoaded = False
+        self.secondImageSize = None
+        self.roi = None
+        self.containerViewDifference.clearContainer()
+        self.startRegistration()
+        
+        # done
+    
+    ## Open images given on the command line, in a layout and at a place in the images
+    #  All images start decoding at once; the views show them as they come in.
+    #  @param self The object pointer.
+    #  @param imagePaths Paths to the images; the first two are compared, others get panes of their own.
+    #  @param layout One of the layout types ("Side-by-side", "Overlay", "Difference"), or None to keep the current one.
+    #  @param center Image coordinate (x, y) of the first image to center the views on, or None.
+    #  @param zoom Scale of the views, 1.0 for one screen pixel per image pixel; None to keep the current one.
+    def openImages(self, imagePaths, layout=None, center=None, zoom=None):
+        # where the images are given, the zoom and centre already apply
+        if center is not None or zoom is not None:
+            self.viewportModel.update(zoom / self.viewportModel.scale if zoom is not None else 1.0,
+                                      center=QtCore.QPointF(*center) if center is not None else None)
+        
+        for imageId, imgFilename in enumerate(imagePaths[:kMaxImages]):
+            imgFilename = os.path.abspath(imgFilename)
+            if imageId >= 2:
+                self.createImageContainer()
+            self.loadImage(imageId, imgFilename)
+            self.workingDir = os.path.dirname(imgFilename)
+        
+        if layout is not None and layout in self.layoutButtons:
+            self.layoutButtons[layout].setChecked(True)
+        
+        # done
+    
+    ## Add a pane for one more image, and load it
+    #  @param self The object pointer.
+    #  @param Dialog The dialog pointer.
+    def addImage(self, Dialog):
+        if len(self.imageContainers) >= kMaxImages:
+            return
+        imgFilename = QtGui.QFileDialog.getOpenFileName(Dialog, "Select another image", self.workingDir)
+        if not imgFilename:
+            return
+        self.workingDir = os.path.dirname(os.path.abspath(imgFilename))
+        
+        self.createImageContainer()
+        self.loadImage(len(self.imageContainers) - 1, imgFilename)
+        
+        # done
+    
+    ## Create one more image container and lay out all of them
+    #  @param self The object pointer.
+    def createImageContainer(self):
+        container = ImageContainerView(self.dialog)
+        container.setObjectName(_fromUtf8("containerViewImage" + str(len(self.imageContainers) + 1)))
+        container.setContainingDialog(self)
+        container.tag = len(self.imageContainers)
+        container.setViewportModel(self.viewportModel)
+        container.setPixelOverlays(self.pixelGrid, self.pixelLabels)
+        self.imageContainers.append(container)
+        
+        # the difference view stays on top
+        container.stackUnder(self.containerViewDifference)
+        self.layoutImages()
+        
+        # done
+    
+    ## Ask for a playlist and show its first pair
+    #  The playlist comes from a manifest, or from files with the same name in two folders.
+    #  @param self The object pointer.
+    #  @param Dialog The dialog pointer.
+    def openPlaylist(self, Dialog):
+        manifestPath = QtGui.QFileDialog.getOpenFileName(Dialog, kInfoPlaylistTitle, self.workingDir)
+        if manifestPath:
+            playlist = PairPlaylist.fromManifest(manifestPath)
+        else:
+            directoryA = QtGui.QFileDialog.getExistingDirectory(Dialog, "Select the folder of first images", self.workingDir)
+            if not directoryA:
+                return
+            directoryB = QtGui.QFileDialog.getExistingDirectory(Dialog, "Select the folder of second images", directoryA)
+            if not directoryB:
+                return
+            playlist = PairPlaylist.fromDirectories(directoryA, directoryB)
+        
+        self.setPlaylist(playlist)
+        
+        # done
+    
+    ## Use a playlist and show its first pair
+    #  @param self The object pointer.
+    #  @param playlist The PairPlaylist.
+    def setPlaylist(self, playlist):
+        if len(playlist) == 0:
+            self.playlist = None
+            self.label_5.setText(_translate("Dialog", kInfoPlaylistEmpty, None))
+            return
+        self.playlist = playlist
+        self.startSequenceScan()
+        self.showPlaylistPair()
+        
+        # done
+    
+    ## Measure the difference of every pair of the playlist, a few pairs at a time, for the timeline
+    #  @param self The object pointer.
+    def startSequenceScan(self):
+        if self.sequenceScan is not None:
+            self.sequenceScan.cancel()
+            self.sequenceScan = None
+        if sequence_compare is None:
+            return
+        if self.playlist is None:
+            if self.sequenceTimeline is not None:
+                self.sequenceTimeline.setVisible(False)
+            return
+        
+        # made with the first playlist
+        if self.sequenceTimeline is None:
+            timelineHeight = sequence_compare.kTimelineHeight
+            self.sequenceTimeline = sequence_compare.SequenceTimeline(self.dialog)
+            self.sequenceTimeline.setGeometry(QtCore.QRect(kDialogMargin, kGroupHeight + kControlSpacing + self.containerHeight - timelineHeight, self.containerWidthOverlay, timelineHeight))
+            self.sequenceTimeline.frameSelected.connect(self.showPlaylistFrame)
+        
+        self.sequenceTimeline.setLength(len(self.playlist))
+        self.sequenceTimeline.setVisible(True)
+        self.sequenceTimeline.raise_()
+        self.sequenceScan = sequence_compare.SequenceScan(self.playlist.pairs)
+        # results of a cancelled scan go to its own timeline state, which is reset above
+        self.sequenceScan.measured.connect(lambda index, result, scan=self.sequenceScan: scan is self.sequenceScan and self.sequenceTimeline.setResult(index, result))
+        self.sequenceScan.start()
+        
+        # done
+    
+    ## Show one pair of the playlist, chosen on the timeline
+    #  @param self The object pointer.
+    #  @param index The index of the pair.
+    def showPlaylistFrame(self, index):
+        if self.playlist is not None and self.playlist.move(index - self.playlist.index):
+            self.showPlaylistPair()
+        
+        # done
+    
+    ## Go to the next or previous pair of the playlist
+    #  @param self The object pointer.
+    #  @param step 1 for the next pair, -1 for the previous one.
+    def stepPlaylist(self, step):
+        # the viewport model keeps the zoom and centre, so the same region is inspected in the next pair
+        if self.playlist is not None and self.playlist.move(step):
+            self.showPlaylistPair()
+        
+        # done
+    
+    ## Load the current pair of the playlist, and decode the next ones in the background
+    #  @param self The object pointer.
+    def showPlaylistPair(self):
+        pathA, pathB = self.playlist.current()
+        self.workingDir = os.path.dirname(os.path.abspath(pathA))
+        self.loadImage(0, pathA)
+        self.loadImage(1, pathB)
+        self.label_6.setToolTip("pair " + str(self.playlist.index + 1) + " of " + str(len(self.playlist)))
+        if self.sequenceTimeline is not None:
+            self.sequenceTimeline.setCurrent(self.playlist.index)
+        
+        # the decoded images wait in the shared cache
+        for pair in self.playlist.upcoming():
+            for path in pair:
+                if path not in self.prefetching and not isMappable(path):
+                    self.prefetching.add(path)
+                    startBackgroundTask(decodeImageCached, (path,), lambda image, path=path: self.prefetching.discard(path), lambda error, path=path: self.prefetching.discard(path))
         
         # done
     
@@ -328,43 +1273,123 @@ class Ui_Dialog(QtGui.QWidget):
         self.label_3.setText(_translate("Dialog", kFilePathInitial, None))
         self.label_4.setText(_translate("Dialog", "", None))
         
+        # playlist
+        self.playlist = None
+        self.label_6.setToolTip("")
+        self.startSequenceScan()
+        
         # buttons
         self.pushButton_2.setEnabled(False)
         self.pushButton_3.setEnabled(False)
+        self.pushButton_5.setEnabled(False)
         
-        # graphics views
+        # graphics views: back to a pair, and nothing laid over the first image
+        self.containerViewOverlay.clearContainer()
+        for container in self.imageContainers[2:]:
+            container.clearContainer()
+            container.setParent(None)
+            container.deleteLater()
+        del self.imageContainers[2:]
+        self.overlayIndex = 1
         self.containerViewFirstImage.clearContainer()
         self.containerViewSecondImage.clearContainer()
+        self.containerViewDifference.clearContainer()
+        self.viewportModel.reset()
+        self.layoutImages()
         
         # other
         self.bothLoaded = False
         self.imageSize = None
         self.secondImageSize = None
         self.roi = None
+        self.toneMap = None
+        self.histogramSources.clear()
+        self.startRegistration()
         
         # done   
 
+    ## Show or hide the instrumentation display; spans are recorded while it is shown
+    #  @param self The object pointer.
+    def toggleInstrumentation(self):
+        self.hud.setActive(not self.hud.isVisible())
+        
+        # done
+    
+    ## Save the recorded spans as a Chrome trace (chrome://tracing, Perfetto)
+    #  @param self The object pointer.
+    #  @param Dialog The dialog pointer.
+    def saveTrace(self, Dialog):
+        traceFilename = QtGui.QFileDialog.getSaveFileName(Dialog, "Save trace", os.path.join(self.workingDir, "trace.json"), "Trace (*.json)")
+        if not traceFilename:
+            return
+        tracer.exportChromeTrace(traceFilename)
+        self.label_5.setText(_translate("Dialog", kInfoTraceSaved + traceFilename, None))
+        
+        # done
+    
     ## UI update
     #  @param self The object pointer.
+    @traced("stats")
     def updateInfo(self):
-        # record the visible rectangle
-        self.visibleRect = self.containerViewFirstImage.visibleRect()
+        # record the visible rectangle, in pixels of the first image
+        self.visibleRect = self.referenceView().visibleModelRect()
         
         # update the info
         infoString = "visible rectangle: x=" + str(int(self.visibleRect.x())) + ", y=" + str(int(self.visibleRect.y())) + ", width=" + str(int(self.visibleRect.width())) + ", height=" + str(int(self.visibleRect.height()))
+        infoString += " (" + str(self.syncScheduler.coalescedEvents()) + " input events coalesced)"
+        if self.containerViewSecondImage.registration is not None:
+            infoString += "\n" + kInfoAligned + self.containerViewSecondImage.registration.describe()
+        
+        # statistics of both images over the visible rectangle, in constant time
+        if self.regionStats is not None:
+            left, top = self.regionStatsOrigin
+            stats = self.regionStats.regionStatistics(self.visibleRect.x() - left, self.visibleRect.y() - top, self.visibleRect.width(), self.visibleRect.height())
+            if stats is not None:
+                infoString += "\n" + region_stats.formatStatistics(stats)
+        
+        # differences over the whole compared area
+        if self.pairMetrics is not None:
+            metrics = self.pairMetrics
+            infoString += "\n" + kInfoPairMetrics + "max diff %g, mean abs. diff %.4g, PSNR " % (metrics['maxDiff'], metrics['meanAbsDiff'])
+            infoString += ("%.2f dB" % metrics['psnr'] if metrics['psnr'] is not None else "inf") + ", " + str(metrics['differingPixels']) + " differing pixels"
+            if metrics['bbox'] is not None:
+                x, y, width, height = metrics['bbox']
+                infoString += " within x=" + str(x + self.pairMetricsOrigin[0]) + ", y=" + str(y + self.pairMetricsOrigin[1]) + ", " + str(width) + "x" + str(height)
+        elif self.pairMetricsError is not None:
+            infoString += "\n" + kInfoPairMetrics + "not computed (" + self.pairMetricsError + ")"
+        
+        # structural similarity of the whole compared area and of the visible part
+        if self.similarity is not None:
+            left, top = self.similarityOrigin
+            visible = self.similarity.regionScore(self.visibleRect.translated(-left, -top))
+            infoString += "\n" + structural_similarity.formatScores(self.similarityScores, self.similarity.progress, visible, self.similarityError)
+        
+        # how high bit depth images are shown
+        if self.toneMap is not None:
+            infoString += "\n" + self.toneMap.describe()
+        
+        # where the images differ
+        if self.changeIndex is not None:
+            if self.changeIndex.isIdentical():
+                infoString += "\n" + kInfoIdentical
+            elif self.changeCursor >= 0:
+                region = self.changeIndex.region(self.changeCursor)
+                infoString += "\ndifference " + str(self.changeCursor + 1) + " of " + str(self.changeIndex.regionCount()) + ": x=" + str(region['x'] + self.changeIndexOrigin[0]) + ", y=" + str(region['y'] + self.changeIndexOrigin[1])
+                infoString += ", " + str(region['width']) + "x" + str(region['height']) + ", " + str(region['differingPixels']) + " differing pixels"
+            else:
+                infoString += "\n" + str(self.changeIndex.regionCount()) + kInfoChanges
+        
         self.label_5.setText(infoString)
+        self.updateHistograms()
         
         # done
     
     ## Adjust both images according to mouse wheel events
     #  @param self The object pointer.
-    #  @param point The image coordinate to center the view on.
+    #  @param scale The multiplication factor of scale.
     def respondToWheel(self, scale):
-        self.containerViewFirstImage.scaleView(scale)
-        self.containerViewSecondImage.scaleView(scale)
-        
-        # also update the UI
-        self.updateInfo()
+        # applied, and the UI updated, with the next frame
+        self.syncScheduler.addZoom(scale)
         
         # done
         
@@ -373,39 +1398,132 @@ class Ui_Dialog(QtGui.QWidget):
     #  @param self The object pointer.
     #  @param point The image coordinate to center the view on.
     def respondToPress(self, point):
-        self.containerViewFirstImage.centerOn(point)
-        self.containerViewSecondImage.centerOn(point)
+        self.syncScheduler.setCenter(point)
         
         # done
         
-    ## Adjust both images when one is being dragged
+    ## Show all images of more than 8 bits per sample through a window and tone curve
     #  @param self The object pointer.
-    #  @param point The image coordinate to center the view on.
-    def respondToDrag(self, point):
-        self.containerViewFirstImage.centerOn(point)
-        self.containerViewSecondImage.centerOn(point)
-        
-        # also update the UI
+    #  @param toneMap The tone_mapping.ToneMap.
+    def setToneMap(self, toneMap):
+        self.toneMap = toneMap
+        for container in self.imageContainers:
+            container.setToneMap(toneMap)
         self.updateInfo()
         
         # done
+    
+    ## Draw a grid between the pixels, and their values, in every view when zoomed in far enough
+    #  @param self The object pointer.
+    #  @param grid Whether to draw the grid.
+    #  @param labels Whether to write the values.
+    def setPixelOverlays(self, grid, labels):
+        self.pixelGrid = grid
+        self.pixelLabels = labels
+        for container in self.imageContainers + [self.containerViewDifference, self.containerViewOverlay]:
+            container.setPixelOverlays(grid, labels)
+        
+        # done
+    
+    ## Go back to the window covering all values of the first high bit depth image
+    #  @param self The object pointer.
+    def resetToneMap(self):
+        for container in self.imageContainers:
+            if container.currentToneMap() is not None:
+                self.setToneMap(tone_mapping.ToneMap.auto(container.pixelArray, self.toneMap.curve))
+                return
+        
+        # done
+    
+    ## Use the next tone curve
+    #  @param self The object pointer.
+    def cycleToneCurve(self):
+        if self.toneMap is not None:
+            curves = tone_mapping.kToneCurves
+            self.setToneMap(self.toneMap.withCurve(curves[(curves.index(self.toneMap.curve) + 1) % len(curves)]))
+        
+        # done
+    
+    ## Adjust the window when the mouse is dragged with Ctrl held
+    #  Dragging right widens the window, dragging down moves it to higher values.
+    #  @param self The object pointer.
+    #  @param deltaX Horizontal mouse movement, in screen pixels.
+    #  @param deltaY Vertical mouse movement, in screen pixels.
+    def respondToWindowDrag(self, deltaX, deltaY):
+        if self.toneMap is None:
+            return
+        width = (self.toneMap.high - self.toneMap.low) * math.pow(2.0, deltaX / kWindowDragPixels)
+        center = (self.toneMap.low + self.toneMap.high) / 2.0 + deltaY * width / kWindowDragPixels
+        self.setToneMap(tone_mapping.ToneMap(center - width / 2.0, center + width / 2.0, self.toneMap.curve))
+        
+        # done
+    
+    ## Show the pixel under the mouse in both images
+    #  Samples are read from the image arrays directly, so this keeps up with the mouse on any image size.
+    #  @param self The object pointer.
+    #  @param view The view the mouse is on.
+    #  @param scenePoint The mouse position in the scene of the view, or None when the mouse has left it.
+    def respondToHover(self, view, scenePoint):
+        if pixel_inspector is None or (self.pixelInspector is not None and not self.pixelInspector.enabled):
+            return
+        if scenePoint is None or view.imageSize is None:
+            self.pixelUnderMouse = None
+            if self.pixelInspector is not None:
+                self.pixelInspector.setVisible(False)
+            return
+        
+        # made when the mouse is first over an image
+        self.inspectorPanel()
+        
+        point = view.sceneToModel(scenePoint)
+        self.pixelUnderMouse = QtCore.QPoint(int(math.floor(point.x())), int(math.floor(point.y())))
+        sources = []
+        for index, container in enumerate(self.imageContainers[:2]):
+            sources.append(("image " + str(index + 1), container.imageArray(), container.registration, container.currentToneMap()))
+        self.pixelInspector.inspect(self.pixelUnderMouse.x(), self.pixelUnderMouse.y(), sources)
+        
+        # bottom left corner of the image area
+        bottom = kGroupHeight + self.containerHeight
+        if self.sequenceTimeline is not None and self.sequenceTimeline.isVisible():
+            bottom = self.sequenceTimeline.y() - kControlSpacing
+        self.pixelInspector.move(kDialogMargin + kControlSpacing, bottom - self.pixelInspector.height())
+        
+        # done
+    
+    ## The pixel inspector panel, made on first use
+    #  @param self The object pointer.
+    def inspectorPanel(self):
+        if self.pixelInspector is None:
+            self.pixelInspector = pixel_inspector.PixelInspector(self.dialog)
+        return self.pixelInspector
+    
+    ## Move both images when one is being dragged
+    #  @param self The object pointer.
+    #  @param deltaX The distance to move the image to the right, in scene units.
+    #  @param deltaY The distance to move the image down, in scene units.
+    def respondToPan(self, deltaX, deltaY):
+        # applied, and the UI updated, with the next frame
+        self.syncScheduler.addPan(deltaX, deltaY)
+        
+        # done
         
     ## Swap visible image upon right click, in overlay mode
     #  @param self The object pointer.
     def respondToRightClick(self):
-        # shrinking the second image container was the easierst way out ;-)
+        # cycle through the ways of compositing, then through the images laid over the first one
         if self.imgLayout == "Overlay":
-            frame = self.containerViewSecondImage.geometry()
-            if frame.height() > 0 :
-                newFrame = QtCore.QRect(frame.left(), frame.top(), frame.width(), 0)
-                self.containerViewSecondImage.setGeometry(newFrame)
-                # change the indicator label
-                self.label_6.setText(_translate("Dialog", "Layout (overlay, image 1)", None))
-                
-            else:
-                self.containerViewSecondImage.setGeometry(self.containerViewFirstImage.geometry())
-                # change the indicator label
-                self.label_6.setText(_translate("Dialog", "Layout (overlay, image 2)", None))
+            index = kOverlayModes.index(self.overlayMode) + 1
+            if index == len(kOverlayModes):
+                index = 0
+                self.overlayIndex = self.overlayIndex % (len(self.imageContainers) - 1) + 1
+            self.overlayMode = kOverlayModes[index]
+            self.layoutImages()
+        
+        # cycle through the ways of showing the difference
+        elif self.imgLayout == "Difference":
+            modes = image_diff.kDiffModes + ((structural_similarity.kSsimMode,) if structural_similarity is not None else ())
+            self.diffMode = modes[(modes.index(self.diffMode) + 1) % len(modes)]
+            self.updateDifference()
         
         # also update the UI
         self.updateInfo()
@@ -422,20 +1540,97 @@ class Ui_Dialog(QtGui.QWidget):
         
         # done
 
+## A point given on the command line as x,y
+#  @param text The command line argument.
+def parsePoint(text):
+    try:
+        x, y = (float(value) for value in text.split(','))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected x,y, e.g. 1200,800: " + repr(text))
+    return x, y
+
+## A zoom given on the command line
+#  @param text The command line argument.
+def parseZoom(text):
+    try:
+        zoom = float(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number, e.g. 4: " + repr(text))
+    if not kScaleFactorMin <= zoom <= kScaleFactorMax:
+        raise argparse.ArgumentTypeError("zoom must be between " + str(kScaleFactorMin) + " and " + str(kScaleFactorMax))
+    return zoom
+
+## Parse the command line of the interactive program
+#  @param argv The arguments, without the program name and Qt's own options.
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(prog='image_comparator.py', description="Compare images side by side, overlaid or as their difference. "
+                                     "Other modes: --batch, --prewarm, --daemon, --benchmark (each with its own --help).")
+    parser.add_argument('images', nargs='*', help="images to open; the first two are compared, up to " + str(kMaxImages) + " are shown")
+    parser.add_argument('--layout', choices=sorted(kLayoutOptions), help="layout to start in (default: side-by-side)")
+    parser.add_argument('--center', type=parsePoint, metavar='X,Y', help="pixel of the first image to center the views on")
+    parser.add_argument('--zoom', type=parseZoom, help="screen pixels per image pixel (default: 1)")
+    # for the startup measurement of the benchmark: print the time of the first frame showing the images, and quit
+    parser.add_argument('--report-first-paint', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.layout == 'difference' and image_diff is None:
+        parser.error("the difference layout needs NumPy")
+    if args.report_first_paint and not args.images:
+        parser.error("--report-first-paint needs images")
+    return args
+
+## Print the time of the first frame showing the images, and quit
+#  Used by the benchmark to measure startup: the time is compared with the time the process was started.
+#  @param app The application.
+#  @param ui The user interface, with the images being loaded.
+def reportFirstPaint(app, ui):
+    views = [view for view in ui.imageContainers + [ui.containerViewOverlay, ui.containerViewDifference] if view.isVisible()]
+    probe = FirstPaintProbe(views, lambda view: view.imageSize is not None, app)
+    probe.painted.connect(lambda: (sys.stdout.write(repr(time.time()) + '\n'), sys.stdout.flush(), app.quit()))
+    
+    # done
+
 ## Main interaction loop
 #
 #  Typical QtDialog Application; no change      
 if __name__ == "__main__":
-    import sys
+    # headless batch comparison: no GUI at all
+    if '--batch' in sys.argv[1:]:
+        import batch_compare
+        sys.exit(batch_compare.main([arg for arg in sys.argv[1:] if arg != '--batch']))
+    
+    # decode images into the on-disk pyramid cache
+    if '--prewarm' in sys.argv[1:]:
+        import pyramid_cache
+        sys.exit(pyramid_cache.main([arg for arg in sys.argv[1:] if arg != '--prewarm']))
+    
+    # comparison service for test harnesses, over a Unix socket
+    if '--daemon' in sys.argv[1:]:
+        import compare_daemon
+        sys.exit(compare_daemon.main([arg for arg in sys.argv[1:] if arg != '--daemon']))
     
-    # load GUI
+    # performance measurements, on a virtual screen
+    if '--benchmark' in sys.argv[1:]:
+        import benchmark
+        sys.exit(benchmark.main([arg for arg in sys.argv[1:] if arg != '--benchmark']))
+    
+    # load GUI; Qt takes its own options out of the arguments
     app = QtGui.QApplication(sys.argv)
+    args = parseArguments(sys.argv[1:])
     
     Dialog = QtGui.QDialog()
     ui = Ui_Dialog()
     ui.setupUi(Dialog)
+    
+    # the images decode while the window comes up
+    ui.openImages(args.images, kLayoutOptions.get(args.layout), args.center, args.zoom)
     Dialog.show()
+    if args.report_first_paint:
+        reportFirstPaint(app, ui)
     
-    sys.exit(app.exec_())
+    status = app.exec_()
+    if args.report_first_paint:
+        # quitting right after the first frame: decodes and computations still running end first
+        QtCore.QThreadPool.globalInstance().waitForDone()
+    sys.exit(status)
 
     # done
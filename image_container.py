@@ -14,12 +14,38 @@ from PyQt4 import QtCore, QtGui
 # custom class for image
 from movable_image import MovableImage
 
+# tiled backend for very large images
+from tiled_image import ImageTileSource, TiledImageItem
+
+# decoding on worker threads
+from image_loader import ImageLoader, decodeImageCached
+
+# files that are memory-mapped instead of decoded
+from image_cache import isMappable
+
+# composite of two views, for the overlay layout
+from image_overlay import OverlayItem
+
+# pixmaps drawn pixel by pixel at high magnification
+from pixel_zoom import PixmapItem
+
+# timed spans for the instrumentation display and traces
+from instrumentation import traced
+
+# optional: memory-mapped loading, differences and high bit depth display need NumPy; imported when first used
+from lazy_import import lazyImport
+mapped_image = lazyImport('mapped_image', 'numpy')
+image_diff = lazyImport('image_diff', 'numpy')
+tone_mapping = lazyImport('tone_mapping', 'numpy')
+structural_similarity = lazyImport('structural_similarity', 'numpy')
+
 # calculations
 import math
 
 # constants
 kScaleFactorMin = 0.1
 kScaleFactorMax = 150.0
+kTiledPixelThreshold = 16 * 1024 * 1024
 
 ## ImageContainerView
 #
@@ -41,6 +67,32 @@ class ImageContainerView(QtGui.QGraphicsView):
         # absolute image path will be stored here
         self.imagePath = None
         
+        # tiled backend: None chooses it automatically for large images
+        self.useTiledBackend = None
+        self.tiledItem = None
+        
+        # composite of two other views, in the overlay layout
+        self.overlayItem = None
+        self.draggingDivider = False
+        
+        # background loading
+        self.loader = ImageLoader(self)
+        self.loader.previewLoaded.connect(self.showPreview)
+        self.loader.imageLoaded.connect(self.showLoadedImage)
+        self.previewShown = False
+        self.imageSize = None
+        
+        # the image, and its pixel data as an array (e.g. a memory-mapped file)
+        self.image = None
+        self.pixelArray = None
+        self.arrayImage = None
+        
+        # histograms of the image, built once when the statistics panel asks for them
+        self.histogramIndex = None
+        
+        # window and tone curve for images of more than 8 bits per sample; None for automatic
+        self.toneMap = None
+        
         # for image dragging
         self.setMouseTracking(True)
         self.currentPos = None
@@ -52,7 +104,13 @@ class ImageContainerView(QtGui.QGraphicsView):
         self.height = 0
         self.originalScaleFactor = 1.0
         self.isPortrait = True
-        self.currenScaleFactor = 1.0
+        
+        # shared viewport, if the view is synchronized with others
+        self.viewportModel = None
+        self.viewportStale = False
+        
+        # alignment with the first image: maps viewport (first image) coordinates to this scene
+        self.registration = None
         
         # other: tag for identification
         self.tag = -1
@@ -63,71 +121,449 @@ class ImageContainerView(QtGui.QGraphicsView):
         self.containerDialog = dialog
         
         # done
+    
+    ## Follow a shared viewport model
+    #  @param self The object pointer.
+    #  @param model The ViewportModel.
+    def setViewportModel(self, model):
+        self.viewportModel = model
+        model.changed.connect(self.applyViewport)
+        self.applyViewport()
+        
+        # done
+    
+    ## Show the centre and scale of the viewport model
+    #  Hidden views only take note, and catch up when they are shown.
+    #  @param self The object pointer.
+    @traced("sync")
+    def applyViewport(self):
+        if not self.isVisible():
+            self.viewportStale = True
+            return
+        self.viewportStale = False
+        scale = self.viewportModel.scale
+        if self.registration is not None:
+            # the same content at the same size on screen
+            scale /= self.registration.scale
+        self.setTransform(QtGui.QTransform.fromScale(scale, scale))
+        if self.viewportModel.center is not None:
+            self.centerOn(self.modelToScene(self.viewportModel.center))
+        
+        # done
+    
+    ## Align the view with the first image
+    #  @param self The object pointer.
+    #  @param registration Object with mapPoint and inverseMapPoint (e.g. an image_registration.Registration),
+    #         or None to show the scene as it is.
+    def setRegistration(self, registration):
+        self.registration = registration
+        if self.viewportModel is not None:
+            self.applyViewport()
+        
+        # done
+    
+    ## Scene position of a point in viewport coordinates
+    #  @param self The object pointer.
+    #  @param point The point, in pixels of the first image.
+    def modelToScene(self, point):
+        if self.registration is None:
+            return point
+        return QtCore.QPointF(*self.registration.mapPoint(point.x(), point.y()))
+    
+    ## Viewport coordinates of a scene position
+    #  @param self The object pointer.
+    #  @param point The point, in scene coordinates.
+    def sceneToModel(self, point):
+        if self.registration is None:
+            return point
+        return QtCore.QPointF(*self.registration.inverseMapPoint(point.x(), point.y()))
+    
+    ## The view is about to be shown
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def showEvent(self, event):
+        super(ImageContainerView, self).showEvent(event)
+        if self.viewportStale:
+            self.applyViewport()
+        
+        # done
+    
+    ## Choose between a single pixmap and tiled rendering
+    #  @param self The object pointer.
+    #  @param enabled True or False to force a backend, None to decide by image size.
+    def setUseTiledBackend(self, enabled):
+        self.useTiledBackend = enabled
+        
+        # done
+    
+    ## Whether an image of the given size should be shown with tiles
+    #  @param self The object pointer.
+    #  @param size The size of the image.
+    def wantsTiledBackend(self, size):
+        if self.useTiledBackend is None:
+            return size.width() * size.height() >= kTiledPixelThreshold
+        return self.useTiledBackend
       
+    ## Draw a grid between the pixels, and write their values on them, when zoomed in far enough
+    #  The settings are kept on the scene, where the items and the overlay of other views find them.
+    #  @param self The object pointer.
+    #  @param grid Whether to draw the grid.
+    #  @param labels Whether to write the values.
+    def setPixelOverlays(self, grid, labels):
+        self.scene.pixelGrid = grid
+        self.scene.pixelLabels = labels
+        self.viewport().update()
+        
+        # done
+    
     ## Image rectangle that is visible through this view
     #  @param self The object pointer.
     def visibleRect(self):
         return self.mapToScene(self.viewport().geometry()).boundingRect()
         # done
     
+    ## Visible rectangle in viewport coordinates (pixels of the first image)
+    #  @param self The object pointer.
+    def visibleModelRect(self):
+        rect = self.visibleRect()
+        return QtCore.QRectF(self.sceneToModel(rect.topLeft()), self.sceneToModel(rect.bottomRight()))
+    
     ## Load an image
     #  @param self The object pointer.
     #  @param filePath The absolute path to the image.    
+    @traced("load")
     def loadSceneForImage(self, filePath):
         # set property for future use
         self.imagePath = filePath
         
-        # load as a pixmap
-        self.image = QtGui.QPixmap(filePath)
+        # this replaces any load still running in the background
+        self.loader.cancel()
+        
+        if self.loadSceneForMappedImage(filePath):
+            return self.imageSize
+        
+        # decoded images are shared through a cache
+        image = decodeImageCached(filePath)
+        if self.wantsTiledBackend(image.size()):
+            # paint only the visible tiles of a mip pyramid
+            self.showImage(image)
+        else:
+            # show as a pixmap
+            self.showImage(QtGui.QPixmap.fromImage(image))
+        self.estimateScaleFactor()
+        
+        # image size is passed as return value
+        return self.imageSize
+        
+        # done
+    
+    ## Load an image in the background
+    #  A preview is shown as soon as it is decoded, and replaced by the full image later.
+    #  The containing dialog is notified through respondToImageLoaded when the load completes.
+    #  @param self The object pointer.
+    #  @param filePath The absolute path to the image.
+    def loadSceneForImageAsync(self, filePath):
+        # set property for future use
+        self.imagePath = filePath
+        self.previewShown = False
+        
+        # mapping a file costs next to nothing, no need for a worker
+        if self.loadSceneForMappedImage(filePath):
+            self.loader.cancel()
+            if self.containerDialog is not None:
+                self.containerDialog.respondToImageLoaded(self.tag, self.imageSize)
+            return
+        
+        # previous load (if any) is cancelled by the loader
+        self.loader.load(filePath)
+        
+        # done
+    
+    ## Load a raw, .npy or uncompressed TIFF file by memory-mapping it
+    #  The mapped buffer is shown through a QImage without copying, using the tiled backend,
+    #  so only the pages under visible tiles are ever read from disk.
+    #  @param self The object pointer.
+    #  @param filePath The absolute path to the image.
+    #  @return True if the file was mapped, False if it has to be decoded instead.
+    @traced("load")
+    def loadSceneForMappedImage(self, filePath):
+        if mapped_image is None or not isMappable(filePath):
+            return False
+        try:
+            array = mapped_image.mapImage(filePath)
+        except (ValueError, IOError, OSError, KeyError):
+            # e.g. a compressed TIFF: let Qt decode it
+            return False
+        
+        self.imagePath = filePath
+        if tone_mapping.needsToneMapping(array):
+            # the original samples are kept, and mapped for display tile by tile
+            self.showToneMappedArray(array)
+        else:
+            self.showImage(mapped_image.arrayToQImage(array))
+        self.pixelArray = array
+        self.estimateScaleFactor()
+        
+        return True
+    
+    ## Show a preview decoded in the background
+    #  @param self The object pointer.
+    #  @param image The reduced-resolution image.
+    #  @param fullSize The size of the full resolution image.
+    @traced("load")
+    def showPreview(self, image, fullSize):
+        self.showImage(image, fullSize)
+        self.estimateScaleFactor()
+        self.previewShown = True
+        
+        # done
+    
+    ## Show an image decoded in the background
+    #  @param self The object pointer.
+    #  @param image The full resolution image.
+    @traced("load")
+    def showLoadedImage(self, image):
+        if image.isNull():
+            # nothing we can show
+            self.clearContainer()
+        else:
+            if not self.wantsTiledBackend(image.size()):
+                image = QtGui.QPixmap.fromImage(image)
+            self.showImage(image)
+            
+            # keep the zoom the user may have chosen on the preview
+            if not self.previewShown:
+                self.estimateScaleFactor()
+        
+        # let the dialog update its labels and check sizes
+        if self.containerDialog is not None:
+            self.containerDialog.respondToImageLoaded(self.tag, image.size())
+        
+        # done
+    
+    ## Replace the image in the scene
+    #  @param self The object pointer.
+    #  @param image A QPixmap, or a QImage to be shown with tiles.
+    #  @param fullSize The size the image should cover in the scene, if it is a preview.
+    @traced("load")
+    def showImage(self, image, fullSize=None):
+        if fullSize is None:
+            fullSize = image.size()
+        
+        # clear previous items
+        itemset = self.scene.items()
+        for i in range(len(itemset)):
+            self.scene.removeItem(itemset[i])
+        self.tiledItem = None
+        self.overlayItem = None
         
+        if isinstance(image, QtGui.QImage) and image.size() == fullSize:
+            # a pyramid from the on-disk cache comes with all its levels
+            self.tiledItem = TiledImageItem(getattr(image, 'pyramidSource', None) or ImageTileSource(image))
+            self.scene.addItem(self.tiledItem)
+        else:
+            if isinstance(image, QtGui.QImage):
+                image = QtGui.QPixmap.fromImage(image)
+            item = PixmapItem(image)
+            self.scene.addItem(item)
+            
+            # stretch a preview so that scene coordinates stay in full resolution pixels
+            if image.size() != fullSize:
+                item.setTransform(QtGui.QTransform.fromScale(fullSize.width() / float(image.width()), fullSize.height() / float(image.height())))
+        
+        self.image = image
+        self.imageSize = fullSize
+        self.pixelArray = None
+        self.arrayImage = None
+        self.histogramIndex = None
+        self.scene.setSceneRect(QtCore.QRectF(0, 0, fullSize.width(), fullSize.height()))
+        self.setScene(self.scene)
+        
+        # done
+    
+    ## Show an image of more than 8 bits per sample through a window and tone curve
+    #  @param self The object pointer.
+    #  @param array The image array.
+    @traced("load")
+    def showToneMappedArray(self, array):
         # clear previous items
         itemset = self.scene.items()
         for i in range(len(itemset)):
             self.scene.removeItem(itemset[i])
-
-        self.scene.addPixmap(self.image)   
+        self.overlayItem = None
+        
+        toneMap = self.toneMap if self.toneMap is not None else tone_mapping.ToneMap.auto(array)
+        self.tiledItem = TiledImageItem(tone_mapping.ToneMappedTileSource(array, toneMap))
+        self.scene.addItem(self.tiledItem)
+        
+        self.image = None
+        self.imageSize = self.tiledItem.imageSize
+        self.pixelArray = array
+        self.arrayImage = None
+        self.histogramIndex = None
+        self.scene.setSceneRect(self.tiledItem.boundingRect())
+        self.setScene(self.scene)
+        
+        # done
+    
+    ## The ToneMap the image is shown with, if it has more than 8 bits per sample
+    #  @param self The object pointer.
+    #  @return The ToneMap, or None.
+    def currentToneMap(self):
+        if self.tiledItem is None or tone_mapping is None or not isinstance(self.tiledItem.source, tone_mapping.ToneMappedTileSource):
+            return None
+        return self.tiledItem.source.toneMap
+    
+    ## Show the image through another window or tone curve
+    #  Only the tiles that are painted again are mapped again.
+    #  @param self The object pointer.
+    #  @param toneMap The ToneMap, or None for the automatic one.
+    def setToneMap(self, toneMap):
+        self.toneMap = toneMap
+        if self.currentToneMap() is None or self.currentToneMap() is toneMap:
+            return
+        self.tiledItem.source.toneMap = toneMap if toneMap is not None else tone_mapping.ToneMap.auto(self.pixelArray)
+        self.tiledItem.invalidateTiles()
+        
+        # done
+    
+    ## Pixel data of the loaded image, as a height x width (x channels) array
+    #  Decoded images are viewed in place after a conversion to 32-bit RGB, if needed.
+    #  @param self The object pointer.
+    #  @return The array, or None while nothing (or only a preview) is loaded.
+    @traced("load")
+    def imageArray(self):
+        if self.pixelArray is None and self.image is not None and mapped_image is not None:
+            if self.loader.isLoading():
+                return None
+            image = self.image
+            if not isinstance(image, QtGui.QImage):
+                image = image.toImage()
+            self.pixelArray, self.arrayImage = mapped_image.qimageToArray(image)
+        return self.pixelArray
+    
+    ## Show the difference of two images, computed tile by tile
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    #  @param mode One of image_diff.kDiffModes.
+    @traced("diff")
+    def showDifference(self, arrayA, arrayB, mode="Absolute"):
+        self.showComparison(image_diff.DiffTileSource(arrayA, arrayB, mode))
+        
+        # done
+    
+    ## Show the structural similarity (SSIM) map of two images, computed tile by tile
+    #  @param self The object pointer.
+    #  @param index The structural_similarity.SimilarityIndex of the images; the tiles shown are recorded in it.
+    @traced("diff")
+    def showSimilarity(self, index):
+        self.showComparison(structural_similarity.SimilarityTileSource(index))
+        
+        # done
+    
+    ## Show a comparison of two images, from a tile source
+    #  @param self The object pointer.
+    #  @param source The tile source, e.g. an image_diff.DiffTileSource.
+    def showComparison(self, source):
+        # clear previous items
+        itemset = self.scene.items()
+        for i in range(len(itemset)):
+            self.scene.removeItem(itemset[i])
+        self.overlayItem = None
+        
+        self.tiledItem = TiledImageItem(source)
+        self.scene.addItem(self.tiledItem)
+        
+        self.imageSize = self.tiledItem.imageSize
+        self.scene.setSceneRect(self.tiledItem.boundingRect())
         self.setScene(self.scene)
         
+        # done
+    
+    ## Show two other views composited into one, e.g. blended
+    #  The images are painted by the items of those views; only the visible part of each is painted.
+    #  @param self The object pointer.
+    #  @param viewA The view of the first image.
+    #  @param viewB The view of the image laid over it.
+    #  @return The OverlayItem, to choose the way of compositing.
+    def showOverlay(self, viewA, viewB):
+        if self.overlayItem is not None and self.overlayItem.views == (viewA, viewB):
+            self.refreshOverlay()
+            return self.overlayItem
+        
+        # clear previous items
+        itemset = self.scene.items()
+        for i in range(len(itemset)):
+            self.scene.removeItem(itemset[i])
+        self.tiledItem = None
+        
+        self.overlayItem = OverlayItem(viewA, viewB)
+        self.scene.addItem(self.overlayItem)
+        self.refreshOverlay()
+        return self.overlayItem
+    
+    ## Take note of new images, or a new alignment, in the overlaid views
+    #  @param self The object pointer.
+    def refreshOverlay(self):
+        if self.overlayItem is None:
+            return
+        self.overlayItem.refresh()
+        rect = self.overlayItem.boundingRect()
+        self.imageSize = rect.size().toSize() if not rect.isEmpty() else None
+        self.scene.setSceneRect(rect)
+        
+        # done
+    
+    ## Estimate the scale factor that fits the image in the view
+    #  @param self The object pointer.
+    def estimateScaleFactor(self):
         # estimate original scale factor, depending on the orientation
         self.width = self.geometry().width()
         self.height = self.geometry().height()
-        if self.image.height() > self.image.width():
+        if self.imageSize.height() > self.imageSize.width():
             # portrait
             self.isPortrait = True
             # scale factor is not greater than 1 at the start
-            if self.height < self.image.height():
-                self.originalScaleFactor = self.height / self.image.height()
+            if self.height < self.imageSize.height():
+                self.originalScaleFactor = self.height / self.imageSize.height()
             else:
                 self.originalScaleFactor = 1
         else:
             # landscape
             self.isPortrait = False
-            if self.width < self.image.width():
-                self.originalScaleFactor = self.width / self.image.width()
+            if self.width < self.imageSize.width():
+                self.originalScaleFactor = self.width / self.imageSize.width()
             else:
                 self.originalScaleFactor = 1
          
         # print(self.originalScaleFactor)
-        # the current scale factor is the same
-        self.currentScaleFactor = self.originalScaleFactor
-        
-        # image size is passed as return value
-        return self.image.size()
         
         # done
     
     ## Remove the loaded image, and clean up
     #  @param self The object pointer.
     def clearContainer(self):
-        # remove image from the scene
+        # stop loading, and remove image from the scene
+        self.loader.cancel()
         self.scene.clear()
+        self.tiledItem = None
+        self.overlayItem = None
+        self.draggingDivider = False
+        self.registration = None
+        self.imageSize = None
+        self.image = None
+        self.pixelArray = None
+        self.arrayImage = None
+        self.histogramIndex = None
+        # the next high bit depth image starts with its own window
+        self.toneMap = None
         # other settings
         self.sceneCenter = None
         self.width = 0
         self.height = 0
         self.originalScaleFactor = 1.0
         self.isPortrait = True
-        self.currenScaleFactor = 1.0
         
         # done
         
@@ -137,13 +573,12 @@ class ImageContainerView(QtGui.QGraphicsView):
     ## Mouse wheel rotated on the container
     #  @param self The object pointer.
     #  @param event The event pointer.
+    @traced("input")
     def wheelEvent(self, event):
         # this is the multiplication factor of scale
         scale = math.pow(2.0, -event.delta() / 240.0)
         # use directly for enlarging and shrinking
         self.containerDialog.respondToWheel(scale)
-        # absolute scale for dragging
-        self.currentScaleFactor *= scale
         
         # done
         
@@ -172,10 +607,59 @@ class ImageContainerView(QtGui.QGraphicsView):
     
     ## own events
     
+    ## Mouse button pressed on the container
+    #  In the swipe overlay, a press on the divider grabs it instead of the image.
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    @traced("input")
+    def mousePressEvent(self, event):
+        if event.button() == QtCore.Qt.LeftButton and self.overlayItem is not None:
+            if self.overlayItem.nearDivider(self.mapToScene(event.pos()).x(), self.transform().m11()):
+                self.draggingDivider = True
+                return
+        super(ImageContainerView, self).mousePressEvent(event)
+        
+        # done
+    
+    ## Mouse button released on the container
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    @traced("input")
+    def mouseReleaseEvent(self, event):
+        if self.draggingDivider:
+            self.draggingDivider = False
+            return
+        super(ImageContainerView, self).mouseReleaseEvent(event)
+        
+        # done
+    
+    ## Mouse left the container
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def leaveEvent(self, event):
+        super(ImageContainerView, self).leaveEvent(event)
+        if self.containerDialog is not None:
+            self.containerDialog.respondToHover(self, None)
+        
+        # done
+    
     ## Mouse moved on the container
     #  @param self The object pointer.
     #  @param event The event pointer.
+    @traced("input")
     def mouseMoveEvent(self, event):
+        # readout of the pixel under the mouse
+        if self.containerDialog is not None:
+            self.containerDialog.respondToHover(self, self.mapToScene(event.pos()))
+        
+        # the swipe divider follows the mouse, and shows that it can be grabbed
+        if self.overlayItem is not None:
+            x = self.mapToScene(event.pos()).x()
+            if self.draggingDivider:
+                self.overlayItem.setDivider(x)
+                return
+            self.viewport().setCursor(QtCore.Qt.SplitHCursor if self.overlayItem.nearDivider(x, self.transform().m11()) else QtCore.Qt.ArrowCursor)
+        
         if self.scene.dragStarted:
             if self.currentPos != None:
                 self.previousPos = self.currentPos
@@ -192,36 +676,30 @@ class ImageContainerView(QtGui.QGraphicsView):
                 translationX = self.currentPos.x() - self.previousPos.x()
                 translationY = self.currentPos.y() - self.previousPos.y()
                 
-                # get the ratio of scale factors
-                scaleRatio = self.currentScaleFactor/self.originalScaleFactor
+                # with Ctrl, dragging changes the window of high bit depth images instead
+                if event.modifiers() & QtCore.Qt.ControlModifier:
+                    self.containerDialog.respondToWindowDrag(translationX, translationY)
+                    return
+                
+                # get the ratio of scale factors, from the shared viewport
+                scaleRatio = self.viewportModel.scale
                 
                 # normalize translation
                 translationX /= scaleRatio
                 translationY /= scaleRatio
                 
-                # get the current viewable center
-                currentSceneRect = self.visibleRect()
-                currentSceneCenter = QtCore.QPointF(currentSceneRect.x() + currentSceneRect.width()/2.0,currentSceneRect.y() + currentSceneRect.height()/2.0)
-                        
-                # calculate the new center
-                newCenter = QtCore.QPointF(currentSceneCenter.x() - translationX, currentSceneCenter.y() - translationY)
-                
-                # send it upstairs
-                self.containerDialog.respondToDrag(newCenter)
+                # send it upstairs: the new center is worked out when the frame is drawn,
+                # so that several moves within one frame add up
+                self.containerDialog.respondToPan(translationX, translationY)
                 
                 # done
     
-    ## Scale the image for zooming in/out
+    ## Repaint the visible part of the scene
     #  @param self The object pointer.
-    #  @param scaleFactor The factor of magnification.
-    def scaleView(self, scaleFactor):
-        factor = self.matrix().scale(scaleFactor, scaleFactor).mapRect(QtCore.QRectF(0, 0, 1, 1)).width()
-        # don't make the image too small or too large        
-        if factor < kScaleFactorMin or factor > kScaleFactorMax:
-            return
-        # ready
-        self.scaleFactor = factor
-        self.scale(scaleFactor, scaleFactor)
+    #  @param event The event pointer.
+    @traced("paint")
+    def paintEvent(self, event):
+        super(ImageContainerView, self).paintEvent(event)
         
         # done
         
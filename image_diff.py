@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  image_diff.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Pixel-level differences between two images, computed with NumPy on small regions at a time.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# calculations
+import math
+import numpy
+
+# conversion of results for display
+from mapped_image import arrayToQImage
+
+# constants
+kDiffModes = ("Absolute", "Signed", "Mask")
+kDefaultGain = 4.0
+kTileSize = 256
+kRowsPerStripe = 256
+
+# colour maps as control points: position in [0, 1], then RGB
+kHeatColors = ((0.0, (0, 0, 4)), (0.25, (87, 16, 110)), (0.5, (188, 55, 84)), (0.75, (249, 142, 9)), (1.0, (252, 255, 164)))
+kDivergingColors = ((0.0, (59, 76, 192)), (0.5, (221, 221, 221)), (1.0, (180, 4, 38)))
+kMaskColor = (255, 0, 0)
+kMaskDimming = 0.35
+
+## Build a 256-entry colour lookup table from control points
+#  @param controlPoints Sequence of (position, (r, g, b)).
+def buildColorTable(controlPoints):
+    positions = [point[0] for point in controlPoints]
+    samples = numpy.linspace(0.0, 1.0, 256)
+    table = numpy.empty((256, 3), numpy.uint8)
+    for channel in range(3):
+        table[:, channel] = numpy.round(numpy.interp(samples, positions, [point[1][channel] for point in controlPoints]))
+    return table
+
+kHeatTable = buildColorTable(kHeatColors)
+kDivergingTable = buildColorTable(kDivergingColors)
+
+## Largest sample value of a data type, used to normalize differences
+#  @param dtype The NumPy data type.
+def valueRange(dtype):
+    if dtype.kind == 'f':
+        return 1.0
+    return float(numpy.iinfo(dtype).max)
+
+## Bring a region of an image into height x width x channels form, without alpha
+#  @param array The image array, height x width (x channels).
+def colorChannels(array):
+    if array.ndim == 2:
+        return array[:, :, numpy.newaxis]
+    if array.shape[2] == 4:
+        return array[:, :, :3]
+    return array
+
+## Common area of two images
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @return Height and width of the area both images cover.
+def commonShape(arrayA, arrayB):
+    return min(arrayA.shape[0], arrayB.shape[0]), min(arrayA.shape[1], arrayB.shape[1])
+
+## Data type that holds the difference of two images without overflow
+#  64-bit samples are differenced in double precision, as no integer type holds all their differences.
+#  @param dtypeA The NumPy data type of the first image.
+#  @param dtypeB The NumPy data type of the second image.
+def differenceType(dtypeA, dtypeB):
+    itemsize = max(dtypeA.itemsize, dtypeB.itemsize)
+    if itemsize >= 8:
+        return numpy.float64
+    if dtypeA.kind == 'f' or dtypeB.kind == 'f':
+        return numpy.float32
+    return numpy.int64 if itemsize >= 4 else numpy.int32
+
+## Per-channel signed difference B - A over a region
+#  @param regionA Region of the first image.
+#  @param regionB Region of the second image, same height and width.
+def signedDifference(regionA, regionB):
+    regionA = colorChannels(regionA)
+    regionB = colorChannels(regionB)
+    dtype = differenceType(regionA.dtype, regionB.dtype)
+    return regionB.astype(dtype) - regionA.astype(dtype)
+
+## Per-channel absolute difference over a region
+#  @param regionA Region of the first image.
+#  @param regionB Region of the second image, same height and width.
+def absoluteDifference(regionA, regionB):
+    return numpy.abs(signedDifference(regionA, regionB))
+
+## Pixels whose difference exceeds a threshold in any channel
+#  @param regionA Region of the first image.
+#  @param regionB Region of the second image, same height and width.
+#  @param threshold Largest difference still considered equal.
+def differenceMask(regionA, regionB, threshold=0):
+    return absoluteDifference(regionA, regionB).max(axis=2) > threshold
+
+## Colour-mapped difference of a region
+#  @param regionA Region of the first image.
+#  @param regionB Region of the second image, same height and width.
+#  @param mode One of kDiffModes.
+#  @param threshold Largest difference still considered equal (mask mode).
+#  @param gain Amplification of differences (absolute and signed modes).
+#  @return A height x width x 3 uint8 RGB array.
+def differenceHeatmap(regionA, regionB, mode="Absolute", threshold=0, gain=kDefaultGain):
+    scale = 255.0 * gain / valueRange(regionA.dtype)
+
+    if mode == "Signed":
+        # mean over channels; negative is blue, positive is red
+        difference = signedDifference(regionA, regionB).mean(axis=2)
+        index = numpy.clip(difference * (scale / 2.0) + 127.5, 0, 255).astype(numpy.uint8)
+        return kDivergingTable[index]
+
+    if mode == "Mask":
+        # dimmed first image, with differing pixels painted over
+        grey = colorChannels(regionA).mean(axis=2) * (kMaskDimming * 255.0 / valueRange(regionA.dtype))
+        heatmap = numpy.repeat(grey.astype(numpy.uint8)[:, :, numpy.newaxis], 3, axis=2)
+        heatmap[differenceMask(regionA, regionB, threshold)] = kMaskColor
+        return heatmap
+
+    difference = absoluteDifference(regionA, regionB).max(axis=2)
+    index = numpy.clip(difference * scale, 0, 255).astype(numpy.uint8)
+    return kHeatTable[index]
+
+## Partial metrics of a horizontal stripe of both images
+#  @param regionA Stripe of the first image.
+#  @param regionB Stripe of the second image, same height and width.
+#  @param rowOffset Row of the first line of the stripe in the full image.
+#  @param threshold Largest difference still considered equal.
+#  @return A dictionary to be combined with mergeMetrics.
+def stripeMetrics(regionA, regionB, rowOffset=0, threshold=0):
+    difference = absoluteDifference(regionA, regionB)
+    mask = difference.max(axis=2) > threshold
+    partial = {
+        'maxDiff': float(difference.max()) if difference.size else 0.0,
+        'sumAbsDiff': float(difference.sum(dtype=numpy.float64)),
+        'sumSquaredDiff': float(numpy.square(difference, dtype=numpy.float64).sum()),
+        'differingPixels': int(mask.sum()),
+        'samples': int(difference.size),
+        'bbox': None,
+    }
+    if partial['differingPixels']:
+        rows = numpy.flatnonzero(mask.any(axis=1))
+        columns = numpy.flatnonzero(mask.any(axis=0))
+        partial['bbox'] = (int(columns[0]), int(rows[0]) + rowOffset, int(columns[-1]), int(rows[-1]) + rowOffset)
+    return partial
+
+## Combine partial metrics into the metrics of the whole image
+#  @param partials Sequence of dictionaries from stripeMetrics.
+#  @param maxValue Largest sample value, for PSNR.
+#  @return A dictionary with maxDiff, meanAbsDiff, psnr (None for identical images),
+#          differingPixels and bbox ([x, y, width, height] of the changes, or None).
+def mergeMetrics(partials, maxValue=255.0):
+    maxDiff = 0.0
+    sumAbsDiff = 0.0
+    sumSquaredDiff = 0.0
+    differingPixels = 0
+    samples = 0
+    bbox = None
+    for partial in partials:
+        maxDiff = max(maxDiff, partial['maxDiff'])
+        sumAbsDiff += partial['sumAbsDiff']
+        sumSquaredDiff += partial['sumSquaredDiff']
+        differingPixels += partial['differingPixels']
+        samples += partial['samples']
+        if partial['bbox'] is not None:
+            if bbox is None:
+                bbox = partial['bbox']
+            else:
+                bbox = (min(bbox[0], partial['bbox'][0]), min(bbox[1], partial['bbox'][1]), max(bbox[2], partial['bbox'][2]), max(bbox[3], partial['bbox'][3]))
+
+    meanSquaredDiff = sumSquaredDiff / samples if samples else 0.0
+    return {
+        'maxDiff': maxDiff,
+        'meanAbsDiff': sumAbsDiff / samples if samples else 0.0,
+        'psnr': 10.0 * math.log10(maxValue * maxValue / meanSquaredDiff) if meanSquaredDiff > 0 else None,
+        'differingPixels': differingPixels,
+        'bbox': None if bbox is None else [bbox[0], bbox[1], bbox[2] - bbox[0] + 1, bbox[3] - bbox[1] + 1],
+    }
+
+## Global difference metrics of two images
+#  The images are processed in stripes of rows, so memory use does not grow with the image.
+#  Only the area covered by both images is compared.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param threshold Largest difference still considered equal.
+#  @param rowsPerStripe Number of rows processed at once.
+def computeMetrics(arrayA, arrayB, threshold=0, rowsPerStripe=kRowsPerStripe):
+    height, width = commonShape(arrayA, arrayB)
+    partials = []
+    for top in range(0, height, rowsPerStripe):
+        bottom = min(top + rowsPerStripe, height)
+        partials.append(stripeMetrics(arrayA[top:bottom, :width], arrayB[top:bottom, :width], top, threshold))
+    return mergeMetrics(partials, valueRange(arrayA.dtype))
+
+## DiffTileSource
+#
+#  Tile source for TiledImageItem that shows the difference of two images.
+#  Tiles are computed only when they are painted, from a strided view of each image,
+#  so no full-frame difference array ever exists.
+class DiffTileSource(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    #  @param mode One of kDiffModes.
+    #  @param threshold Largest difference still considered equal (mask mode).
+    #  @param gain Amplification of differences.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, arrayA, arrayB, mode="Absolute", threshold=0, gain=kDefaultGain, tileSize=kTileSize):
+        self.arrayA = arrayA
+        self.arrayB = arrayB
+        self.mode = mode
+        self.threshold = threshold
+        self.gain = gain
+        self.tileSize = tileSize
+        self.height, self.width = commonShape(arrayA, arrayB)
+
+        longestSide = max(self.width, self.height, 1)
+        self.numLevels = max(1, int(math.ceil(math.log(float(longestSide) / tileSize, 2))) + 1)
+
+        # done
+
+    ## Size of the compared area
+    #  @param self The object pointer.
+    def size(self):
+        return QtCore.QSize(self.width, self.height)
+
+    ## Number of pyramid levels
+    #  @param self The object pointer.
+    def levelCount(self):
+        return self.numLevels
+
+    ## Size of the compared area at a given pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelSize(self, level):
+        factor = 2 ** level
+        return QtCore.QSize(max(1, -(-self.width // factor)), max(1, -(-self.height // factor)))
+
+    ## Region of both images for a tile, subsampled for the pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileRegions(self, level, rect):
+        factor = 2 ** level
+        rows = slice(rect.top() * factor, min((rect.top() + rect.height()) * factor, self.height), factor)
+        columns = slice(rect.left() * factor, min((rect.left() + rect.width()) * factor, self.width), factor)
+        return self.arrayA[rows, columns], self.arrayB[rows, columns]
+
+    ## Image data for one tile
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileImage(self, level, rect):
+        regionA, regionB = self.tileRegions(level, rect)
+        return arrayToQImage(differenceHeatmap(regionA, regionB, self.mode, self.threshold, self.gain))
+
+    ## Differences of some pixels, for labelling them at high magnification
+    #  @param self The object pointer.
+    #  @param rect The pixels, at full resolution.
+    #  @return Rows of per-pixel lists of differences: absolute in absolute mode, B - A otherwise.
+    def pixelValues(self, rect):
+        regionA, regionB = self.tileRegions(0, rect)
+        if self.mode == "Absolute":
+            return absoluteDifference(regionA, regionB).tolist()
+        return signedDifference(regionA, regionB).tolist()
+
+# end
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  image_loader.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# file handling
+import os
+
+# recently decoded images
+from image_cache import decodedImageCache, kPyramidCacheVariable, kSharedPixelThreshold
+
+# optional subsystems, imported when first used
+from lazy_import import lazyImport
+
+# optional: decoded pyramids kept on disk need NumPy; the cache is only used if it is configured
+pyramid_cache = lazyImport('pyramid_cache', 'numpy') if os.environ.get(kPyramidCacheVariable) else None
+
+# optional: large images are kept in shared memory for comparisons on all cores
+parallel_diff = lazyImport('parallel_diff', 'numpy')
+
+# timed spans for the instrumentation display and traces
+from instrumentation import traced
+
+# constants
+kPreviewMaxSide = 1024
+
+## Size of an image file, read from its header only
+#  @param filePath The path to the image.
+def readImageSize(filePath):
+    return QtGui.QImageReader(filePath).size()
+
+## Decode a reduced-resolution version of an image
+#  Returns None when the image format cannot be decoded at a smaller size directly,
+#  because a preview would then cost as much as the full decode.
+#  @param filePath The path to the image.
+#  @param maxSide The longest side of the preview, in pixels.
+@traced("decode")
+def decodePreview(filePath, maxSide=kPreviewMaxSide):
+    reader = QtGui.QImageReader(filePath)
+    size = reader.size()
+    if not size.isValid() or max(size.width(), size.height()) <= maxSide:
+        return None
+    if not reader.supportsOption(QtGui.QImageIOHandler.ScaledSize):
+        return None
+    reader.setScaledSize(size.scaled(maxSide, maxSide, QtCore.Qt.KeepAspectRatio))
+    image = reader.read()
+    if image.isNull():
+        return None
+    return image
+
+## Decode an image at full resolution
+#  QImage (unlike QPixmap) can safely be created outside the GUI thread.
+#  @param filePath The path to the image.
+@traced("decode")
+def decodeImage(filePath):
+    return QtGui.QImageReader(filePath).read()
+
+## Move a large decoded image into shared memory, where worker processes can read it in place
+#  @param image The decoded QImage.
+#  @return The image in shared memory, or the image itself.
+@traced("decode")
+def shareImage(image):
+    if parallel_diff is None or image.width() * image.height() < kSharedPixelThreshold:
+        return image
+    return parallel_diff.sharedImage(image)
+
+## Image from the on-disk pyramid cache, if it is enabled and has the same file version
+#  The image shares the mapped memory of the cache entry; its pyramid is attached as pyramidSource.
+#  @param filePath The path to the image.
+#  @return The QImage, or None.
+@traced("cache")
+def loadCachedPyramid(filePath):
+    if pyramid_cache is None or pyramid_cache.pyramidCache is None:
+        return None
+    source = pyramid_cache.pyramidCache.load(filePath)
+    if source is None:
+        return None
+    image = source.image()
+    image.pyramidSource = source
+    return image
+
+## Store a decoded image in the on-disk pyramid cache, if it is enabled
+#  @param filePath The path to the image.
+#  @param image The decoded QImage.
+@traced("cache")
+def storeCachedPyramid(filePath, image):
+    if pyramid_cache is not None and pyramid_cache.pyramidCache is not None:
+        pyramid_cache.pyramidCache.store(filePath, image)
+
+    # done
+
+## Decode an image at full resolution, unless the same file version is in one of the caches
+#  @param filePath The path to the image.
+def decodeImageCached(filePath):
+    image = decodedImageCache.get(filePath)
+    if image is None:
+        image = loadCachedPyramid(filePath)
+    if image is None:
+        image = shareImage(decodeImage(filePath))
+        decodedImageCache.put(filePath, image)
+        storeCachedPyramid(filePath, image)
+    return image
+
+## ImageLoadSignals
+#
+#  Carries results from the worker threads back to the GUI thread.
+class ImageLoadSignals(QtCore.QObject):
+    # request id, preview image, full size
+    previewReady = QtCore.pyqtSignal(int, object, object)
+    # request id, full resolution image
+    imageReady = QtCore.pyqtSignal(int, object)
+
+## ImageLoadTask
+#
+#  Decodes one image on a worker thread: first a preview, then the full image.
+class ImageLoadTask(QtCore.QRunnable):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param requestId The id of the load request.
+    #  @param filePath The path to the image.
+    #  @param signals The ImageLoadSignals to report to.
+    def __init__(self, requestId, filePath, signals):
+        super(ImageLoadTask, self).__init__()
+        self.requestId = requestId
+        self.filePath = filePath
+        self.signals = signals
+        self.cancelled = False
+
+        # done
+
+    ## Decode the image
+    #  @param self The object pointer.
+    def run(self):
+        if self.cancelled:
+            return
+
+        # no decoding at all for a recently viewed file, or one whose pyramid is on disk
+        image = decodedImageCache.get(self.filePath)
+        if image is None:
+            image = loadCachedPyramid(self.filePath)
+        if image is not None:
+            self.signals.imageReady.emit(self.requestId, image)
+            return
+
+        # cheap preview first, if the format allows it
+        preview = decodePreview(self.filePath)
+        if preview is not None and not self.cancelled:
+            self.signals.previewReady.emit(self.requestId, preview, readImageSize(self.filePath))
+
+        if self.cancelled:
+            return
+
+        # then the real thing
+        image = shareImage(decodeImage(self.filePath))
+        decodedImageCache.put(self.filePath, image)
+        if not self.cancelled:
+            self.signals.imageReady.emit(self.requestId, image)
+
+        # the next open, also by another process, only reads the tiles it shows
+        storeCachedPyramid(self.filePath, image)
+
+        # done
+
+## ImageLoader
+#
+#  Loads images for one container on the shared thread pool.
+#  Starting a new load cancels the previous one; results of stale requests are dropped.
+class ImageLoader(QtCore.QObject):
+    # preview image, full size
+    previewLoaded = QtCore.pyqtSignal(object, object)
+    # full resolution image
+    imageLoaded = QtCore.pyqtSignal(object)
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The parent object.
+    def __init__(self, parent=None):
+        super(ImageLoader, self).__init__(parent)
+        self.pool = QtCore.QThreadPool.globalInstance()
+        self.signals = ImageLoadSignals(self)
+        self.signals.previewReady.connect(self.onPreviewReady)
+        self.signals.imageReady.connect(self.onImageReady)
+
+        # request state
+        self.requestId = 0
+        self.task = None
+
+        # done
+
+    ## Start loading an image in the background
+    #  @param self The object pointer.
+    #  @param filePath The path to the image.
+    def load(self, filePath):
+        self.cancel()
+        self.requestId += 1
+        self.task = ImageLoadTask(self.requestId, filePath, self.signals)
+        self.pool.start(self.task)
+
+        # done
+
+    ## Cancel the current load, if any
+    #  @param self The object pointer.
+    def cancel(self):
+        if self.task is not None:
+            self.task.cancelled = True
+            self.task = None
+        # anything still in flight is now stale
+        self.requestId += 1
+
+        # done
+
+    ## Whether a load is in progress
+    #  @param self The object pointer.
+    def isLoading(self):
+        return self.task is not None
+
+    ## Preview decoded on a worker thread
+    #  @param self The object pointer.
+    #  @param requestId The id of the load request.
+    #  @param image The preview image.
+    #  @param fullSize The size of the full resolution image.
+    def onPreviewReady(self, requestId, image, fullSize):
+        if requestId == self.requestId:
+            self.previewLoaded.emit(image, fullSize)
+
+        # done
+
+    ## Full image decoded on a worker thread
+    #  @param self The object pointer.
+    #  @param requestId The id of the load request.
+    #  @param image The decoded image.
+    def onImageReady(self, requestId, image):
+        if requestId == self.requestId:
+            self.task = None
+            self.imageLoaded.emit(image)
+
+        # done
+
+# end
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  image_overlay.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Overlay of two images in a single view: alpha blend, flicker, or a swipe divider.
+#  The images are painted by the items of their own (hidden) views, so tiles and pyramids are shared,
+#  and only the part of each image that is visible in the composite is painted.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# timed spans for the instrumentation display and traces
+from instrumentation import traced
+
+# constants
+kOverlayModes = ("Blend", "Flicker", "Swipe")
+kDefaultOpacity = 0.5
+kFlickerInterval = 500
+kSwipeGrabDistance = 8
+kDividerColor = QtGui.QColor(255, 255, 0)
+
+## Transformation from the scene of a view to viewport coordinates (pixels of the first image)
+#  @param view The ImageContainerView.
+def sceneToModelTransform(view):
+    registration = view.registration
+    if registration is None:
+        return QtGui.QTransform()
+    # a point x of the first image is at scale * x + offset in the view's scene
+    modelToScene = QtGui.QTransform(registration.scale, 0.0, 0.0, registration.scale, registration.offsetX, registration.offsetY)
+    return modelToScene.inverted()[0]
+
+## OverlayItem
+#
+#  Scene item that composites the images of two views, in viewport coordinates.
+class OverlayItem(QtGui.QGraphicsItem):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param viewA The view of the first image; its scene is the viewport.
+    #  @param viewB The view of the image laid over it.
+    #  @param parent The parent item, if any.
+    def __init__(self, viewA, viewB, parent=None):
+        super(OverlayItem, self).__init__(parent)
+        self.views = (viewA, viewB)
+        self.mode = kOverlayModes[0]
+        self.opacity = kDefaultOpacity
+        self.showSecond = False
+        self.dividerX = None
+        self.rect = QtCore.QRectF()
+
+        # we need the exposed rectangle while painting
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+        self.refresh()
+
+        # done
+
+    ## Area covered by either image
+    #  @param self The object pointer.
+    def boundingRect(self):
+        return self.rect
+
+    ## Take note of new images or a new alignment in the source views
+    #  @param self The object pointer.
+    def refresh(self):
+        rect = QtCore.QRectF()
+        for view in self.views:
+            if view.imageSize is not None:
+                rect = rect.united(sceneToModelTransform(view).mapRect(view.scene.sceneRect()))
+        if rect != self.rect:
+            self.prepareGeometryChange()
+            self.rect = rect
+        if self.dividerX is None and not rect.isEmpty():
+            self.dividerX = rect.center().x()
+        self.update()
+
+        # done
+
+    ## Choose how the images are combined
+    #  @param self The object pointer.
+    #  @param mode One of kOverlayModes.
+    def setMode(self, mode):
+        self.mode = mode
+        self.update()
+
+        # done
+
+    ## Set the opacity of the second image, in blend mode
+    #  @param self The object pointer.
+    #  @param opacity From 0 (first image only) to 1 (second image only).
+    def setOpacity(self, opacity):
+        self.opacity = min(1.0, max(0.0, opacity))
+        self.update()
+
+        # done
+
+    ## Show the other image, in flicker mode
+    #  @param self The object pointer.
+    def flicker(self):
+        self.showSecond = not self.showSecond
+        self.update()
+
+        # done
+
+    ## Move the swipe divider
+    #  @param self The object pointer.
+    #  @param x The position of the divider, in pixels of the first image.
+    def setDivider(self, x):
+        self.dividerX = min(self.rect.right(), max(self.rect.left(), x))
+        self.update()
+
+        # done
+
+    ## Whether a point is close enough to the swipe divider to grab it
+    #  @param self The object pointer.
+    #  @param x The x coordinate of the point, in pixels of the first image.
+    #  @param scale Number of screen pixels per image pixel.
+    def nearDivider(self, x, scale):
+        if self.mode != "Swipe" or self.dividerX is None:
+            return False
+        return abs(x - self.dividerX) * scale <= kSwipeGrabDistance
+
+    ## Paint part of one image
+    #  @param self The object pointer.
+    #  @param painter The painter, in viewport coordinates.
+    #  @param option The style options of the overlay item.
+    #  @param widget The widget being painted on.
+    #  @param index 0 for the first image, 1 for the second.
+    #  @param rect The area to paint, in viewport coordinates.
+    def paintImage(self, painter, option, widget, index, rect):
+        view = self.views[index]
+        items = view.scene.items() if view.imageSize is not None else []
+        if not items or rect.isEmpty():
+            return
+
+        painter.save()
+        painter.setClipRect(rect, QtCore.Qt.IntersectClip)
+        modelTransform = sceneToModelTransform(view)
+        for item in items:
+            # the item's own transformation, e.g. that of a stretched preview, comes first
+            itemTransform = item.sceneTransform() * modelTransform
+            exposed = itemTransform.inverted()[0].mapRect(rect).intersected(item.boundingRect())
+            if exposed.isEmpty():
+                continue
+            itemOption = QtGui.QStyleOptionGraphicsItem(option)
+            itemOption.exposedRect = exposed
+            painter.save()
+            painter.setTransform(itemTransform, True)
+            item.paint(painter, itemOption, widget)
+            painter.restore()
+        painter.restore()
+
+        # done
+
+    ## Draw the composite of the exposed rectangle
+    #  @param self The object pointer.
+    #  @param painter The painter.
+    #  @param option The style options, with the exposed rectangle.
+    #  @param widget The widget being painted on.
+    @traced("paint")
+    def paint(self, painter, option, widget=None):
+        exposed = option.exposedRect.intersected(self.rect)
+        if exposed.isEmpty():
+            return
+
+        if self.mode == "Flicker":
+            self.paintImage(painter, option, widget, 1 if self.showSecond else 0, exposed)
+
+        elif self.mode == "Swipe":
+            # first image on the left of the divider, second on the right
+            left = QtCore.QRectF(exposed)
+            left.setRight(min(exposed.right(), self.dividerX))
+            right = QtCore.QRectF(exposed)
+            right.setLeft(max(exposed.left(), self.dividerX))
+            if left.width() > 0:
+                self.paintImage(painter, option, widget, 0, left)
+            if right.width() > 0:
+                self.paintImage(painter, option, widget, 1, right)
+            pen = QtGui.QPen(kDividerColor)
+            pen.setCosmetic(True)
+            painter.setPen(pen)
+            painter.drawLine(QtCore.QLineF(self.dividerX, exposed.top(), self.dividerX, exposed.bottom()))
+
+        else:
+            # an opaque image hides the other one completely
+            if self.opacity < 1.0:
+                self.paintImage(painter, option, widget, 0, exposed)
+            if self.opacity > 0.0:
+                painter.save()
+                painter.setOpacity(painter.opacity() * self.opacity)
+                self.paintImage(painter, option, widget, 1, exposed)
+                painter.restore()
+
+        # done
+
+# end
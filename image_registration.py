@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  image_registration.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Alignment of two images that are shifted, cropped differently or (optionally) scaled.
+#  Phase correlation runs on a coarse grid of samples first, then on small patches at ever finer
+#  sampling steps, so the cost does not depend on the image size. Full-resolution data is only
+#  read at the sample positions.
+#
+
+# calculations
+import math
+import numpy
+
+# channel handling shared with the difference engine
+from image_diff import colorChannels
+
+# constants
+kCoarseSide = 256
+kPatchSize = 128
+kScaleGridSize = 256
+kLogPolarSize = 256
+kMinPeak = 0.05
+kMinScalePeak = 0.02
+kMaxScale = 8.0
+kScaleSnap = 1e-3
+kResampleRows = 256
+
+## Registration
+#
+#  Maps pixel coordinates of the first image to the second one:
+#  a point (x, y) of the first image shows up at (scale * x + offsetX, scale * y + offsetY) in the second.
+class Registration(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param offsetX Horizontal offset, in pixels of the second image.
+    #  @param offsetY Vertical offset, in pixels of the second image.
+    #  @param scale Size of the second image relative to the first.
+    #  @param confidence Height of the correlation peak, 0 to 1.
+    def __init__(self, offsetX=0.0, offsetY=0.0, scale=1.0, confidence=1.0):
+        self.offsetX = offsetX
+        self.offsetY = offsetY
+        self.scale = scale
+        self.confidence = confidence
+
+        # done
+
+    ## Position of a point of the first image in the second
+    #  @param self The object pointer.
+    #  @param x The x coordinate in the first image.
+    #  @param y The y coordinate in the first image.
+    def mapPoint(self, x, y):
+        return self.scale * x + self.offsetX, self.scale * y + self.offsetY
+
+    ## Position of a point of the second image in the first
+    #  @param self The object pointer.
+    #  @param x The x coordinate in the second image.
+    #  @param y The y coordinate in the second image.
+    def inverseMapPoint(self, x, y):
+        return (x - self.offsetX) / self.scale, (y - self.offsetY) / self.scale
+
+    ## Whether the images are only shifted against each other
+    #  @param self The object pointer.
+    def isTranslation(self):
+        return self.scale == 1.0
+
+    ## Short description for display
+    #  @param self The object pointer.
+    def describe(self):
+        text = "shift x=%.1f, y=%.1f px" % (self.offsetX, self.offsetY)
+        if not self.isTranslation():
+            text += ", scale %.4f" % self.scale
+        return text + " (confidence %.2f)" % self.confidence
+
+## Indices of the pixels nearest to some positions, clamped to the image
+#  Halves are always rounded up; NumPy's round-half-to-even would make equally spaced samples uneven.
+#  @param positions The positions, in pixels.
+#  @param length The number of pixels.
+def nearestIndices(positions, length):
+    return numpy.clip(numpy.floor(positions + 0.5), 0, length - 1).astype(numpy.intp)
+
+## Grey values of an image on a regular grid of sample positions
+#  Each sample averages four pixels half a step apart, which is cheap and keeps aliasing down.
+#  Positions outside the image take the value of the nearest border pixel.
+#  @param array The image array, height x width (x channels).
+#  @param left The x coordinate of the first sample.
+#  @param top The y coordinate of the first sample.
+#  @param step Distance between samples, in pixels.
+#  @param columns Number of samples per row.
+#  @param rows Number of rows of samples.
+def greySamples(array, left, top, step, columns, rows):
+    height, width = array.shape[:2]
+    offsets = (0.0, step / 2.0) if step >= 2.0 else (0.0,)
+    grey = numpy.zeros((rows, columns), numpy.float32)
+    for offsetY in offsets:
+        ys = nearestIndices(top + offsetY + step * numpy.arange(rows), height)
+        for offsetX in offsets:
+            xs = nearestIndices(left + offsetX + step * numpy.arange(columns), width)
+            grey += colorChannels(array[ys[:, numpy.newaxis], xs])[:, :, :3].mean(axis=2, dtype=numpy.float32)
+    return grey / (len(offsets) ** 2)
+
+## Two-dimensional Hann window
+#  @param shape Height and width.
+def hannWindow(shape):
+    return numpy.outer(numpy.hanning(shape[0]), numpy.hanning(shape[1])).astype(numpy.float32)
+
+## Offset of a peak from a sample position, from a parabola through three samples
+#  @param before The value before the peak.
+#  @param peak The value at the peak.
+#  @param after The value after the peak.
+def subpixelOffset(before, peak, after):
+    curvature = before - 2.0 * peak + after
+    if curvature >= 0:
+        return 0.0
+    return max(-0.5, min(0.5, 0.5 * (before - after) / curvature))
+
+## Shift between two equally sized grids, by phase correlation
+#  @param gridA The first grid.
+#  @param gridB The second grid, showing the first one moved by the shift.
+#  @return (shiftX, shiftY, peak): gridB[y, x] is about gridA[y - shiftY, x - shiftX];
+#          the peak (0 to 1) tells how well the grids match.
+def phaseCorrelation(gridA, gridB):
+    window = hannWindow(gridA.shape)
+    spectrumA = numpy.fft.rfft2((gridA - gridA.mean()) * window)
+    spectrumB = numpy.fft.rfft2((gridB - gridB.mean()) * window)
+    crossPower = spectrumB * numpy.conj(spectrumA)
+    crossPower /= numpy.maximum(numpy.abs(crossPower), 1e-12)
+    surface = numpy.fft.irfft2(crossPower, s=gridA.shape)
+
+    rows, columns = surface.shape
+    peakY, peakX = numpy.unravel_index(numpy.argmax(surface), surface.shape)
+    peak = surface[peakY, peakX]
+    shiftY = peakY + subpixelOffset(surface[(peakY - 1) % rows, peakX], peak, surface[(peakY + 1) % rows, peakX])
+    shiftX = peakX + subpixelOffset(surface[peakY, (peakX - 1) % columns], peak, surface[peakY, (peakX + 1) % columns])
+
+    # the surface wraps around: large shifts are negative ones
+    if shiftY > rows / 2.0:
+        shiftY -= rows
+    if shiftX > columns / 2.0:
+        shiftX -= columns
+    return shiftX, shiftY, float(peak)
+
+## Log-polar resampling of the high-passed magnitude spectrum of a grid
+#  A scale change of the grid becomes a shift along the radius axis.
+#  @param grid A square grid.
+#  @return The log-polar spectrum (angles x radii) and the ratio between successive radii.
+def logPolarSpectrum(grid):
+    size = grid.shape[0]
+    spectrum = numpy.abs(numpy.fft.fftshift(numpy.fft.fft2((grid - grid.mean()) * hannWindow(grid.shape))))
+
+    # low frequencies dominate every spectrum; weigh them down
+    frequencies = numpy.fft.fftshift(numpy.fft.fftfreq(size))
+    cosine = numpy.cos(numpy.pi * frequencies)[:, numpy.newaxis] * numpy.cos(numpy.pi * frequencies)[numpy.newaxis, :]
+    spectrum *= (1.0 - cosine) * (2.0 - cosine)
+
+    # the magnitude spectrum is symmetric, so half a turn is enough
+    radiusBase = (size / 2.0) ** (1.0 / kLogPolarSize)
+    radii = radiusBase ** numpy.arange(kLogPolarSize)
+    angles = numpy.linspace(0.0, numpy.pi, kLogPolarSize, endpoint=False)
+    ys = size // 2 + numpy.sin(angles)[:, numpy.newaxis] * radii
+    xs = size // 2 + numpy.cos(angles)[:, numpy.newaxis] * radii
+
+    # bilinear interpolation
+    y0 = numpy.clip(numpy.floor(ys).astype(numpy.intp), 0, size - 2)
+    x0 = numpy.clip(numpy.floor(xs).astype(numpy.intp), 0, size - 2)
+    fy = numpy.clip(ys - y0, 0.0, 1.0)
+    fx = numpy.clip(xs - x0, 0.0, 1.0)
+    top = spectrum[y0, x0] * (1.0 - fx) + spectrum[y0, x0 + 1] * fx
+    bottom = spectrum[y0 + 1, x0] * (1.0 - fx) + spectrum[y0 + 1, x0 + 1] * fx
+    return (top * (1.0 - fy) + bottom * fy).astype(numpy.float32), radiusBase
+
+## Scale of the second image relative to the first, from the log-polar spectra (Fourier-Mellin)
+#  Both images are sampled with the same step, on a square around their centres that fits in both.
+#  Works best for moderate scales (within about a factor of two), where the sampled areas mostly overlap.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @return The scale, or 1.0 if none was found.
+def estimateScale(arrayA, arrayB):
+    side = float(min(arrayA.shape[:2] + arrayB.shape[:2]))
+    step = side / kScaleGridSize
+    grids = []
+    for array in (arrayA, arrayB):
+        height, width = array.shape[:2]
+        grids.append(greySamples(array, (width - side) / 2.0, (height - side) / 2.0, step, kScaleGridSize, kScaleGridSize))
+    spectrumA, radiusBase = logPolarSpectrum(grids[0])
+    spectrumB, radiusBase = logPolarSpectrum(grids[1])
+
+    # a larger second image has a smaller spectrum
+    shiftRadius, shiftAngle, peak = phaseCorrelation(spectrumA, spectrumB)
+    scale = radiusBase ** -shiftRadius
+    if peak < kMinScalePeak or not 1.0 / kMaxScale <= scale <= kMaxScale:
+        return 1.0
+    return scale
+
+## Part of the first image that the second one also shows
+#  @param shapeA Shape of the first image.
+#  @param shapeB Shape of the second image.
+#  @param registration The current Registration.
+#  @return (left, top, right, bottom) in pixels of the first image; empty if they do not overlap.
+def overlapRect(shapeA, shapeB, registration):
+    left, top = registration.inverseMapPoint(0, 0)
+    right, bottom = registration.inverseMapPoint(shapeB[1], shapeB[0])
+    return max(0.0, left), max(0.0, top), min(float(shapeA[1]), right), min(float(shapeA[0]), bottom)
+
+## Residual shift of a patch, with the current estimate applied
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param registration The current Registration.
+#  @param centerX The x coordinate of the patch centre, in the first image.
+#  @param centerY The y coordinate of the patch centre, in the first image.
+#  @param step Distance between samples in the first image, in pixels.
+#  @return The remaining shift (x, y) in pixels of the second image and the correlation peak,
+#          or None if the patch does not match.
+def patchResidual(arrayA, arrayB, registration, centerX, centerY, step):
+    left = math.floor(centerX - step * kPatchSize / 2.0 + 0.5)
+    top = math.floor(centerY - step * kPatchSize / 2.0 + 0.5)
+    patchA = greySamples(arrayA, left, top, step, kPatchSize, kPatchSize)
+
+    # the second patch starts on the pixel nearest to where the first one is expected;
+    # the rounding is part of the measured shift
+    leftB, topB = registration.mapPoint(left, top)
+    roundedLeftB = math.floor(leftB + 0.5)
+    roundedTopB = math.floor(topB + 0.5)
+    patchB = greySamples(arrayB, roundedLeftB, roundedTopB, step * registration.scale, kPatchSize, kPatchSize)
+    shiftX, shiftY, peak = phaseCorrelation(patchA, patchB)
+    if peak < kMinPeak:
+        return None
+    factor = step * registration.scale
+    return shiftX * factor + roundedLeftB - leftB, shiftY * factor + roundedTopB - topB, peak
+
+## Find the translation (and optionally the scale) that aligns the second image with the first
+#  The coarse estimate comes from the whole images on a grid of about kCoarseSide samples;
+#  patches around the centre of the overlap then refine it, halving the step until it is one pixel.
+#  With scale estimation, patches left/right and above/below the centre also correct the scale.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param withScale True to estimate a scale too.
+#  @return The Registration.
+def register(arrayA, arrayB, withScale=False):
+    shapeA = arrayA.shape[:2]
+    shapeB = arrayB.shape[:2]
+    # power-of-two steps keep the samples of successive levels on the same pixels
+    step = 2.0 ** max(0, int(math.ceil(math.log(max(shapeA + shapeB) / float(kCoarseSide), 2))))
+    scale = estimateScale(arrayA, arrayB) if withScale else 1.0
+
+    # coarse: both images on the same grid, the second one at the scale of the first
+    rows = int(math.ceil(max(shapeA[0], shapeB[0] / scale) / step))
+    columns = int(math.ceil(max(shapeA[1], shapeB[1] / scale) / step))
+    gridA = padded(greySamples(arrayA, 0, 0, step, int(math.ceil(shapeA[1] / step)), int(math.ceil(shapeA[0] / step))), rows, columns)
+    gridB = padded(greySamples(arrayB, 0, 0, step * scale, int(math.ceil(shapeB[1] / (step * scale))), int(math.ceil(shapeB[0] / (step * scale)))), rows, columns)
+    shiftX, shiftY, peak = phaseCorrelation(gridA, gridB)
+    registration = Registration(shiftX * step * scale, shiftY * step * scale, scale, peak)
+
+    # fine: patches with ever smaller steps
+    while True:
+        step = max(1.0, step / 2.0)
+        left, top, right, bottom = overlapRect(shapeA, shapeB, registration)
+        if right <= left or bottom <= top:
+            break
+        centerX = (left + right) / 2.0
+        centerY = (top + bottom) / 2.0
+        residual = patchResidual(arrayA, arrayB, registration, centerX, centerY, step)
+        if residual is not None:
+            registration.offsetX += residual[0]
+            registration.offsetY += residual[1]
+            registration.confidence = residual[2]
+            if withScale:
+                refineScale(arrayA, arrayB, registration, (left, top, right, bottom), step)
+                if abs(registration.scale - 1.0) < kScaleSnap:
+                    # no real scale: keep the overlap centre where it is, and refine a plain translation
+                    registration.offsetX += (registration.scale - 1.0) * centerX
+                    registration.offsetY += (registration.scale - 1.0) * centerY
+                    registration.scale = 1.0
+                    withScale = False
+                    continue
+        if step == 1.0:
+            break
+    return registration
+
+## Correct the scale from the residual shifts of patches on either side of the overlap centre
+#  A scale error shows up as residuals that grow with the distance from the centre.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param registration The Registration; updated in place.
+#  @param overlap The overlap rectangle (left, top, right, bottom) in the first image.
+#  @param step Distance between samples in the first image, in pixels.
+def refineScale(arrayA, arrayB, registration, overlap, step):
+    left, top, right, bottom = overlap
+    centerX = (left + right) / 2.0
+    centerY = (top + bottom) / 2.0
+    distanceX = (right - left) / 4.0
+    distanceY = (bottom - top) / 4.0
+    corrections = []
+    for axis, distance in ((0, distanceX), (1, distanceY)):
+        if distance < step * kPatchSize / 2.0:
+            continue
+        before = patchResidual(arrayA, arrayB, registration, centerX - distance * (axis == 0), centerY - distance * (axis == 1), step)
+        after = patchResidual(arrayA, arrayB, registration, centerX + distance * (axis == 0), centerY + distance * (axis == 1), step)
+        if before is not None and after is not None:
+            corrections.append((after[axis] - before[axis]) / (2.0 * distance))
+    if not corrections:
+        return
+
+    # keep the overlap centre where it is
+    correction = sum(corrections) / len(corrections)
+    registration.scale += correction
+    registration.offsetX -= correction * centerX
+    registration.offsetY -= correction * centerY
+
+    # done
+
+## Pad a grid with its mean value, at the bottom and on the right
+#  @param grid The grid.
+#  @param rows The number of rows wanted.
+#  @param columns The number of columns wanted.
+def padded(grid, rows, columns):
+    result = numpy.empty((rows, columns), numpy.float32)
+    result.fill(grid.mean())
+    result[:min(rows, grid.shape[0]), :min(columns, grid.shape[1])] = grid[:rows, :columns]
+    return result
+
+## Parts of both images that show the same area, pixel for pixel
+#  For a plain translation both parts are views of the original arrays.
+#  With a scale, the second part is resampled (nearest neighbour) into a new array, a stripe at a time.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param registration The Registration.
+#  @return The two arrays of equal height and width, and the (left, top) position of the area in the first image.
+def alignedArrays(arrayA, arrayB, registration):
+    heightA, widthA = arrayA.shape[:2]
+    heightB, widthB = arrayB.shape[:2]
+    if registration.isTranslation():
+        offsetX = int(round(registration.offsetX))
+        offsetY = int(round(registration.offsetY))
+        left, top = max(0, -offsetX), max(0, -offsetY)
+        right, bottom = min(widthA, widthB - offsetX), min(heightA, heightB - offsetY)
+        if right <= left or bottom <= top:
+            raise ValueError("the images do not overlap")
+        return arrayA[top:bottom, left:right], arrayB[top + offsetY:bottom + offsetY, left + offsetX:right + offsetX], (left, top)
+
+    left, top, right, bottom = overlapRect(arrayA.shape, arrayB.shape, registration)
+    left, top = int(math.ceil(left)), int(math.ceil(top))
+    right, bottom = int(math.floor(right)), int(math.floor(bottom))
+    if right <= left or bottom <= top:
+        raise ValueError("the images do not overlap")
+    xs = nearestIndices(registration.scale * numpy.arange(left, right) + registration.offsetX, widthB)
+    ys = nearestIndices(registration.scale * numpy.arange(top, bottom) + registration.offsetY, heightB)
+    regionB = numpy.empty((bottom - top, right - left) + arrayB.shape[2:], arrayB.dtype)
+    for first in range(0, len(ys), kResampleRows):
+        regionB[first:first + kResampleRows] = arrayB[ys[first:first + kResampleRows, numpy.newaxis], xs]
+    return arrayA[top:bottom, left:right], regionB, (left, top)
+
+## Register two images, and prepare their overlapping parts for comparison
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param withScale True to estimate a scale difference as well.
+#  @return The Registration, and the result of alignedArrays, or None if the alignment is not trustworthy.
+def registerAndAlign(arrayA, arrayB, withScale=False):
+    registration = register(arrayA, arrayB, withScale)
+    if registration.confidence < kMinPeak:
+        return registration, None
+    try:
+        return registration, alignedArrays(arrayA, arrayB, registration)
+    except ValueError:
+        return registration, None
+
+# end
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  instrumentation.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Timed spans for the hot paths (loading, painting, synchronizing, statistics), an on-screen
+#  display of recent timings, and export of the spans in Chrome's trace event format
+#  (chrome://tracing, Perfetto). While tracing is off, instrumented functions cost one flag test.
+#
+
+# timing
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# peak memory, where the current one cannot be read
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# constants
+kMaxSpans = 200000
+kRecentSpans = 120
+kMaxFrameInterval = 1.0
+kHudInterval = 250
+kHudSpans = (("sync", "ViewportModel.update"), ("view", "ImageContainerView.applyViewport"), ("paint", "ImageContainerView.paintEvent"),
+             ("tiles", "TiledImageItem.paint"), ("info", "Ui_Dialog.updateInfo"), ("load", "ImageContainerView.showImage"))
+
+## Span
+#
+#  Context manager that records the time spent in its block.
+class Span(object):
+    __slots__ = ('tracer', 'name', 'category', 'args', 'start')
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param tracer The Tracer to report to.
+    #  @param name The name of the span.
+    #  @param category The category, e.g. "paint".
+    #  @param args Extra values shown with the span, or None.
+    def __init__(self, tracer, name, category, args):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception):
+        self.tracer.record(self.name, self.category, self.start, time.perf_counter(), self.args)
+        return False
+
+## NullSpan
+#
+#  Stands in for a Span while tracing is off.
+class NullSpan(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+kNullSpan = NullSpan()
+
+## Tracer
+#
+#  Collects spans from any thread, up to a fixed number; the oldest are dropped first.
+#  Recent durations are kept per span name for the on-screen display.
+class Tracer(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param maxSpans The number of spans to keep.
+    def __init__(self, maxSpans=kMaxSpans):
+        self.enabled = False
+        self.origin = time.perf_counter()
+        self.events = deque(maxlen=maxSpans)
+        self.recent = {}
+        self.frameIntervals = deque(maxlen=kRecentSpans)
+        self.lastFrame = None
+        self.lock = threading.Lock()
+
+        # done
+
+    ## Start or stop recording
+    #  @param self The object pointer.
+    #  @param enabled True to record spans.
+    def setEnabled(self, enabled):
+        self.enabled = enabled
+        self.lastFrame = None
+
+        # done
+
+    ## A span to be used with the with statement
+    #  @param self The object pointer.
+    #  @param name The name of the span.
+    #  @param category The category, e.g. "paint".
+    #  @param args Extra values shown with the span, or None.
+    def span(self, name, category="", args=None):
+        if not self.enabled:
+            return kNullSpan
+        return Span(self, name, category, args)
+
+    ## Record a finished span
+    #  @param self The object pointer.
+    #  @param name The name of the span.
+    #  @param category The category.
+    #  @param start Start time, from time.perf_counter().
+    #  @param end End time, from time.perf_counter().
+    #  @param args Extra values shown with the span, or None.
+    def record(self, name, category, start, end, args=None):
+        event = ('X', name, category, start, end - start, threading.current_thread().ident, args)
+        with self.lock:
+            self.events.append(event)
+            durations = self.recent.get(name)
+            if durations is None:
+                durations = self.recent[name] = deque(maxlen=kRecentSpans)
+            durations.append(end - start)
+
+        # done
+
+    ## Record the value of a counter, e.g. memory use
+    #  @param self The object pointer.
+    #  @param name The name of the counter.
+    #  @param values Dictionary of series name to value.
+    def counter(self, name, values):
+        if not self.enabled:
+            return
+        with self.lock:
+            self.events.append(('C', name, "", time.perf_counter(), 0.0, threading.current_thread().ident, values))
+
+        # done
+
+    ## Note that a frame has been applied to the views
+    #  @param self The object pointer.
+    def recordFrame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        # a pause in interaction is not a slow frame
+        if self.lastFrame is not None and now - self.lastFrame < kMaxFrameInterval:
+            self.frameIntervals.append(now - self.lastFrame)
+        self.lastFrame = now
+
+        # done
+
+    ## Mean and maximum of the recent durations of a span, in milliseconds
+    #  @param self The object pointer.
+    #  @param name The name of the span.
+    #  @return (mean, maximum), or None if there are none.
+    def recentStatistics(self, name):
+        with self.lock:
+            durations = list(self.recent.get(name, ()))
+        if not durations:
+            return None
+        return 1000.0 * sum(durations) / len(durations), 1000.0 * max(durations)
+
+    ## Mean interval between recent frames, in milliseconds
+    #  @param self The object pointer.
+    def meanFrameInterval(self):
+        intervals = list(self.frameIntervals)
+        if not intervals:
+            return None
+        return 1000.0 * sum(intervals) / len(intervals)
+
+    ## Forget all recorded spans
+    #  @param self The object pointer.
+    def clear(self):
+        with self.lock:
+            self.events.clear()
+            self.recent.clear()
+            self.frameIntervals.clear()
+
+        # done
+
+    ## The recorded spans as Chrome trace events
+    #  @param self The object pointer.
+    def chromeTraceEvents(self):
+        processId = os.getpid()
+        with self.lock:
+            events = list(self.events)
+        traceEvents = []
+        for phase, name, category, start, duration, threadId, args in events:
+            # times are in microseconds
+            traceEvent = {'ph': phase, 'name': name, 'cat': category, 'ts': (start - self.origin) * 1e6, 'pid': processId, 'tid': threadId}
+            if phase == 'X':
+                traceEvent['dur'] = duration * 1e6
+            if args is not None:
+                traceEvent['args'] = args
+            traceEvents.append(traceEvent)
+        return traceEvents
+
+    ## Write the recorded spans as a Chrome trace file
+    #  @param self The object pointer.
+    #  @param filePath The path to the JSON file.
+    def exportChromeTrace(self, filePath):
+        with open(filePath, 'w') as traceFile:
+            json.dump({'traceEvents': self.chromeTraceEvents(), 'displayTimeUnit': 'ms'}, traceFile)
+
+        # done
+
+## The tracer shared by all modules
+tracer = Tracer()
+
+## Decorator that records a span for each call of a function while tracing is on
+#  @param category The category, e.g. "paint".
+#  @param name The name of the span; the qualified function name by default.
+def traced(category, name=None):
+    def decorator(function):
+        spanName = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                tracer.record(spanName, category, start, time.perf_counter())
+        return wrapper
+    return decorator
+
+## Resident memory of this process, in megabytes
+#  Falls back to the peak where the current value cannot be read.
+#  @return The memory use, or None.
+def currentMemory():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024.0 * 1024.0)
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+## InstrumentationHud
+#
+#  Semi-transparent display of recent timings and memory use, on top of the dialog.
+class InstrumentationHud(QtGui.QLabel):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The dialog to show the display on.
+    #  @param top Distance of the display from the top of the dialog.
+    def __init__(self, parent=None, top=10):
+        super(InstrumentationHud, self).__init__(parent)
+        self.top = top
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QLabel { background-color: rgba(0, 0, 0, 160); color: white; font-family: monospace; padding: 6px; }")
+        self.setVisible(False)
+
+        # refreshed only while shown
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+        # done
+
+    ## Show or hide the display; tracing is on while it is shown
+    #  @param self The object pointer.
+    #  @param visible True to show the display.
+    def setActive(self, visible):
+        tracer.setEnabled(visible)
+        self.setVisible(visible)
+        if visible:
+            self.timer.start(kHudInterval)
+            self.refresh()
+            self.raise_()
+        else:
+            self.timer.stop()
+
+        # done
+
+    ## Update the text
+    #  @param self The object pointer.
+    def refresh(self):
+        lines = []
+        interval = tracer.meanFrameInterval()
+        if interval is not None:
+            lines.append("frame   %6.1f ms  (%.0f fps)" % (interval, 1000.0 / interval))
+        for label, name in kHudSpans:
+            statistics = tracer.recentStatistics(name)
+            if statistics is not None:
+                lines.append("%-7s %6.2f ms  max %6.2f ms" % ((label,) + statistics))
+        memory = currentMemory()
+        if memory is not None:
+            lines.append("memory  %6.0f MB" % memory)
+            tracer.counter("memory", {'MB': memory})
+        lines.append("spans   %6d" % len(tracer.events))
+        self.setText('\n'.join(lines))
+        self.adjustSize()
+        self.move(self.parentWidget().width() - self.width() - 10, self.top)
+
+        # done
+
+## FirstPaintProbe
+#
+#  Notices the first time each of some widgets has been painted with its content, e.g. to measure
+#  how long the program takes to show the images it was started with.
+class FirstPaintProbe(QtCore.QObject):
+    # every widget has been painted with its content
+    painted = QtCore.pyqtSignal()
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param widgets The widgets to watch.
+    #  @param ready Function telling whether a widget has its content yet; earlier paints do not count.
+    #  @param parent The parent object.
+    def __init__(self, widgets, ready, parent=None):
+        super(FirstPaintProbe, self).__init__(parent)
+        self.ready = ready
+        # scroll areas, such as graphics views, are painted on their viewport
+        self.pending = {}
+        for widget in widgets:
+            target = widget.viewport() if isinstance(widget, QtGui.QAbstractScrollArea) else widget
+            self.pending[target] = widget
+            target.installEventFilter(self)
+
+        # done
+
+    ## Count a paint once the widget has its content
+    #  @param self The object pointer.
+    #  @param watched The widget being painted.
+    #  @param event The event pointer.
+    def eventFilter(self, watched, event):
+        if event.type() == QtCore.QEvent.Paint and watched in self.pending and self.ready(self.pending[watched]):
+            del self.pending[watched]
+            watched.removeEventFilter(self)
+            if not self.pending:
+                # reported once the paint event has been handled
+                QtCore.QTimer.singleShot(0, self.painted.emit)
+        return False
+
+# end
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  lazy_import.py
+#  @author: Chamin Morikawa
+#
+#  Optional subsystems imported when they are first used rather than at startup. NumPy and the
+#  modules built on it take longer to import than the rest of the program, and a window with two
+#  plain images needs none of them until it is compared.
+#
+
+# finding modules without importing them
+import importlib
+import importlib.util
+import sys
+import threading
+
+## LazyModule
+#
+#  Stands in for a module until one of its attributes is needed, then imports it.
+#  Safe to use from several threads: the first one imports, the others wait for it.
+class LazyModule(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param name The name of the module.
+    def __init__(self, name):
+        self.lazyName = name
+        self.lazyLock = threading.Lock()
+        self.lazyModule = None
+
+        # done
+
+    ## The module, imported on first use
+    #  @param self The object pointer.
+    def load(self):
+        if self.lazyModule is None:
+            with self.lazyLock:
+                if self.lazyModule is None:
+                    self.lazyModule = importlib.import_module(self.lazyName)
+        return self.lazyModule
+
+    ## Attributes of the module; only called for names the stand-in does not have itself
+    #  @param self The object pointer.
+    #  @param name The name of the attribute.
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+    ## Show which module this stands for
+    #  @param self The object pointer.
+    def __repr__(self):
+        return "<lazy module '" + self.lazyName + "'" + (" (imported)" if self.lazyModule is not None else "") + ">"
+
+## Whether a module can be imported, without importing it
+#  @param name The name of a top-level module.
+def isAvailable(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+## A module that is imported when it is first used
+#  @param name The name of the module.
+#  @param requirements Names of the top-level modules it needs, e.g. 'numpy'.
+#  @return The module if it was imported already, a LazyModule, or None if it or a requirement is missing.
+def lazyImport(name, *requirements):
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    if not all(isAvailable(requirement) for requirement in (name,) + requirements):
+        return None
+    return LazyModule(name)
+
+# end
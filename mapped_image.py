@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  mapped_image.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Memory-mapped access to raw sensor dumps, .npy arrays and uncompressed TIFF files.
+#  Pixels are read by the OS page cache only when they are actually looked at.
+#
+
+# GUI
+from PyQt4 import QtGui
+
+# calculations
+import numpy
+
+# file handling
+import json
+import os
+import struct
+import sys
+
+# which files are mapped is decided before NumPy is imported
+from image_cache import isMappable
+
+# constants
+kRawDescriptorSuffix = '.json'
+
+# TIFF tags we need
+kTiffImageWidth = 256
+kTiffImageLength = 257
+kTiffBitsPerSample = 258
+kTiffCompression = 259
+kTiffPhotometric = 262
+kTiffStripOffsets = 273
+kTiffSamplesPerPixel = 277
+kTiffStripByteCounts = 279
+kTiffPlanarConfiguration = 284
+kTiffSampleFormat = 339
+
+# TIFF field types: struct code and size
+kTiffFieldTypes = {1: ('B', 1), 3: ('H', 2), 4: ('I', 4), 16: ('Q', 8)}
+
+## Read the descriptor of a raw file
+#  The descriptor is a JSON file next to the raw file (frame.raw -> frame.raw.json) with the keys
+#  width, height, and optionally channels (1), dtype ("uint8"), offset (0, header size in bytes)
+#  and stride (bytes per row, default width * channels * itemsize).
+#  @param filePath The path to the raw file.
+def readRawDescriptor(filePath):
+    with open(filePath + kRawDescriptorSuffix) as descriptorFile:
+        descriptor = json.load(descriptorFile)
+    if 'width' not in descriptor or 'height' not in descriptor:
+        raise ValueError("raw descriptor needs width and height: " + filePath + kRawDescriptorSuffix)
+    return descriptor
+
+## Wrap part of a file as an array, without reading it
+#  @param filePath The path to the file.
+#  @param dtype The data type of a sample.
+#  @param width Image width in pixels.
+#  @param height Image height in pixels.
+#  @param channels Samples per pixel.
+#  @param offset Position of the first pixel in the file, in bytes.
+#  @param stride Bytes per row, None for tightly packed rows.
+def mapFile(filePath, dtype, width, height, channels=1, offset=0, stride=None):
+    dtype = numpy.dtype(dtype)
+    pixelBytes = channels * dtype.itemsize
+    if stride is None:
+        stride = width * pixelBytes
+    if stride < width * pixelBytes:
+        raise ValueError("row stride is smaller than a row of pixels")
+
+    mapped = numpy.memmap(filePath, dtype=numpy.uint8, mode='r')
+    if offset + stride * (height - 1) + width * pixelBytes > mapped.size:
+        raise ValueError("file is too small for the described image: " + filePath)
+
+    # a strided view on the mapping, no data is touched
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    strides = (stride, pixelBytes, dtype.itemsize) if channels > 1 else (stride, pixelBytes)
+    return numpy.ndarray(shape=shape, dtype=dtype, buffer=mapped, offset=offset, strides=strides)
+
+## Map a raw file described by a descriptor
+#  @param filePath The path to the raw file.
+#  @param descriptor The descriptor; read from the sidecar file if None.
+def mapRaw(filePath, descriptor=None):
+    if descriptor is None:
+        descriptor = readRawDescriptor(filePath)
+    return mapFile(filePath, descriptor.get('dtype', 'uint8'), int(descriptor['width']), int(descriptor['height']),
+                   int(descriptor.get('channels', 1)), int(descriptor.get('offset', 0)), descriptor.get('stride'))
+
+## Map a .npy file
+#  @param filePath The path to the .npy file.
+def mapNpy(filePath):
+    array = numpy.load(filePath, mmap_mode='r')
+    if array.ndim == 3 and array.shape[2] == 1:
+        array = array[:, :, 0]
+    if array.ndim not in (2, 3):
+        raise ValueError("expected a 2D or 3D array: " + filePath)
+    return array
+
+## Read the tags of the first image in a TIFF file
+#  A truncated or garbled header or directory raises ValueError, like any other file that cannot be mapped.
+#  @param tiffFile The open file.
+#  @return The byte order character and a dictionary of tag values (tuples).
+def readTiffTags(tiffFile):
+    try:
+        return readTiffDirectory(tiffFile)
+    except struct.error:
+        raise ValueError("malformed TIFF")
+
+## Read the header and the first image file directory of a TIFF file
+#  @param tiffFile The open file.
+#  @return The byte order character and a dictionary of tag values (tuples).
+def readTiffDirectory(tiffFile):
+    header = tiffFile.read(8)
+    if header[:2] == b'II':
+        byteOrder = '<'
+    elif header[:2] == b'MM':
+        byteOrder = '>'
+    else:
+        raise ValueError("not a TIFF file")
+    magic, ifdOffset = struct.unpack(byteOrder + 'HI', header[2:8])
+    if magic != 42:
+        raise ValueError("BigTIFF and unknown TIFF variants are not supported")
+
+    tiffFile.seek(ifdOffset)
+    count = struct.unpack(byteOrder + 'H', tiffFile.read(2))[0]
+    tags = {}
+    for entry in range(count):
+        tag, fieldType, valueCount, valueOrOffset = struct.unpack(byteOrder + 'HHI4s', tiffFile.read(12))
+        if fieldType not in kTiffFieldTypes:
+            continue
+        code, size = kTiffFieldTypes[fieldType]
+        if size * valueCount <= 4:
+            data = valueOrOffset[:size * valueCount]
+        else:
+            # values are stored elsewhere
+            position = tiffFile.tell()
+            tiffFile.seek(struct.unpack(byteOrder + 'I', valueOrOffset)[0])
+            data = tiffFile.read(size * valueCount)
+            tiffFile.seek(position)
+        tags[tag] = struct.unpack(byteOrder + code * valueCount, data)
+    return byteOrder, tags
+
+## Map an uncompressed, chunky TIFF file whose strips are stored back to back
+#  @param filePath The path to the TIFF file.
+def mapTiff(filePath):
+    with open(filePath, 'rb') as tiffFile:
+        byteOrder, tags = readTiffTags(tiffFile)
+
+    if tags.get(kTiffCompression, (1,))[0] != 1:
+        raise ValueError("compressed TIFF cannot be mapped")
+    if tags.get(kTiffPlanarConfiguration, (1,))[0] != 1:
+        raise ValueError("planar TIFF cannot be mapped")
+
+    for tag in (kTiffImageWidth, kTiffImageLength, kTiffStripOffsets, kTiffStripByteCounts):
+        if not tags.get(tag):
+            raise ValueError("malformed TIFF: tag " + str(tag) + " is missing")
+    width = tags[kTiffImageWidth][0]
+    height = tags[kTiffImageLength][0]
+    channels = tags.get(kTiffSamplesPerPixel, (1,))[0]
+
+    # only samples that are shown as they are: black-is-zero grey or RGB; e.g. palette images are decoded by Qt
+    photometric = tags.get(kTiffPhotometric, (None,))[0]
+    if not (photometric == 1 or (photometric == 2 and channels in (3, 4))):
+        raise ValueError("TIFF photometric interpretation " + str(photometric) + " cannot be mapped")
+
+    bits = tags.get(kTiffBitsPerSample, (8,))
+    if len(set(bits)) != 1 or bits[0] not in (8, 16, 32):
+        raise ValueError("unsupported TIFF sample size")
+    kind = {1: 'u', 2: 'i', 3: 'f'}.get(tags.get(kTiffSampleFormat, (1,))[0], 'u')
+    dtype = numpy.dtype(byteOrder + kind + str(bits[0] // 8))
+
+    # strips must form one contiguous block
+    offsets = tags[kTiffStripOffsets]
+    counts = tags[kTiffStripByteCounts]
+    for i in range(1, len(offsets)):
+        if offsets[i] != offsets[i - 1] + counts[i - 1]:
+            raise ValueError("TIFF strips are not contiguous")
+
+    return mapFile(filePath, dtype, width, height, channels, offsets[0])
+
+## Map an image file, choosing the reader by extension
+#  Raises ValueError (or IOError) if the file cannot be mapped; the caller should then decode it normally.
+#  @param filePath The path to the file.
+def mapImage(filePath):
+    extension = os.path.splitext(filePath)[1].lower()
+    if extension == '.npy':
+        return mapNpy(filePath)
+    if extension == '.raw':
+        return mapRaw(filePath)
+    if extension in ('.tif', '.tiff'):
+        return mapTiff(filePath)
+    raise ValueError("not a mappable format: " + filePath)
+
+## Reduce an array to 8-bit samples for display
+#  8-bit data is returned as is; anything else is rescaled into a new array.
+#  @param array The image array.
+def toDisplayArray(array):
+    if array.dtype == numpy.uint8:
+        return array
+    if array.dtype.kind == 'f':
+        return (numpy.clip(array, 0.0, 1.0) * 255.0 + 0.5).astype(numpy.uint8)
+    # integers: keep the most significant byte
+    shift = 8 * array.dtype.itemsize - 8
+    return (array >> shift).astype(numpy.uint8)
+
+## Grey colour table for 8-bit indexed images
+kGreyColorTable = [QtGui.qRgb(i, i, i) for i in range(256)]
+
+## Wrap an array as a QImage
+#  8-bit grey and RGB arrays with packed pixels share their memory with the QImage;
+#  the array is attached to the image so that it stays alive as long as the image does.
+#  Other arrays are converted first.
+#  @param array The image array, height x width (x channels).
+def arrayToQImage(array):
+    array = toDisplayArray(array)
+    channels = 1 if array.ndim == 2 else array.shape[2]
+    if channels == 4 and not hasattr(QtGui.QImage, 'Format_RGBA8888'):
+        # Qt 4 only knows BGRA in memory order; convert
+        array = numpy.ascontiguousarray(array[:, :, [2, 1, 0, 3]])
+    if array.strides[1] != channels or (channels > 1 and array.strides[2] != 1) or array.strides[0] <= 0:
+        array = numpy.ascontiguousarray(array)
+
+    height, width = array.shape[:2]
+    if channels == 1:
+        imageFormat = QtGui.QImage.Format_Indexed8
+    elif channels == 3:
+        imageFormat = QtGui.QImage.Format_RGB888
+    elif channels == 4:
+        imageFormat = getattr(QtGui.QImage, 'Format_RGBA8888', QtGui.QImage.Format_ARGB32)
+    else:
+        raise ValueError("unsupported number of channels: " + str(channels))
+
+    image = QtGui.QImage(array.ctypes.data, width, height, array.strides[0], imageFormat)
+    if channels == 1:
+        image.setColorTable(kGreyColorTable)
+    image.sourceArray = array
+    return image
+
+## View the pixels of a QImage as an RGB array, without copying
+#  The image is converted to 32-bit RGB first if needed. The array points into the returned image,
+#  which must be kept alive as long as the array is used.
+#  @param image The QImage.
+#  @return The height x width x 3 array and the image that owns its memory.
+def qimageToArray(image):
+    if image.format() != QtGui.QImage.Format_RGB32 and image.format() != QtGui.QImage.Format_ARGB32:
+        image = image.convertToFormat(QtGui.QImage.Format_RGB32)
+    height, width = image.height(), image.width()
+    # constBits does not detach an image shared with e.g. the decoded image cache
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    pixels = numpy.frombuffer(bits, numpy.uint8).reshape(height, image.bytesPerLine())[:, :width * 4].reshape(height, width, 4)
+
+    # 0xAARRGGBB words: B, G, R, A in memory on little-endian machines
+    if sys.byteorder == 'little':
+        return pixels[:, :, 2::-1], image
+    return pixels[:, :, 1:], image
+
+## Load an image file as an array, mapping it when possible
+#  Works without a QApplication, so it can be used in headless worker processes.
+#  @param filePath The path to the image.
+#  @return The array and the object that owns its memory (None for mapped files).
+def loadImageArray(filePath):
+    if isMappable(filePath):
+        try:
+            return mapImage(filePath), None
+        except (ValueError, IOError, OSError, KeyError):
+            # not something we can map; decode it instead
+            pass
+    image = QtGui.QImageReader(filePath).read()
+    if image.isNull():
+        raise IOError("could not decode image: " + filePath)
+    return qimageToArray(image)
+
+# end
@@ -12,6 +12,9 @@
 from PyQt4 import QtCore
 from PyQt4.QtGui import QGraphicsScene
 
+# timed spans for the instrumentation display and traces
+from instrumentation import traced
+
 ## MovableImage
 #
 #  Stores an image that the user can manipulate for looking at the details
@@ -28,11 +31,16 @@ class MovableImage(QGraphicsScene):
         self.dragStarted = False
         self.pressedButton = "None"
         
+        # drawn by the items when zoomed in far, see ImageContainerView.setPixelOverlays
+        self.pixelGrid = False
+        self.pixelLabels = False
+        
         # done
         
     ## Mouse button pressed on the image
     #  @param self The object pointer.
     #  @param event The event pointer.
+    @traced("input")
     def mousePressEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
                 self.pressedButton = "Left"
@@ -55,6 +63,7 @@ class MovableImage(QGraphicsScene):
     ## Mouse button released on the image
     #  @param self The object pointer.    
     #  @param event The event pointer.
+    @traced("input")
     def mouseReleaseEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
             self.dragStarted = False
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  pair_playlist.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Lists of image pairs, from a manifest or from two folders, to be stepped through one pair at a time.
+#
+
+# file handling
+import csv
+import os
+
+# constants
+kPlaylistPrefetch = 2
+
+## Pairs of files with the same relative path under two directories
+#  Files that exist only under the first directory are paired with None.
+#  @param directoryA The first directory, e.g. rendered frames.
+#  @param directoryB The second directory, e.g. golden images.
+def pairsFromDirectories(directoryA, directoryB):
+    for root, dirs, files in os.walk(directoryA):
+        dirs.sort()
+        for name in sorted(files):
+            pathA = os.path.join(root, name)
+            pathB = os.path.join(directoryB, os.path.relpath(pathA, directoryA))
+            yield pathA, pathB if os.path.isfile(pathB) else None
+
+## Pairs of files listed in a manifest
+#  Each line holds two paths, separated by a tab or a comma. Relative paths are relative to the manifest.
+#  Empty lines and lines starting with # are ignored.
+#  @param manifestPath The path to the manifest.
+def pairsFromManifest(manifestPath):
+    baseDir = os.path.dirname(os.path.abspath(manifestPath))
+    with open(manifestPath) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            delimiter = '\t' if '\t' in line else ','
+            fields = next(csv.reader([line], delimiter=delimiter))
+            if len(fields) < 2:
+                yield os.path.join(baseDir, fields[0]), None
+            else:
+                yield os.path.join(baseDir, fields[0].strip()), os.path.join(baseDir, fields[1].strip())
+
+## PairPlaylist
+#
+#  An ordered list of image pairs with a current position.
+class PairPlaylist(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param pairs Iterable of (pathA, pathB); pairs without a second image are skipped.
+    def __init__(self, pairs):
+        self.pairs = [(pathA, pathB) for pathA, pathB in pairs if pathB is not None]
+        self.index = 0
+
+        # done
+
+    ## Playlist of matching files in two directories
+    #  @param directoryA The first directory.
+    #  @param directoryB The second directory.
+    @classmethod
+    def fromDirectories(cls, directoryA, directoryB):
+        return cls(pairsFromDirectories(directoryA, directoryB))
+
+    ## Playlist of the pairs in a manifest
+    #  @param manifestPath The path to the manifest.
+    @classmethod
+    def fromManifest(cls, manifestPath):
+        return cls(pairsFromManifest(manifestPath))
+
+    ## Number of pairs
+    #  @param self The object pointer.
+    def __len__(self):
+        return len(self.pairs)
+
+    ## The current pair
+    #  @param self The object pointer.
+    def current(self):
+        return self.pairs[self.index]
+
+    ## Move by a number of pairs, staying within the list
+    #  @param self The object pointer.
+    #  @param step Number of pairs to move; negative to go back.
+    #  @return True if the position changed.
+    def move(self, step):
+        index = min(max(self.index + step, 0), len(self.pairs) - 1)
+        if index == self.index:
+            return False
+        self.index = index
+        return True
+
+    ## The pairs after the current one
+    #  @param self The object pointer.
+    #  @param count The number of pairs.
+    def upcoming(self, count=kPlaylistPrefetch):
+        return self.pairs[self.index + 1:self.index + 1 + count]
+
+# end
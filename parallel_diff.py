@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  parallel_diff.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Full-frame comparison of one pair on all cores. The images are split into stripes of rows that
+#  are compared on a pool of worker processes; the workers read the pixels in place, from shared
+#  memory blocks or from the memory-mapped image files, so nothing but stripe bounds and small
+#  partial results is ever pickled. Large decoded images are placed in shared memory as they are
+#  loaded, so a comparison can start at once.
+#
+
+# GUI
+from PyQt4 import QtGui
+
+# worker processes and shared memory
+import atexit
+import collections
+import multiprocessing
+import os
+import weakref
+from multiprocessing import shared_memory
+
+# calculations
+import numpy
+
+# large decoded images are placed in shared memory
+from image_cache import kSharedPixelThreshold
+
+# comparison of stripes
+from image_diff import commonShape, computeMetrics, kRowsPerStripe, mergeMetrics, stripeMetrics, valueRange
+
+# constants
+kParallelPixelThreshold = 4 * 1024 * 1024
+kStripesPerWorker = 4
+kAttachedBlocks = 8
+
+# shared memory blocks created by this process and still in use, by name
+sharedBlocks = weakref.WeakValueDictionary()
+
+# blocks attached by a worker process, most recently used last
+attachedBlocks = collections.OrderedDict()
+
+# the worker processes, started on first use
+workerPool = None
+
+## SharedArray
+#
+#  A NumPy array in a shared memory block that worker processes can attach to by name.
+#  The block is released when the object is garbage collected.
+class SharedArray(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param shape The shape of the array.
+    #  @param dtype The NumPy data type.
+    def __init__(self, shape, dtype):
+        dtype = numpy.dtype(dtype)
+        size = max(1, int(numpy.prod(shape)) * dtype.itemsize)
+        self.block = shared_memory.SharedMemory(create=True, size=size)
+        self.array = numpy.ndarray(shape, dtype, buffer=self.block.buf)
+        self.address = self.array.__array_interface__['data'][0]
+        self.size = size
+        sharedBlocks[self.block.name] = self
+
+        # done
+
+    ## Release the block
+    #  @param self The object pointer.
+    def __del__(self):
+        # views of the buffer must be gone before it can be closed
+        self.array = None
+        try:
+            self.block.unlink()
+        except OSError:
+            # already removed when the program ended
+            pass
+        try:
+            self.block.close()
+        except BufferError:
+            # views still in use keep the memory mapped until they are gone
+            pass
+
+        # done
+
+## Remove the names of the blocks still in use when the program ends
+#  The memory itself stays mapped until the images that use it are gone.
+def unlinkSharedBlocks():
+    for shared in list(sharedBlocks.values()):
+        try:
+            shared.block.unlink()
+        except OSError:
+            pass
+
+atexit.register(unlinkSharedBlocks)
+
+## Copy of a decoded image whose pixels live in shared memory
+#  The pixels are kept as 32-bit words, the layout the image arrays are viewed in.
+#  @param image The decoded QImage.
+#  @return The new QImage, with the block attached as sharedArray; or the image itself if it is small.
+def sharedImage(image):
+    if image.isNull() or image.width() * image.height() < kSharedPixelThreshold:
+        return image
+    if image.format() != QtGui.QImage.Format_RGB32 and image.format() != QtGui.QImage.Format_ARGB32:
+        image = image.convertToFormat(QtGui.QImage.Format_RGB32)
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    shared = SharedArray((image.byteCount(),), numpy.uint8)
+    shared.array[:] = numpy.frombuffer(bits, numpy.uint8)
+
+    copy = QtGui.QImage(shared.address, image.width(), image.height(), image.bytesPerLine(), image.format())
+    copy.sharedArray = shared
+    return copy
+
+## Range of bytes spanned by an array
+#  @param array The array.
+#  @return (lowest, highest + 1) byte addresses.
+def byteExtent(array):
+    low = high = array.__array_interface__['data'][0]
+    for length, stride in zip(array.shape, array.strides):
+        if stride < 0:
+            low += (length - 1) * stride
+        else:
+            high += (length - 1) * stride
+    return low, high + array.dtype.itemsize
+
+## How a worker process finds the pixels of an array without copying them
+#  Arrays in a shared memory block of this process and arrays of memory-mapped files are found in place;
+#  any other array is copied into a new block.
+#  @param array The array.
+#  @return The descriptor, and the SharedArray holding a copy (None if the array was found in place).
+def shareArray(array):
+    address = array.__array_interface__['data'][0]
+    low, high = byteExtent(array)
+    layout = (array.shape, array.dtype.str, array.strides)
+
+    for name, shared in list(sharedBlocks.items()):
+        if shared.address <= low and high <= shared.address + shared.size:
+            return ('shared', name, address - shared.address) + layout, None
+
+    # views of a mapped file are memmaps too; the one that mapped the file starts at its offset in the file
+    base = array
+    while isinstance(base, numpy.ndarray) and not (isinstance(base, numpy.memmap) and not isinstance(base.base, numpy.ndarray)):
+        base = base.base
+    if isinstance(base, numpy.memmap) and base.filename is not None:
+        return ('file', base.filename, base.offset + address - base.__array_interface__['data'][0]) + layout, None
+
+    shared = SharedArray(array.shape, array.dtype)
+    shared.array[...] = array
+    return shareArray(shared.array)[0], shared
+
+## The array described by shareArray, in a worker process
+#  @param descriptor The descriptor.
+def attachArray(descriptor):
+    kind, name, offset, shape, dtype, strides = descriptor
+    buffer = attachedBlocks.pop((kind, name), None)
+    if buffer is None:
+        if kind == 'shared':
+            # workers share the resource tracker of the process that created the block
+            block = shared_memory.SharedMemory(name=name)
+            buffer = (block, block.buf)
+        else:
+            mapped = numpy.memmap(name, numpy.uint8, mode='r')
+            buffer = (mapped, mapped)
+    attachedBlocks[(kind, name)] = buffer
+
+    # forget the blocks of earlier comparisons
+    while len(attachedBlocks) > kAttachedBlocks:
+        block = attachedBlocks.popitem(last=False)[1][0]
+        if isinstance(block, shared_memory.SharedMemory):
+            try:
+                block.close()
+            except BufferError:
+                pass
+
+    return numpy.ndarray(shape, dtype, buffer=buffer[1], offset=offset, strides=strides)
+
+## Partial metrics of some rows of both images; runs in a worker process
+#  @param task Tuple of (descriptorA, descriptorB, top, bottom, width, threshold).
+#  @return A list of partial metrics, as image_diff.stripeMetrics.
+def metricsTask(task):
+    descriptorA, descriptorB, top, bottom, width, threshold = task
+    arrayA = attachArray(descriptorA)
+    arrayB = attachArray(descriptorB)
+    partials = []
+    for start in range(top, bottom, kRowsPerStripe):
+        end = min(start + kRowsPerStripe, bottom)
+        partials.append(stripeMetrics(arrayA[start:end, :width], arrayB[start:end, :width], start, threshold))
+    return partials
+
+## The pool of worker processes, started on first use
+#  Workers are started fresh rather than forked, so they do not inherit the GUI's threads.
+def getWorkerPool():
+    global workerPool
+    if workerPool is None:
+        workerPool = multiprocessing.get_context('spawn').Pool(processes=os.cpu_count())
+        atexit.register(workerPool.terminate)
+    return workerPool
+
+## Rows of the stripes that the workers compare
+#  @param height The number of rows.
+#  @return List of (top, bottom), a few per worker, in multiples of kRowsPerStripe.
+def stripeRanges(height):
+    count = (os.cpu_count() or 1) * kStripesPerWorker
+    rows = max(kRowsPerStripe, -(-height // count // kRowsPerStripe) * kRowsPerStripe)
+    return [(top, min(top + rows, height)) for top in range(0, height, rows)]
+
+## Global difference metrics of two images, on all cores
+#  Small images are compared in this process; starting the workers would cost more.
+#  @param arrayA The first image array.
+#  @param arrayB The second image array.
+#  @param threshold Largest difference still considered equal.
+#  @return The same dictionary as image_diff.computeMetrics, including the bounding box of the changes.
+def parallelMetrics(arrayA, arrayB, threshold=0):
+    height, width = commonShape(arrayA, arrayB)
+    if height * width < kParallelPixelThreshold:
+        return computeMetrics(arrayA, arrayB, threshold)
+
+    descriptorA, ownerA = shareArray(arrayA)
+    descriptorB, ownerB = shareArray(arrayB)
+    tasks = [(descriptorA, descriptorB, top, bottom, width, threshold) for top, bottom in stripeRanges(height)]
+    partials = [partial for stripe in getWorkerPool().map(metricsTask, tasks, chunksize=1) for partial in stripe]
+    return mergeMetrics(partials, valueRange(arrayA.dtype))
+
+# end
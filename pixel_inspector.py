@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  pixel_inspector.py
+#  @author: Chamin Morikawa
+#
+#  Readout of the pixel under the mouse in every image, and a magnifier (loupe) of its neighbourhood.
+#  Samples are gathered from the image arrays with fancy indexing, so a lookup touches only the
+#  pixels it shows, however large the images are.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# calculations
+import numpy
+
+# conversion of samples for display
+from mapped_image import arrayToQImage
+
+# constants
+kLoupeSize = 15
+kLoupeZoom = 9
+kPanelSpacing = 6
+kMarkerColor = QtGui.QColor(255, 255, 0)
+
+## Samples of an image at a block of viewport pixels
+#  @param array The image array, height x width (x channels).
+#  @param registration Maps viewport coordinates to the image (see image_registration.Registration), or None.
+#  @param left First viewport column.
+#  @param top First viewport row.
+#  @param columns Number of columns.
+#  @param rows Number of rows.
+#  @return The samples (zero outside the image), and a rows x columns mask of the pixels inside the image.
+def samplePixels(array, registration, left, top, columns, rows):
+    # centres of the viewport pixels, in image coordinates
+    xs = numpy.arange(left, left + columns) + 0.5
+    ys = numpy.arange(top, top + rows) + 0.5
+    if registration is not None:
+        xs = registration.scale * xs + registration.offsetX
+        ys = registration.scale * ys + registration.offsetY
+    xs = numpy.floor(xs).astype(numpy.intp)
+    ys = numpy.floor(ys).astype(numpy.intp)
+
+    height, width = array.shape[:2]
+    insideX = (xs >= 0) & (xs < width)
+    insideY = (ys >= 0) & (ys < height)
+    samples = array[numpy.ix_(numpy.clip(ys, 0, height - 1), numpy.clip(xs, 0, width - 1))]
+    inside = insideY[:, numpy.newaxis] & insideX[numpy.newaxis, :]
+    samples[~inside] = 0
+    return samples, inside
+
+## Sample values as text
+#  @param values The samples of one pixel: a scalar or one value per channel.
+def formatValues(values):
+    values = numpy.atleast_1d(values)
+    if values.dtype.kind == 'f':
+        return ", ".join("%.5g" % value for value in values)
+    return ", ".join(str(int(value)) for value in values)
+
+## LoupeWidget
+#
+#  Magnified neighbourhoods of the pixel under the mouse, one per image, at nearest-neighbour zoom.
+class LoupeWidget(QtGui.QWidget):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The parent widget.
+    def __init__(self, parent=None):
+        super(LoupeWidget, self).__init__(parent)
+        self.images = []
+
+        # done
+
+    ## Show new neighbourhoods
+    #  @param self The object pointer.
+    #  @param images QImages of kLoupeSize x kLoupeSize pixels.
+    def setImages(self, images):
+        self.images = images
+        side = kLoupeSize * kLoupeZoom
+        self.setFixedSize(max(1, len(images) * (side + kPanelSpacing) - kPanelSpacing), side)
+        self.update()
+
+        # done
+
+    ## Draw the magnified neighbourhoods, with the centre pixel marked
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+        side = kLoupeSize * kLoupeZoom
+        center = (kLoupeSize // 2) * kLoupeZoom
+        painter.setPen(kMarkerColor)
+        for index, image in enumerate(self.images):
+            left = index * (side + kPanelSpacing)
+            painter.drawImage(QtCore.QRectF(left, 0, side, side), image, QtCore.QRectF(image.rect()))
+            painter.drawRect(left + center, center, kLoupeZoom - 1, kLoupeZoom - 1)
+        painter.end()
+
+        # done
+
+## PixelInspector
+#
+#  Semi-transparent panel with the coordinate and sample values of the pixel under the mouse,
+#  their difference, and optionally a loupe.
+class PixelInspector(QtGui.QFrame):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The dialog to show the panel on.
+    def __init__(self, parent=None):
+        super(PixelInspector, self).__init__(parent)
+        self.setAttribute(QtCore.Qt.WA_TransparentForMouseEvents)
+        self.setStyleSheet("QFrame { background-color: rgba(0, 0, 0, 160); } QLabel { color: white; font-family: monospace; }")
+        layout = QtGui.QVBoxLayout(self)
+        layout.setContentsMargins(kPanelSpacing, kPanelSpacing, kPanelSpacing, kPanelSpacing)
+        self.label = QtGui.QLabel(self)
+        layout.addWidget(self.label)
+        self.loupe = LoupeWidget(self)
+        self.loupe.setVisible(False)
+        layout.addWidget(self.loupe)
+        self.setVisible(False)
+
+        # the readout is on, the loupe off, until toggled
+        self.enabled = True
+        self.loupeEnabled = False
+
+        # done
+
+    ## Show the pixel at a viewport position
+    #  @param self The object pointer.
+    #  @param x The viewport column.
+    #  @param y The viewport row.
+    #  @param sources Sequence of (name, array, registration, toneMap) for the images; toneMap may be None.
+    def inspect(self, x, y, sources):
+        lines = ["x=" + str(x) + ", y=" + str(y)]
+        values = []
+        images = []
+        radius = kLoupeSize // 2
+        for name, array, registration, toneMap in sources:
+            if array is None:
+                continue
+            if self.loupeEnabled:
+                # the centre of the neighbourhood is the pixel itself
+                samples, inside = samplePixels(array, registration, x - radius, y - radius, kLoupeSize, kLoupeSize)
+                pixel, pixelInside = samples[radius, radius], inside[radius, radius]
+                images.append(arrayToQImage(toneMap.apply(samples) if toneMap is not None else samples))
+            else:
+                samples, inside = samplePixels(array, registration, x, y, 1, 1)
+                pixel, pixelInside = samples[0, 0], inside[0, 0]
+            if pixelInside:
+                lines.append(name + ": " + formatValues(pixel))
+                values.append(pixel)
+            else:
+                lines.append(name + ": -")
+                values.append(None)
+
+        # difference of the second image from the first
+        if len(values) >= 2 and values[0] is not None and values[1] is not None and numpy.shape(values[0]) == numpy.shape(values[1]):
+            kind = 'f' if 'f' in (values[0].dtype.kind, values[1].dtype.kind) else 'i'
+            difference = numpy.asarray(values[1], numpy.float64 if kind == 'f' else numpy.int64) - numpy.asarray(values[0], numpy.float64 if kind == 'f' else numpy.int64)
+            lines.append("difference: " + formatValues(difference))
+
+        self.label.setText('\n'.join(lines))
+        self.loupe.setVisible(self.loupeEnabled)
+        if self.loupeEnabled:
+            self.loupe.setImages(images)
+        self.adjustSize()
+        self.setVisible(True)
+        self.raise_()
+
+        # done
+
+    ## Turn the readout on or off
+    #  @param self The object pointer.
+    def toggle(self):
+        self.enabled = not self.enabled
+        if not self.enabled:
+            self.setVisible(False)
+
+        # done
+
+    ## Turn the loupe on or off
+    #  @param self The object pointer.
+    def toggleLoupe(self):
+        self.loupeEnabled = not self.loupeEnabled
+        if self.loupeEnabled:
+            self.enabled = True
+
+        # done
+
+# end
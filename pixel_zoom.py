@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  pixel_zoom.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Rendering at high magnification. Above kPixelZoomScale, only the source pixels under the
+#  exposed area are taken from the image and drawn as nearest-neighbour rectangles, optionally
+#  with a grid between them and their values written on them. The cost of a repaint then depends
+#  on the size of the view, not on the size of the image.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# calculations
+import math
+
+# constants
+kPixelZoomScale = 8.0
+kLabelScale = 64.0
+kLabelFontSize = 12
+kLabelFill = 0.8
+kGridColor = QtGui.QColor(128, 128, 128)
+kGreyFormats = tuple(getattr(QtGui.QImage, name) for name in ("Format_Indexed8", "Format_Grayscale8") if hasattr(QtGui.QImage, name))
+
+## Number of screen pixels per image pixel
+#  @param painter The painter, with the transformation of the item being painted.
+def paintScale(painter):
+    return QtGui.QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+
+## Source pixels under an exposed rectangle
+#  @param exposed The exposed rectangle (QRectF), in pixels of the image.
+#  @param width The width of the image.
+#  @param height The height of the image.
+#  @return The QRect of whole pixels covering it, within the image; empty if there are none.
+def exposedPixels(exposed, width, height):
+    left = max(0, int(math.floor(exposed.left())))
+    top = max(0, int(math.floor(exposed.top())))
+    right = min(width, int(math.ceil(exposed.right())))
+    bottom = min(height, int(math.ceil(exposed.bottom())))
+    return QtCore.QRect(left, top, max(0, right - left), max(0, bottom - top))
+
+## Whether an item's view draws the pixel grid and the value labels
+#  The settings are kept on the scene, see ImageContainerView.setPixelOverlays.
+#  @param item The QGraphicsItem.
+#  @return (grid, labels).
+def pixelOverlays(item):
+    scene = item.scene()
+    return getattr(scene, 'pixelGrid', False), getattr(scene, 'pixelLabels', False)
+
+## Values of the pixels of an image as shown, per channel
+#  @param image The QImage.
+#  @return Rows of per-pixel tuples: one grey value, or red, green and blue.
+def imageValues(image):
+    grey = image.format() in kGreyFormats and image.isGrayscale()
+    values = []
+    for y in range(image.height()):
+        pixels = [image.pixel(x, y) for x in range(image.width())]
+        values.append([(QtGui.qGray(pixel),) if grey else (QtGui.qRed(pixel), QtGui.qGreen(pixel), QtGui.qBlue(pixel)) for pixel in pixels])
+    return values
+
+## Sample value as text
+#  @param value An integer or floating point sample.
+def formatValue(value):
+    if isinstance(value, float):
+        return "%.4g" % value
+    return str(int(value))
+
+## Write the value of every pixel on it
+#  The text is drawn in screen pixels, black on light pixels and white on dark ones.
+#  @param painter The painter, in pixels of the image.
+#  @param image The QImage of the pixels, as shown.
+#  @param rect The pixels the image covers.
+#  @param values Rows of per-pixel sequences of samples, e.g. the original samples; None for the values shown.
+def drawLabels(painter, image, rect, values=None):
+    if values is None:
+        values = imageValues(image)
+    transform = painter.worldTransform()
+    painter.resetTransform()
+
+    # one line per channel, as large as fits in a pixel
+    channels = len(values[0][0])
+    cell = transform.mapRect(QtCore.QRectF(0, 0, 1, 1))
+    font = QtGui.QFont(painter.font())
+    font.setPixelSize(max(1, min(kLabelFontSize, int(cell.height() * kLabelFill / channels))))
+    painter.setFont(font)
+
+    for row in range(rect.height()):
+        for column in range(rect.width()):
+            pixel = image.pixel(column, row)
+            painter.setPen(QtCore.Qt.black if QtGui.qGray(pixel) >= 128 else QtCore.Qt.white)
+            target = transform.mapRect(QtCore.QRectF(rect.left() + column, rect.top() + row, 1, 1))
+            text = "\n".join(formatValue(value) for value in values[row][column])
+            painter.drawText(target, QtCore.Qt.AlignCenter, text)
+
+    # done
+
+## Draw pixels as nearest-neighbour rectangles, with the grid and labels if asked for
+#  @param painter The painter, in pixels of the image.
+#  @param image The QImage of the pixels to draw; only these pixels, not the whole image.
+#  @param rect The pixels the image covers.
+#  @param grid Whether to draw lines between the pixels.
+#  @param labels Whether to write the values of the pixels, when they are large enough.
+#  @param values Samples for the labels, as drawLabels; None for the values shown.
+def drawPixels(painter, image, rect, grid=False, labels=False, values=None):
+    painter.save()
+    painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, False)
+    painter.drawImage(QtCore.QRectF(rect), image, QtCore.QRectF(image.rect()))
+
+    if grid:
+        pen = QtGui.QPen(kGridColor)
+        pen.setCosmetic(True)
+        painter.setPen(pen)
+        right = rect.left() + rect.width()
+        bottom = rect.top() + rect.height()
+        lines = [QtCore.QLineF(x, rect.top(), x, bottom) for x in range(rect.left(), right + 1)]
+        lines += [QtCore.QLineF(rect.left(), y, right, y) for y in range(rect.top(), bottom + 1)]
+        painter.drawLines(lines)
+
+    if labels and paintScale(painter) >= kLabelScale:
+        drawLabels(painter, image, rect, values)
+    painter.restore()
+
+    # done
+
+## PixmapItem
+#
+#  Scene item for an image shown as a single pixmap. At high magnification only the pixels
+#  under the exposed area are drawn, instead of transforming the whole pixmap.
+class PixmapItem(QtGui.QGraphicsPixmapItem):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param pixmap The QPixmap.
+    #  @param parent The parent item, if any.
+    def __init__(self, pixmap, parent=None):
+        super(PixmapItem, self).__init__(pixmap, parent)
+
+        # we need the exposed rectangle while painting
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+        # done
+
+    ## Draw the pixmap, or its exposed pixels when zoomed in far
+    #  @param self The object pointer.
+    #  @param painter The painter.
+    #  @param option The style options, with the exposed rectangle.
+    #  @param widget The widget being painted on.
+    def paint(self, painter, option, widget=None):
+        if paintScale(painter) < kPixelZoomScale:
+            super(PixmapItem, self).paint(painter, option, widget)
+            return
+        pixmap = self.pixmap()
+        rect = exposedPixels(option.exposedRect, pixmap.width(), pixmap.height())
+        if rect.isEmpty():
+            return
+        grid, labels = pixelOverlays(self)
+        drawPixels(painter, pixmap.copy(rect).toImage(), rect, grid, labels)
+
+        # done
+
+# end
@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  pyramid_cache.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  On-disk cache of decoded images and their mip pyramids, for images that are opened again and again.
+#  Every pyramid level is stored as a .npy array of 32-bit pixels and memory-mapped when the image
+#  is reopened, so only the pages under the tiles that are painted are ever read.
+#  The cache is used when IMAGE_COMPARATOR_PYRAMID_CACHE names a directory.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# calculations
+import math
+import numpy
+
+# file handling
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import threading
+
+# key of a file version
+from image_cache import cacheKey, isMappable, kPyramidCacheVariable
+
+# constants
+kCacheDirectoryVariable = kPyramidCacheVariable
+kCacheBudgetVariable = 'IMAGE_COMPARATOR_PYRAMID_CACHE_MB'
+kDefaultCacheBudget = 4 * 1024 * 1024 * 1024
+kMinCachedPixels = 1024 * 1024
+kTileSize = 256
+kStripeRows = 512
+kMetaFile = 'meta.json'
+kFormatVersion = 1
+
+## File name of a pyramid level
+#  @param level The pyramid level.
+def levelFileName(level):
+    return 'level' + str(level) + '.npy'
+
+## The 32-bit pixels of a QImage, as a height x width array of words, without copying
+#  @param image The QImage, in Format_RGB32 or Format_ARGB32.
+def imageWords(image):
+    bits = image.constBits()
+    bits.setsize(image.byteCount())
+    return numpy.frombuffer(bits, numpy.uint32).reshape(image.height(), image.bytesPerLine() // 4)[:, :image.width()]
+
+## Wrap an array of 32-bit pixels as a QImage
+#  The array is attached to the image so that it stays alive as long as the image does.
+#  @param words The height x width array of words; rows may be strided.
+#  @param imageFormat Format_RGB32 or Format_ARGB32.
+def wordsToQImage(words, imageFormat):
+    image = QtGui.QImage(words.ctypes.data, words.shape[1], words.shape[0], words.strides[0], imageFormat)
+    image.sourceArray = words
+    return image
+
+## Write the next pyramid level: each pixel is the mean of 2 x 2 pixels of the level above
+#  The edge row and column are repeated where a dimension is odd.
+#  @param source The height x width array of words of the level above.
+#  @param target The array of words to fill, half the size (rounded up).
+def writeHalvedLevel(source, target):
+    for top in range(0, source.shape[0], kStripeRows):
+        stripe = source[top:top + kStripeRows].view(numpy.uint8).reshape(-1, source.shape[1], 4)
+        if stripe.shape[0] % 2:
+            stripe = numpy.concatenate((stripe, stripe[-1:]), axis=0)
+        if stripe.shape[1] % 2:
+            stripe = numpy.concatenate((stripe, stripe[:, -1:]), axis=1)
+        total = stripe[0::2, 0::2].astype(numpy.uint16) + stripe[1::2, 0::2] + stripe[0::2, 1::2] + stripe[1::2, 1::2]
+        halved = ((total + 2) >> 2).astype(numpy.uint8)
+        target[top // 2:top // 2 + halved.shape[0]] = halved.view(numpy.uint32)[:, :, 0]
+
+    # done
+
+## CachedPyramidSource
+#
+#  Tile source for TiledImageItem that reads tiles from the memory-mapped levels of a cache entry.
+class CachedPyramidSource(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param levels The memory-mapped arrays of words, from full resolution down.
+    #  @param imageFormat Format_RGB32 or Format_ARGB32.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, levels, imageFormat, tileSize=kTileSize):
+        self.levels = levels
+        self.imageFormat = imageFormat
+        self.tileSize = tileSize
+
+        # done
+
+    ## Size of the full resolution image
+    #  @param self The object pointer.
+    def size(self):
+        return QtCore.QSize(self.levels[0].shape[1], self.levels[0].shape[0])
+
+    ## Number of pyramid levels
+    #  @param self The object pointer.
+    def levelCount(self):
+        return len(self.levels)
+
+    ## Size of the image at a given pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelSize(self, level):
+        return QtCore.QSize(self.levels[level].shape[1], self.levels[level].shape[0])
+
+    ## The full resolution image, sharing the mapped memory
+    #  @param self The object pointer.
+    def image(self):
+        return wordsToQImage(self.levels[0], self.imageFormat)
+
+    ## Image data for one tile; only the pages under the tile are read
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileImage(self, level, rect):
+        words = self.levels[level][rect.top():rect.top() + rect.height(), rect.left():rect.left() + rect.width()]
+        return wordsToQImage(words, self.imageFormat)
+
+## PyramidCache
+#
+#  Directory of cached pyramids, one subdirectory per file version, within a byte budget.
+#  The least recently opened entries are removed first. Safe to use from worker threads and processes.
+class PyramidCache(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param directory The cache directory; created when needed.
+    #  @param budget The maximum number of bytes to keep on disk.
+    def __init__(self, directory, budget=kDefaultCacheBudget):
+        self.directory = os.path.abspath(directory)
+        self.budget = budget
+        self.lock = threading.Lock()
+
+        # counters
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+        # done
+
+    ## The cache configured by the environment
+    #  @return The PyramidCache, or None if no directory is set.
+    @staticmethod
+    def fromEnvironment():
+        directory = os.environ.get(kCacheDirectoryVariable)
+        if not directory:
+            return None
+        return PyramidCache(directory, environmentBudget())
+
+    ## Directory of the entry for the current version of a file
+    #  @param self The object pointer.
+    #  @param filePath The path to the image file.
+    #  @return The path, or None if the file cannot be accessed.
+    def entryPath(self, filePath):
+        key = cacheKey(filePath)
+        if key is None:
+            return None
+        return os.path.join(self.directory, hashlib.sha1(repr(key).encode('utf-8')).hexdigest())
+
+    ## Whether the current version of a file is cached
+    #  @param self The object pointer.
+    #  @param filePath The path to the image file.
+    def contains(self, filePath):
+        entryPath = self.entryPath(filePath)
+        return entryPath is not None and os.path.exists(os.path.join(entryPath, kMetaFile))
+
+    ## The cached pyramid of a file, if the same version was stored before
+    #  @param self The object pointer.
+    #  @param filePath The path to the image file.
+    #  @return The CachedPyramidSource, or None.
+    def load(self, filePath):
+        entryPath = self.entryPath(filePath)
+        try:
+            metaPath = os.path.join(entryPath, kMetaFile)
+            with open(metaPath) as metaFile:
+                meta = json.load(metaFile)
+            if meta.get('version') != kFormatVersion:
+                raise ValueError("old cache format")
+            levels = [numpy.load(os.path.join(entryPath, levelFileName(level)), mmap_mode='r') for level in range(meta['levels'])]
+            # most recently used: the time of the meta file is what the cleanup goes by
+            os.utime(metaPath, None)
+        except (TypeError, IOError, OSError, ValueError, KeyError):
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+        imageFormat = QtGui.QImage.Format_ARGB32 if meta.get('alpha') else QtGui.QImage.Format_RGB32
+        return CachedPyramidSource(levels, imageFormat)
+
+    ## Store a decoded image and its pyramid
+    #  Small images decode quickly and are not stored.
+    #  @param self The object pointer.
+    #  @param filePath The path to the image file.
+    #  @param image The decoded QImage.
+    #  @return True if the image was stored.
+    def store(self, filePath, image):
+        entryPath = self.entryPath(filePath)
+        if entryPath is None or image.isNull() or image.width() * image.height() < kMinCachedPixels:
+            return False
+        if os.path.exists(os.path.join(entryPath, kMetaFile)):
+            return True
+
+        alpha = image.hasAlphaChannel()
+        imageFormat = QtGui.QImage.Format_ARGB32 if alpha else QtGui.QImage.Format_RGB32
+        if image.format() != imageFormat:
+            image = image.convertToFormat(imageFormat)
+
+        # written under a temporary name, so that nobody sees a half-written entry
+        temporaryPath = entryPath + '.' + str(os.getpid()) + '.' + str(threading.current_thread().ident) + '.tmp'
+        try:
+            os.makedirs(temporaryPath)
+            source = imageWords(image)
+            longestSide = max(image.width(), image.height())
+            levelCount = max(1, int(math.ceil(math.log(float(longestSide) / kTileSize, 2))) + 1)
+            totalBytes = 0
+            for level in range(levelCount):
+                shape = source.shape if level == 0 else ((source.shape[0] + 1) // 2, (source.shape[1] + 1) // 2)
+                target = numpy.lib.format.open_memmap(os.path.join(temporaryPath, levelFileName(level)), mode='w+', dtype=numpy.uint32, shape=shape)
+                if level == 0:
+                    for top in range(0, shape[0], kStripeRows):
+                        target[top:top + kStripeRows] = source[top:top + kStripeRows]
+                else:
+                    writeHalvedLevel(source, target)
+                target.flush()
+                totalBytes += target.nbytes
+                source = target
+            del source, target
+            with open(os.path.join(temporaryPath, kMetaFile), 'w') as metaFile:
+                json.dump({'version': kFormatVersion, 'path': os.path.abspath(filePath), 'width': image.width(), 'height': image.height(),
+                           'levels': levelCount, 'alpha': alpha, 'bytes': totalBytes}, metaFile)
+            os.rename(temporaryPath, entryPath)
+        except (IOError, OSError):
+            # e.g. a full disk, or another process stored the same file first
+            shutil.rmtree(temporaryPath, ignore_errors=True)
+            return self.contains(filePath)
+
+        with self.lock:
+            self.stores += 1
+        self.trim()
+        return True
+
+    ## Cached entries with their size and time of last use, least recently used first
+    #  @param self The object pointer.
+    def entries(self):
+        entries = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return entries
+        for name in names:
+            metaPath = os.path.join(self.directory, name, kMetaFile)
+            try:
+                with open(metaPath) as metaFile:
+                    size = json.load(metaFile).get('bytes', 0)
+                entries.append((os.path.getmtime(metaPath), size, os.path.join(self.directory, name)))
+            except (IOError, OSError, ValueError):
+                continue
+        entries.sort()
+        return entries
+
+    ## Number of bytes used by the cached entries
+    #  @param self The object pointer.
+    def usedBytes(self):
+        return sum(entry[1] for entry in self.entries())
+
+    ## Remove least recently used entries until the budget is met
+    #  @param self The object pointer.
+    #  @return The number of entries removed.
+    def trim(self):
+        entries = self.entries()
+        usedBytes = sum(entry[1] for entry in entries)
+        removed = 0
+        for lastUse, size, entryPath in entries:
+            if usedBytes <= self.budget:
+                break
+            # mapped files stay readable until they are closed (except on Windows, where removal fails)
+            shutil.rmtree(entryPath, ignore_errors=True)
+            if not os.path.exists(entryPath):
+                usedBytes -= size
+                removed += 1
+        return removed
+
+    ## Counters and disk use, for display
+    #  @param self The object pointer.
+    def formatStatistics(self):
+        return ("pyramid cache: " + str(self.usedBytes() // (1024 * 1024)) + " of " + str(self.budget // (1024 * 1024)) + " MB; "
+                + str(self.hits) + " hits, " + str(self.misses) + " misses, " + str(self.stores) + " stored")
+
+## Size limit of the cache set by the environment
+#  A value that is not a whole number of megabytes is reported and the default is used instead.
+#  @return The budget in bytes.
+def environmentBudget():
+    budget = os.environ.get(kCacheBudgetVariable)
+    if not budget:
+        return kDefaultCacheBudget
+    try:
+        return int(budget) * 1024 * 1024
+    except ValueError:
+        sys.stderr.write(kCacheBudgetVariable + "=" + budget + " is not a number of megabytes, using " + str(kDefaultCacheBudget // (1024 * 1024)) + "\n")
+        return kDefaultCacheBudget
+
+## The cache shared by all image loaders, or None if it is not enabled
+pyramidCache = PyramidCache.fromEnvironment()
+
+## Image files in a directory tree that Qt can decode and that are not memory-mapped anyway
+#  @param directory The directory to search.
+def imageFiles(directory):
+    extensions = set('.' + bytes(name).decode('ascii').lower() for name in QtGui.QImageReader.supportedImageFormats())
+    for root, directories, files in os.walk(directory):
+        directories.sort()
+        for name in sorted(files):
+            if os.path.splitext(name)[1].lower() in extensions and not isMappable(name):
+                yield os.path.join(root, name)
+
+## Decode one image and store it in a cache; runs in a worker process
+#  @param task Tuple of the cache directory, its budget and the image path.
+#  @return Tuple of the image path and 'cached', 'stored', 'skipped' or 'failed'.
+def prewarmFile(task):
+    directory, budget, filePath = task
+    cache = PyramidCache(directory, budget)
+    if cache.contains(filePath):
+        return filePath, 'cached'
+    image = QtGui.QImageReader(filePath).read()
+    if image.isNull():
+        return filePath, 'failed'
+    return filePath, 'stored' if cache.store(filePath, image) else 'skipped'
+
+## Command line entry point: decode all images in some directories into the cache
+#  @param argv The arguments, without the program name.
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='image_comparator.py --prewarm', description="Store the pyramids of all images in some directories in the on-disk cache.")
+    parser.add_argument('directories', nargs='+', metavar='DIR', help="directories to search for images, recursively")
+    parser.add_argument('--cache-dir', default=os.environ.get(kCacheDirectoryVariable), help="cache directory (default: $" + kCacheDirectoryVariable + ")")
+    parser.add_argument('--budget-mb', type=int, default=None, help="size limit of the cache in megabytes (default: $" + kCacheBudgetVariable + ", else 4096)")
+    parser.add_argument('--jobs', '-j', type=int, default=None, help="number of worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+    if not args.cache_dir:
+        parser.error("no cache directory: use --cache-dir or set " + kCacheDirectoryVariable)
+
+    budget = environmentBudget() if args.budget_mb is None else args.budget_mb * 1024 * 1024
+    tasks = [(args.cache_dir, budget, filePath) for directory in args.directories for filePath in imageFiles(directory)]
+
+    counts = {'cached': 0, 'stored': 0, 'skipped': 0, 'failed': 0}
+    pool = multiprocessing.Pool(processes=args.jobs)
+    try:
+        for filePath, outcome in pool.imap_unordered(prewarmFile, tasks, chunksize=1):
+            counts[outcome] += 1
+            print(outcome + '\t' + filePath)
+        pool.close()
+    except KeyboardInterrupt:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+    cache = PyramidCache(args.cache_dir, budget)
+    print(str(counts['stored']) + " stored, " + str(counts['cached']) + " already cached, " + str(counts['skipped']) + " too small, " + str(counts['failed']) + " failed; "
+          + str(cache.usedBytes() // (1024 * 1024)) + " MB in " + cache.directory)
+    return 1 if counts['failed'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
+
+# end
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  region_stats.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Statistics of two images over any rectangle in constant time.
+#  Sums, squared sums and absolute difference sums are kept as summed-area tables
+#  over a grid of blocks, minima and maxima as sparse tables over the same grid.
+#
+
+# calculations
+import math
+import numpy
+
+# image helpers
+from image_diff import colorChannels, commonShape
+
+# constants
+kMaxTableCells = 1 << 20
+kExactRegionPixels = 256 * 256
+kMaxSparseLevel = 5
+
+## Smallest power-of-two block size that keeps the table grid within kMaxTableCells
+#  Images of up to kMaxTableCells pixels get exact (1 x 1) blocks.
+#  @param height Image height.
+#  @param width Image width.
+def chooseBlockSize(height, width):
+    blockSize = 1
+    while int(math.ceil(height / float(blockSize))) * int(math.ceil(width / float(blockSize))) > kMaxTableCells:
+        blockSize *= 2
+    return blockSize
+
+## Summed-area table of per-block values
+#  @param blocks Block values, grid height x grid width x channels.
+#  @return Table with one extra leading row and column of zeros.
+def summedAreaTable(blocks):
+    table = numpy.zeros((blocks.shape[0] + 1, blocks.shape[1] + 1, blocks.shape[2]), numpy.float64)
+    numpy.cumsum(blocks, axis=0, out=table[1:, 1:])
+    numpy.cumsum(table[1:, 1:], axis=1, out=table[1:, 1:])
+    return table
+
+## Sparse table levels: level k holds the extreme over 2^k x 2^k blocks
+#  @param blocks Per-block minima or maxima.
+#  @param reduce numpy.minimum or numpy.maximum.
+def sparseTable(blocks, reduce):
+    levels = [blocks]
+    while len(levels) <= kMaxSparseLevel:
+        half = 2 ** (len(levels) - 1)
+        previous = levels[-1]
+        if previous.shape[0] <= half or previous.shape[1] <= half:
+            break
+        levels.append(reduce(reduce(previous[:-half, :-half], previous[half:, :-half]), reduce(previous[:-half, half:], previous[half:, half:])))
+    return levels
+
+## Look up a rectangle of blocks in a sparse table
+#  The rectangle is covered by overlapping squares of the largest available level.
+#  @param levels The sparse table.
+#  @param top First block row.
+#  @param left First block column.
+#  @param bottom Last block row + 1.
+#  @param right Last block column + 1.
+#  @param reduce numpy.min or numpy.max.
+def sparseQuery(levels, top, left, bottom, right, reduce):
+    level = min(int(math.log(min(bottom - top, right - left), 2)), len(levels) - 1)
+    size = 2 ** level
+    rows = list(range(top, bottom - size + 1, size)) + [bottom - size]
+    columns = list(range(left, right - size + 1, size)) + [right - size]
+    return reduce(levels[level][rows][:, columns], axis=(0, 1))
+
+## RegionStatistics
+#
+#  Per-channel mean, standard deviation, minimum and maximum of two images,
+#  and their mean absolute difference, for any rectangle.
+#  Small rectangles are computed exactly from the pixels; larger ones are snapped to the block grid
+#  and answered from the tables, so every query costs about the same.
+class RegionStatistics(object):
+    ## The constructor. Building the tables takes one pass over both images.
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    def __init__(self, arrayA, arrayB):
+        self.height, self.width = commonShape(arrayA, arrayB)
+        self.arrayA = colorChannels(arrayA)[:self.height, :self.width]
+        self.arrayB = colorChannels(arrayB)[:self.height, :self.width]
+        self.blockSize = chooseBlockSize(self.height, self.width)
+
+        # per-block values, built one stripe of block rows at a time
+        blockStarts = numpy.arange(0, self.width, self.blockSize)
+        gridHeight = int(math.ceil(self.height / float(self.blockSize)))
+        blocks = {}
+        for row in range(gridHeight):
+            rows = slice(row * self.blockSize, (row + 1) * self.blockSize)
+            stripeA = self.arrayA[rows].astype(numpy.float64)
+            stripeB = self.arrayB[rows].astype(numpy.float64)
+            values = {
+                'sumA': stripeA, 'squareA': numpy.square(stripeA),
+                'sumB': stripeB, 'squareB': numpy.square(stripeB),
+                'absDiff': numpy.abs(stripeB - stripeA),
+            }
+            for name, stripe in values.items():
+                blocks.setdefault(name, []).append(numpy.add.reduceat(stripe.sum(axis=0), blockStarts, axis=0))
+            for name, stripe in (('A', self.arrayA[rows]), ('B', self.arrayB[rows])):
+                blocks.setdefault('min' + name, []).append(numpy.minimum.reduceat(stripe.min(axis=0), blockStarts, axis=0))
+                blocks.setdefault('max' + name, []).append(numpy.maximum.reduceat(stripe.max(axis=0), blockStarts, axis=0))
+
+        self.tables = {}
+        for name in ('sumA', 'squareA', 'sumB', 'squareB', 'absDiff'):
+            self.tables[name] = summedAreaTable(numpy.array(blocks[name]))
+        self.minA = sparseTable(numpy.array(blocks['minA']), numpy.minimum)
+        self.maxA = sparseTable(numpy.array(blocks['maxA']), numpy.maximum)
+        self.minB = sparseTable(numpy.array(blocks['minB']), numpy.minimum)
+        self.maxB = sparseTable(numpy.array(blocks['maxB']), numpy.maximum)
+
+        # done
+
+    ## Sum of a table over a rectangle of blocks
+    #  @param self The object pointer.
+    #  @param name The table name.
+    #  @param top First block row.
+    #  @param left First block column.
+    #  @param bottom Last block row + 1.
+    #  @param right Last block column + 1.
+    def tableSum(self, name, top, left, bottom, right):
+        table = self.tables[name]
+        return table[bottom, right] - table[top, right] - table[bottom, left] + table[top, left]
+
+    ## Statistics over a rectangle
+    #  @param self The object pointer.
+    #  @param x Left edge, in image pixels.
+    #  @param y Top edge, in image pixels.
+    #  @param width Width, in image pixels.
+    #  @param height Height, in image pixels.
+    #  @return A dictionary of per-channel lists (meanA, stdA, minA, maxA, the same for B, and meanAbsDiff),
+    #          the rectangle actually used (x, y, width, height), and whether it is exact; None if the rectangle is outside the images.
+    def regionStatistics(self, x, y, width, height):
+        left = max(0, int(math.floor(x)))
+        top = max(0, int(math.floor(y)))
+        right = min(self.width, int(math.ceil(x + width)))
+        bottom = min(self.height, int(math.ceil(y + height)))
+        if right <= left or bottom <= top:
+            return None
+
+        if (right - left) * (bottom - top) <= kExactRegionPixels:
+            return self.exactStatistics(left, top, right, bottom)
+
+        # snap to the block grid
+        gridLeft = int(round(left / float(self.blockSize)))
+        gridTop = int(round(top / float(self.blockSize)))
+        gridRight = max(gridLeft + 1, int(round(right / float(self.blockSize))))
+        gridBottom = max(gridTop + 1, int(round(bottom / float(self.blockSize))))
+        gridRight = min(gridRight, self.tables['sumA'].shape[1] - 1)
+        gridBottom = min(gridBottom, self.tables['sumA'].shape[0] - 1)
+        gridLeft = min(gridLeft, gridRight - 1)
+        gridTop = min(gridTop, gridBottom - 1)
+
+        left = gridLeft * self.blockSize
+        top = gridTop * self.blockSize
+        right = min(self.width, gridRight * self.blockSize)
+        bottom = min(self.height, gridBottom * self.blockSize)
+        count = float((right - left) * (bottom - top))
+
+        grid = (gridTop, gridLeft, gridBottom, gridRight)
+        meanA = self.tableSum('sumA', *grid) / count
+        meanB = self.tableSum('sumB', *grid) / count
+        varianceA = numpy.maximum(self.tableSum('squareA', *grid) / count - numpy.square(meanA), 0.0)
+        varianceB = numpy.maximum(self.tableSum('squareB', *grid) / count - numpy.square(meanB), 0.0)
+
+        return {
+            'rect': (left, top, right - left, bottom - top),
+            'exact': self.blockSize == 1,
+            'meanA': meanA.tolist(), 'stdA': numpy.sqrt(varianceA).tolist(),
+            'minA': sparseQuery(self.minA, *(grid + (numpy.min,))).tolist(),
+            'maxA': sparseQuery(self.maxA, *(grid + (numpy.max,))).tolist(),
+            'meanB': meanB.tolist(), 'stdB': numpy.sqrt(varianceB).tolist(),
+            'minB': sparseQuery(self.minB, *(grid + (numpy.min,))).tolist(),
+            'maxB': sparseQuery(self.maxB, *(grid + (numpy.max,))).tolist(),
+            'meanAbsDiff': (self.tableSum('absDiff', *grid) / count).tolist(),
+        }
+
+    ## Statistics of a small rectangle, straight from the pixels
+    #  @param self The object pointer.
+    #  @param left Left edge, in image pixels.
+    #  @param top Top edge, in image pixels.
+    #  @param right Right edge + 1.
+    #  @param bottom Bottom edge + 1.
+    def exactStatistics(self, left, top, right, bottom):
+        regionA = self.arrayA[top:bottom, left:right].astype(numpy.float64)
+        regionB = self.arrayB[top:bottom, left:right].astype(numpy.float64)
+        return {
+            'rect': (left, top, right - left, bottom - top),
+            'exact': True,
+            'meanA': regionA.mean(axis=(0, 1)).tolist(), 'stdA': regionA.std(axis=(0, 1)).tolist(),
+            'minA': regionA.min(axis=(0, 1)).tolist(), 'maxA': regionA.max(axis=(0, 1)).tolist(),
+            'meanB': regionB.mean(axis=(0, 1)).tolist(), 'stdB': regionB.std(axis=(0, 1)).tolist(),
+            'minB': regionB.min(axis=(0, 1)).tolist(), 'maxB': regionB.max(axis=(0, 1)).tolist(),
+            'meanAbsDiff': numpy.abs(regionB - regionA).mean(axis=(0, 1)).tolist(),
+        }
+
+## Format statistics for display, one line per image
+#  @param stats A dictionary from RegionStatistics.regionStatistics.
+def formatStatistics(stats):
+    def values(key, precision=1):
+        return '/'.join(('%.' + str(precision) + 'f') % value for value in stats[key])
+
+    lines = []
+    for label, suffix in (("image 1", 'A'), ("image 2", 'B')):
+        lines.append(label + ": mean " + values('mean' + suffix) + ", std " + values('std' + suffix) + ", min " + values('min' + suffix, 0) + ", max " + values('max' + suffix, 0))
+    lines.append("mean abs. difference: " + values('meanAbsDiff', 2) + ("" if stats['exact'] else " (block-aligned)"))
+    return '\n'.join(lines)
+
+# end
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  sequence_compare.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+#  Comparison of two image sequences, e.g. two renders of an animation, frame by frame.
+#  Frames are decoded and compared on a few worker threads, a small number of frames ahead of
+#  the one being reported, so memory does not grow with the length of the sequence.
+#  The difference of every frame is drawn on a timeline, which is also used to pick a frame.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# worker threads
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# calculations
+import numpy
+
+# comparison of one pair
+from batch_compare import comparePair, kResultFields
+
+# constants
+kReadAhead = 4
+kTimelineHeight = 48
+kTimelineMetric = 'meanAbsDiff'
+kTimelineBackground = QtGui.QColor(0, 0, 0, 160)
+kTimelineBarColor = QtGui.QColor(80, 200, 255)
+kTimelineErrorColor = QtGui.QColor(255, 60, 60)
+kTimelineCursorColor = QtGui.QColor(255, 255, 0)
+
+## Result of a pair compared on a worker thread
+#  A pair whose comparison failed gets a result with only the error filled in, like a pair that cannot be read.
+#  @param future The future of comparePair.
+#  @param pathA The path to the first image.
+#  @param pathB The path to the second image.
+def pairResult(future, pathA, pathB):
+    try:
+        return future.result()
+    except Exception as error:
+        result = dict.fromkeys(kResultFields)
+        result['imageA'] = pathA
+        result['imageB'] = pathB
+        result['error'] = type(error).__name__ + ": " + str(error)
+        return result
+
+## Metrics of every pair of a sequence, in order
+#  Pairs are compared on worker threads while earlier results are consumed; at most readAhead pairs
+#  are decoded or held at a time. Closing the generator drops the pairs not compared yet.
+#  @param pairs Iterable of (pathA, pathB).
+#  @param threshold Largest difference still considered equal.
+#  @param readAhead Number of pairs compared ahead of the one returned.
+#  @return Generator of result dictionaries, as batch_compare.comparePair.
+def streamPairMetrics(pairs, threshold=0, readAhead=kReadAhead):
+    executor = ThreadPoolExecutor(max_workers=readAhead)
+    pending = collections.deque()
+    try:
+        for pathA, pathB in pairs:
+            pending.append((executor.submit(comparePair, (pathA, pathB, threshold)), pathA, pathB))
+            if len(pending) >= readAhead:
+                yield pairResult(*pending.popleft())
+        while pending:
+            yield pairResult(*pending.popleft())
+    finally:
+        for future, pathA, pathB in pending:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+## SequenceScan
+#
+#  Runs streamPairMetrics on a thread of its own and reports each frame's result to the GUI thread.
+class SequenceScan(QtCore.QObject):
+    # index of the frame and its result dictionary
+    measured = QtCore.pyqtSignal(int, object)
+    # every frame has been compared, or the scan was cancelled
+    completed = QtCore.pyqtSignal()
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param pairs List of (pathA, pathB).
+    #  @param threshold Largest difference still considered equal.
+    #  @param parent The parent object.
+    def __init__(self, pairs, threshold=0, parent=None):
+        super(SequenceScan, self).__init__(parent)
+        self.pairs = list(pairs)
+        self.threshold = threshold
+        self.cancelled = False
+
+        # done
+
+    ## Start comparing the frames
+    #  @param self The object pointer.
+    def start(self):
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+
+        # done
+
+    ## Stop after the frames being compared; their results are not reported
+    #  @param self The object pointer.
+    def cancel(self):
+        self.cancelled = True
+
+        # done
+
+    ## Compare the frames, in the scan thread
+    #  @param self The object pointer.
+    def run(self):
+        stream = streamPairMetrics(self.pairs, self.threshold)
+        try:
+            for index, result in enumerate(stream):
+                if self.cancelled:
+                    break
+                self.measured.emit(index, result)
+        finally:
+            stream.close()
+            # the timeline stops waiting even if the scan itself failed
+            self.completed.emit()
+
+        # done
+
+## SequenceTimeline
+#
+#  Sparkline of the difference of every frame, with the current frame marked.
+#  Clicking or dragging on it selects a frame.
+class SequenceTimeline(QtGui.QWidget):
+    # index of the frame under the mouse
+    frameSelected = QtCore.pyqtSignal(int)
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The parent widget.
+    def __init__(self, parent=None):
+        super(SequenceTimeline, self).__init__(parent)
+        self.setMouseTracking(False)
+        self.setLength(0)
+
+        # done
+
+    ## Start again with a number of frames, none measured yet
+    #  @param self The object pointer.
+    #  @param count The number of frames.
+    def setLength(self, count):
+        # NaN for frames not measured yet, -1 for frames that could not be compared
+        self.values = numpy.full(count, numpy.nan)
+        self.measuredCount = 0
+        self.current = 0
+        self.update()
+
+        # done
+
+    ## Record the result of one frame
+    #  @param self The object pointer.
+    #  @param index The index of the frame.
+    #  @param result The result dictionary of the frame.
+    def setResult(self, index, result):
+        value = result.get(kTimelineMetric)
+        self.values[index] = -1.0 if result.get('error') or value is None else float(value)
+        self.measuredCount += 1
+        self.update()
+
+        # done
+
+    ## Mark the frame shown in the views
+    #  @param self The object pointer.
+    #  @param index The index of the frame.
+    def setCurrent(self, index):
+        self.current = index
+        self.update()
+
+        # done
+
+    ## Index of the frame at a horizontal position
+    #  @param self The object pointer.
+    #  @param x The position, in widget pixels.
+    def frameAt(self, x):
+        count = len(self.values)
+        return min(max(int(x * count // max(1, self.width())), 0), count - 1)
+
+    ## Select the frame under the mouse
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def mousePressEvent(self, event):
+        if len(self.values) and event.button() == QtCore.Qt.LeftButton:
+            self.frameSelected.emit(self.frameAt(event.pos().x()))
+
+        # done
+
+    ## Scrub through the frames while the button is held
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def mouseMoveEvent(self, event):
+        if len(self.values) and event.buttons() & QtCore.Qt.LeftButton:
+            index = self.frameAt(event.pos().x())
+            if index != self.current:
+                self.frameSelected.emit(index)
+
+        # done
+
+    ## Draw one bar per column of pixels, the highest difference of the frames it covers
+    #  @param self The object pointer.
+    #  @param event The event pointer.
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), kTimelineBackground)
+        count = len(self.values)
+        width, height = self.width(), self.height()
+        if count == 0 or width == 0:
+            painter.end()
+            return
+
+        # frames covered by every column; a column covers at least one frame
+        columns = min(width, count)
+        starts = numpy.arange(columns) * count // columns
+        values = numpy.nan_to_num(self.values, nan=0.0)
+        peaks = numpy.maximum.reduceat(values, starts)
+        errors = numpy.minimum.reduceat(values, starts) < 0
+        scale = (height - 1) / peaks.max() if peaks.max() > 0 else 0.0
+        columnWidth = float(width) / columns
+        for column in range(columns):
+            left = int(column * columnWidth)
+            right = max(left + 1, int((column + 1) * columnWidth))
+            if errors[column]:
+                painter.fillRect(left, 0, right - left, height, kTimelineErrorColor)
+            elif peaks[column] > 0:
+                barHeight = max(1, int(peaks[column] * scale))
+                painter.fillRect(left, height - barHeight, right - left, barHeight, kTimelineBarColor)
+
+        # the current frame, and how far the scan has come
+        painter.setPen(kTimelineCursorColor)
+        x = int((self.current + 0.5) * width / count)
+        painter.drawLine(x, 0, x, height)
+        painter.setPen(QtCore.Qt.white)
+        text = "frame " + str(self.current + 1) + " of " + str(count)
+        value = self.values[self.current]
+        if value >= 0:
+            text += ": mean abs. diff %.4g" % value
+        elif value < 0:
+            text += ": not compared"
+        if self.measuredCount < count:
+            text += " (" + str(self.measuredCount) + " compared)"
+        painter.drawText(self.rect().adjusted(4, 2, -4, -2), QtCore.Qt.AlignLeft | QtCore.Qt.AlignTop, text)
+        painter.end()
+
+        # done
+
+# end
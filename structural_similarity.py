@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  structural_similarity.py
+#  @author: Chamin Morikawa
+#
+#  Structural similarity (SSIM) and multi-scale SSIM of two images. Local statistics come from a
+#  separable 11-tap Gaussian window (sigma 1.5), applied with shifted array additions, on the luma
+#  of the images. Similarity maps are only computed for the tiles that are looked at; the score of
+#  the whole image is computed in the background, one stripe of tiles at a time, and is kept per
+#  tile so that the score of any area is read from the tiles it covers.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# calculations
+import math
+import numpy
+
+# image helpers
+from image_diff import colorChannels, commonShape, kHeatTable, valueRange
+from mapped_image import arrayToQImage
+
+# constants
+kSsimMode = "SSIM"
+kWindowRadius = 5
+kWindowSigma = 1.5
+kK1 = 0.01
+kK2 = 0.03
+kTileSize = 256
+kScaleWeights = (0.0448, 0.2856, 0.3001, 0.2363, 0.1333)
+kLumaWeights = (0.299, 0.587, 0.114)
+kDefaultGain = 4.0
+kDimming = 0.35
+
+## Weights of the Gaussian window, from the centre outwards
+def windowWeights():
+    weights = numpy.exp(-numpy.arange(kWindowRadius + 1) ** 2 / (2.0 * kWindowSigma ** 2))
+    return (weights / (2.0 * weights.sum() - weights[0])).astype(numpy.float32)
+
+kWindowWeights = windowWeights()
+
+## Luma of a region, as float32
+#  @param region Region of an image, height x width (x channels); or a plane that is luma already.
+def lumaPlane(region):
+    region = colorChannels(region)
+    if region.shape[2] == 1:
+        return region[:, :, 0].astype(numpy.float32)
+    luma = region[:, :, 0] * numpy.float32(kLumaWeights[0])
+    luma += region[:, :, 1] * numpy.float32(kLumaWeights[1])
+    luma += region[:, :, 2] * numpy.float32(kLumaWeights[2])
+    return luma
+
+## Luma of a region with a margin around it, mirrored where the margin is outside the image
+#  Coordinates are in pixels of a subsampled image: every step-th pixel of the original.
+#  @param array The image array (or luma plane).
+#  @param height Height of the compared area of the original.
+#  @param width Width of the compared area of the original.
+#  @param top First row of the region.
+#  @param left First column of the region.
+#  @param bottom Last row + 1.
+#  @param right Last column + 1.
+#  @param step Subsampling step.
+def paddedLuma(array, height, width, top, left, bottom, right, step=1):
+    levelHeight = -(-height // step)
+    levelWidth = -(-width // step)
+    firstRow, firstColumn = max(0, top - kWindowRadius), max(0, left - kWindowRadius)
+    lastRow, lastColumn = min(levelHeight, bottom + kWindowRadius), min(levelWidth, right + kWindowRadius)
+    luma = lumaPlane(array[firstRow * step:min(lastRow * step, height):step, firstColumn * step:min(lastColumn * step, width):step])
+    padding = ((firstRow - (top - kWindowRadius), bottom + kWindowRadius - lastRow), (firstColumn - (left - kWindowRadius), right + kWindowRadius - lastColumn))
+    if any(before or after for before, after in padding):
+        luma = numpy.pad(luma, padding, mode='symmetric')
+    return luma
+
+## Gaussian-weighted local mean, losing kWindowRadius pixels on every side
+#  The window is separable and symmetric: one pass per axis, adding mirrored pairs of shifted arrays.
+#  @param plane The samples, float32.
+def windowMean(plane):
+    # rows first, then the columns of the transposed result
+    for axis in range(2):
+        length = plane.shape[0] - 2 * kWindowRadius
+        result = plane[kWindowRadius:kWindowRadius + length] * kWindowWeights[0]
+        for distance in range(1, kWindowRadius + 1):
+            result += (plane[kWindowRadius - distance:kWindowRadius - distance + length] + plane[kWindowRadius + distance:kWindowRadius + distance + length]) * kWindowWeights[distance]
+        plane = result.T
+    return plane
+
+## SSIM and contrast-structure maps of two padded luma planes
+#  @param lumaA The luma of the first image, with kWindowRadius pixels of margin on every side.
+#  @param lumaB The same for the second image.
+#  @param dataRange The largest sample value.
+#  @return The SSIM map and the contrast-structure map, without the margin.
+def similarityMaps(lumaA, lumaB, dataRange):
+    c1 = numpy.float32((kK1 * dataRange) ** 2)
+    c2 = numpy.float32((kK2 * dataRange) ** 2)
+    meanA = windowMean(lumaA)
+    meanB = windowMean(lumaB)
+    meanAB = meanA * meanB
+    meanSquares = meanA * meanA + meanB * meanB
+    variances = windowMean(lumaA * lumaA) + windowMean(lumaB * lumaB) - meanSquares
+    covariance = windowMean(lumaA * lumaB) - meanAB
+    contrastStructure = (2.0 * covariance + c2) / (variances + c2)
+    return (2.0 * meanAB + c1) / (meanSquares + c1) * contrastStructure, contrastStructure
+
+## Average of 2 x 2 blocks, for the next scale of MS-SSIM
+#  @param plane A luma plane.
+def halvePlane(plane):
+    height, width = plane.shape[0] // 2 * 2, plane.shape[1] // 2 * 2
+    plane = plane[:height, :width]
+    return (plane[0::2, 0::2] + plane[1::2, 0::2] + plane[0::2, 1::2] + plane[1::2, 1::2]) * numpy.float32(0.25)
+
+## SimilarityIndex
+#
+#  SSIM of two images, kept as the sum of the SSIM and contrast-structure maps of every tile.
+#  Tiles are measured when the SSIM map shows them, or by computeGlobal in the background.
+class SimilarityIndex(object):
+    ## The constructor. Nothing is computed yet.
+    #  @param self The object pointer.
+    #  @param arrayA The first image array.
+    #  @param arrayB The second image array.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, arrayA, arrayB, tileSize=kTileSize):
+        self.arrayA = arrayA
+        self.arrayB = arrayB
+        self.tileSize = tileSize
+        self.height, self.width = commonShape(arrayA, arrayB)
+        self.dataRange = valueRange(arrayA.dtype)
+
+        # sums per tile; NaN until the tile is measured
+        rows = -(-self.height // tileSize)
+        columns = -(-self.width // tileSize)
+        self.ssimSums = numpy.full((rows, columns), numpy.nan)
+        self.contrastSums = numpy.full((rows, columns), numpy.nan)
+        self.tileAreas = numpy.outer(numpy.minimum(tileSize, self.height - numpy.arange(rows) * tileSize),
+                                     numpy.minimum(tileSize, self.width - numpy.arange(columns) * tileSize)).astype(numpy.float64)
+
+        # the background computation: how far it has come, and whether to stop
+        self.progress = 0.0
+        self.cancelled = False
+
+        # done
+
+    ## SSIM and contrast-structure maps of a rectangle, possibly of subsampled images
+    #  Full-resolution maps are added to the tile sums of the tiles they cover completely.
+    #  @param self The object pointer.
+    #  @param top First row.
+    #  @param left First column.
+    #  @param bottom Last row + 1.
+    #  @param right Last column + 1.
+    #  @param step Subsampling step; coordinates are in pixels of the subsampled images.
+    #  @return The SSIM map, the contrast-structure map, and the luma of the first image with its margin.
+    def maps(self, top, left, bottom, right, step=1):
+        lumaA = paddedLuma(self.arrayA, self.height, self.width, top, left, bottom, right, step)
+        lumaB = paddedLuma(self.arrayB, self.height, self.width, top, left, bottom, right, step)
+        ssim, contrastStructure = similarityMaps(lumaA, lumaB, self.dataRange)
+        if step == 1 and top % self.tileSize == 0 and left % self.tileSize == 0:
+            self.recordTiles(ssim, contrastStructure, top, left)
+        return ssim, contrastStructure, lumaA
+
+    ## Add the sums of the whole tiles in a pair of maps
+    #  @param self The object pointer.
+    #  @param ssim The SSIM map, starting on a tile boundary.
+    #  @param contrastStructure The contrast-structure map.
+    #  @param top First row of the maps.
+    #  @param left First column of the maps.
+    def recordTiles(self, ssim, contrastStructure, top, left):
+        size = self.tileSize
+        for row in range(ssim.shape[0] // size + 1):
+            for column in range(ssim.shape[1] // size + 1):
+                tileRow, tileColumn = top // size + row, left // size + column
+                block = (slice(row * size, (row + 1) * size), slice(column * size, (column + 1) * size))
+                if tileRow >= self.ssimSums.shape[0] or tileColumn >= self.ssimSums.shape[1] or ssim[block].size != self.tileAreas[tileRow, tileColumn]:
+                    continue
+                self.ssimSums[tileRow, tileColumn] = ssim[block].sum(dtype=numpy.float64)
+                self.contrastSums[tileRow, tileColumn] = contrastStructure[block].sum(dtype=numpy.float64)
+
+        # done
+
+    ## Mean SSIM over a rectangle, snapped outwards to whole tiles
+    #  Only tiles already measured count, by the SSIM map being painted or by the background
+    #  computation; nothing is computed here, so it is cheap enough for every update of the info label.
+    #  @param self The object pointer.
+    #  @param rect The rectangle (QRectF), in pixels of the compared area.
+    #  @return The mean SSIM and the fraction of the rectangle it covers, or None if no tile is measured.
+    def regionScore(self, rect):
+        size = self.tileSize
+        top, left = max(0, int(rect.top()) // size), max(0, int(rect.left()) // size)
+        bottom = min(self.ssimSums.shape[0], -(-int(math.ceil(rect.bottom())) // size))
+        right = min(self.ssimSums.shape[1], -(-int(math.ceil(rect.right())) // size))
+        if bottom <= top or right <= left:
+            return None
+
+        sums = self.ssimSums[top:bottom, left:right]
+        areas = self.tileAreas[top:bottom, left:right]
+        measured = ~numpy.isnan(sums)
+        if not measured.any():
+            return None
+        return float(sums[measured].sum() / areas[measured].sum()), float(areas[measured].sum() / areas.sum())
+
+    ## Stop the background computation after the stripe it is working on
+    #  @param self The object pointer.
+    def cancel(self):
+        self.cancelled = True
+
+        # done
+
+    ## SSIM and MS-SSIM of the whole compared area, one stripe of tiles at a time
+    #  Runs in the background; the tile sums of the first scale also serve regionScore.
+    #  MS-SSIM uses up to five scales, fewer for small images, with the weights scaled to add up to one.
+    #  @param self The object pointer.
+    #  @return Dictionary with ssim, msssim and the number of scales; None if cancelled.
+    def computeGlobal(self):
+        scales = 1
+        while scales < len(kScaleWeights) and min(self.height, self.width) >> scales > 2 * kWindowRadius:
+            scales += 1
+        rows = self.ssimSums.shape[0]
+        stripes = float(rows + sum(-(-(self.height >> scale) // self.tileSize) for scale in range(1, scales)))
+        done = 0
+
+        # full resolution, measuring the tiles that are still missing
+        for row in range(rows):
+            if self.cancelled:
+                return None
+            if numpy.isnan(self.ssimSums[row]).any():
+                self.maps(row * self.tileSize, 0, min((row + 1) * self.tileSize, self.height), self.width)
+            done += 1
+            self.progress = done / stripes
+        area = self.tileAreas.sum()
+        ssim = float(self.ssimSums.sum() / area)
+
+        # coarser scales, from luma planes halved in size each time
+        contrastMeans = [float(self.contrastSums.sum() / area)]
+        lastSsim = ssim
+        planeA, planeB = self.arrayA, self.arrayB
+        height, width = self.height, self.width
+        for scale in range(1, scales):
+            planeA = self.halved(planeA, height, width)
+            planeB = self.halved(planeB, height, width)
+            if planeA is None or planeB is None:
+                return None
+            height, width = planeA.shape
+            ssimSum = contrastSum = 0.0
+            for top in range(0, height, self.tileSize):
+                if self.cancelled:
+                    return None
+                bottom = min(top + self.tileSize, height)
+                lumaA = paddedLuma(planeA, height, width, top, 0, bottom, width)
+                lumaB = paddedLuma(planeB, height, width, top, 0, bottom, width)
+                stripeSsim, stripeContrast = similarityMaps(lumaA, lumaB, self.dataRange)
+                ssimSum += stripeSsim.sum(dtype=numpy.float64)
+                contrastSum += stripeContrast.sum(dtype=numpy.float64)
+                done += 1
+                self.progress = done / stripes
+            contrastMeans.append(contrastSum / (height * width))
+            lastSsim = ssimSum / (height * width)
+
+        # the last scale contributes its SSIM, the others their contrast-structure
+        values = contrastMeans[:scales - 1] + [lastSsim]
+        weights = numpy.array(kScaleWeights[:scales]) / sum(kScaleWeights[:scales])
+        msssim = float(numpy.prod([max(0.0, value) ** weight for value, weight in zip(values, weights)]))
+        self.progress = 1.0
+        return {'ssim': ssim, 'msssim': msssim, 'scales': scales}
+
+    ## Luma of an image at half the size, built one stripe at a time
+    #  @param self The object pointer.
+    #  @param plane The image array, or the luma plane of the previous scale.
+    #  @param height Height of the area to halve.
+    #  @param width Width of the area to halve.
+    #  @return The halved plane, or None if cancelled.
+    def halved(self, plane, height, width):
+        halved = numpy.empty((height // 2, width // 2), numpy.float32)
+        rows = self.tileSize * 2
+        for top in range(0, height // 2 * 2, rows):
+            if self.cancelled:
+                return None
+            bottom = min(top + rows, height // 2 * 2)
+            halved[top // 2:bottom // 2] = halvePlane(lumaPlane(plane[top:bottom, :width]))
+        return halved
+
+## Colour-coded dissimilarity over the dimmed first image
+#  @param ssim The SSIM map.
+#  @param lumaA The luma of the first image, same size as the map.
+#  @param dataRange The largest sample value.
+#  @param gain Amplification of the dissimilarity, 1 - SSIM.
+#  @return A height x width x 3 uint8 RGB array.
+def similarityHeatmap(ssim, lumaA, dataRange, gain=kDefaultGain):
+    strength = numpy.clip((1.0 - ssim) * gain, 0.0, 1.0)[:, :, numpy.newaxis]
+    grey = (lumaA * numpy.float32(kDimming * 255.0 / dataRange))[:, :, numpy.newaxis]
+    heat = kHeatTable[(strength[:, :, 0] * 255).astype(numpy.uint8)]
+    return (grey * (1.0 - strength) + heat * strength).astype(numpy.uint8)
+
+## SimilarityTileSource
+#
+#  Tile source for TiledImageItem that shows the SSIM map of two images, tile by tile.
+#  Zoomed out, a tile shows the similarity of the subsampled images.
+class SimilarityTileSource(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param index The SimilarityIndex of the images; the tiles shown at full size are recorded in it.
+    #  @param gain Amplification of the dissimilarity.
+    def __init__(self, index, gain=kDefaultGain):
+        self.index = index
+        self.gain = gain
+        self.tileSize = index.tileSize
+
+        longestSide = max(index.width, index.height, 1)
+        self.numLevels = max(1, int(math.ceil(math.log(float(longestSide) / self.tileSize, 2))) + 1)
+
+        # done
+
+    ## Size of the compared area
+    #  @param self The object pointer.
+    def size(self):
+        return QtCore.QSize(self.index.width, self.index.height)
+
+    ## Number of pyramid levels
+    #  @param self The object pointer.
+    def levelCount(self):
+        return self.numLevels
+
+    ## Size of the compared area at a given pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelSize(self, level):
+        factor = 2 ** level
+        return QtCore.QSize(max(1, -(-self.index.width // factor)), max(1, -(-self.index.height // factor)))
+
+    ## Image data for one tile
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileImage(self, level, rect):
+        index = self.index
+        top, left, bottom, right = rect.top(), rect.left(), rect.top() + rect.height(), rect.left() + rect.width()
+        ssim, contrastStructure, lumaA = index.maps(top, left, bottom, right, 2 ** level)
+        lumaA = lumaA[kWindowRadius:-kWindowRadius, kWindowRadius:-kWindowRadius]
+        return arrayToQImage(similarityHeatmap(ssim, lumaA, index.dataRange, self.gain))
+
+## Scores as text
+#  @param scores Dictionary returned by SimilarityIndex.computeGlobal, or None while it is computed.
+#  @param progress Fraction of the computation done.
+#  @param visible Result of SimilarityIndex.regionScore for the visible area, or None.
+#  @param error Why the scores could not be computed, or None.
+def formatScores(scores, progress, visible, error=None):
+    text = "SSIM: "
+    if error is not None:
+        text += "whole image not computed (" + error + ")"
+    elif scores is None:
+        text += "whole image computing (%d%%)" % int(progress * 100)
+    else:
+        text += "whole image %.4f, MS-SSIM %.4f" % (scores['ssim'], scores['msssim'])
+    if visible is not None:
+        text += "; visible %.4f" % visible[0]
+        if visible[1] < 1.0:
+            text += " (%d%% measured)" % int(visible[1] * 100)
+    return text
+
+# end
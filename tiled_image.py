@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  tiled_image.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# GUI
+from PyQt4 import QtCore, QtGui
+
+# timed spans for the instrumentation display and traces
+from instrumentation import traced, tracer
+
+# source pixels drawn one by one at high magnification
+from pixel_zoom import drawPixels, exposedPixels, kLabelScale, kPixelZoomScale, pixelOverlays
+
+# calculations
+import math
+from collections import OrderedDict
+
+# constants
+kTileSize = 256
+kMaxCachedTiles = 512
+
+## ImageTileSource
+#
+#  Provides tiles of a decoded image at every level of a mip pyramid.
+#  Level 0 is the original image; each following level halves both dimensions.
+#  Levels are built on first use, from the level just above them.
+class ImageTileSource(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param image The decoded QImage (level 0 of the pyramid).
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, image, tileSize=kTileSize):
+        self.levels = [image]
+        self.tileSize = tileSize
+
+        # number of levels until the whole image fits in a single tile
+        longestSide = max(image.width(), image.height(), 1)
+        self.numLevels = max(1, int(math.ceil(math.log(float(longestSide) / tileSize, 2))) + 1)
+
+        # done
+
+    ## Size of the full resolution image
+    #  @param self The object pointer.
+    def size(self):
+        return self.levels[0].size()
+
+    ## Number of pyramid levels
+    #  @param self The object pointer.
+    def levelCount(self):
+        return self.numLevels
+
+    ## Size of the image at a given pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelSize(self, level):
+        size = self.size()
+        factor = 2 ** level
+        return QtCore.QSize(max(1, int(math.ceil(size.width() / float(factor)))), max(1, int(math.ceil(size.height() / float(factor)))))
+
+    ## Image for a pyramid level, built on demand
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelImage(self, level):
+        while len(self.levels) <= level:
+            nextSize = self.levelSize(len(self.levels))
+            self.levels.append(self.levels[-1].scaled(nextSize, QtCore.Qt.IgnoreAspectRatio, QtCore.Qt.SmoothTransformation))
+        return self.levels[level]
+
+    ## Image data for one tile
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileImage(self, level, rect):
+        return self.levelImage(level).copy(rect)
+
+    ## Release everything but the original image
+    #  @param self The object pointer.
+    def releaseLevels(self):
+        del self.levels[1:]
+
+        # done
+
+## TiledImageItem
+#
+#  Scene item that draws an image as a grid of fixed-size tiles.
+#  Only tiles intersecting the exposed (visible) part of the scene are created and painted,
+#  and they are taken from the pyramid level that matches the current zoom of the view.
+class TiledImageItem(QtGui.QGraphicsItem):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param source The tile source, e.g. an ImageTileSource.
+    #  @param parent The parent item, if any.
+    def __init__(self, source, parent=None):
+        super(TiledImageItem, self).__init__(parent)
+        self.source = source
+        self.tileSize = source.tileSize
+        self.imageSize = source.size()
+
+        # pixmaps of recently painted tiles, least recently used first
+        self.tileCache = OrderedDict()
+        self.maxCachedTiles = kMaxCachedTiles
+
+        # we need the exposed rectangle while painting
+        self.setFlag(QtGui.QGraphicsItem.ItemUsesExtendedStyleOption, True)
+
+        # done
+
+    ## Area covered by the image, in scene coordinates
+    #  @param self The object pointer.
+    def boundingRect(self):
+        return QtCore.QRectF(0, 0, self.imageSize.width(), self.imageSize.height())
+
+    ## Pyramid level that matches a scale factor
+    #  @param self The object pointer.
+    #  @param scale Number of screen pixels per image pixel.
+    def levelForScale(self, scale):
+        if scale <= 0 or scale >= 1.0:
+            return 0
+        # a level is used until it would have to be magnified
+        level = int(math.floor(math.log(1.0 / scale, 2)))
+        return min(level, self.source.levelCount() - 1)
+
+    ## Pixmap for a tile, from the cache if possible
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param column The tile column at that level.
+    #  @param row The tile row at that level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tilePixmap(self, level, column, row, rect):
+        key = (level, column, row)
+        pixmap = self.tileCache.pop(key, None)
+        if pixmap is None:
+            with tracer.span("tile", "paint", {'level': level, 'column': column, 'row': row}):
+                pixmap = QtGui.QPixmap.fromImage(self.source.tileImage(level, rect))
+        self.tileCache[key] = pixmap
+
+        # forget the tiles that have not been seen for the longest time
+        while len(self.tileCache) > self.maxCachedTiles:
+            self.tileCache.popitem(last=False)
+        return pixmap
+
+    ## Drop all cached tiles, e.g. after the source has changed
+    #  @param self The object pointer.
+    def invalidateTiles(self):
+        self.tileCache.clear()
+        self.update()
+
+        # done
+
+    ## Draw the tiles that intersect the exposed rectangle
+    #  @param self The object pointer.
+    #  @param painter The painter.
+    #  @param option The style options, with the exposed rectangle.
+    #  @param widget The widget being painted on.
+    @traced("paint")
+    def paint(self, painter, option, widget=None):
+        scale = QtGui.QStyleOptionGraphicsItem.levelOfDetailFromTransform(painter.worldTransform())
+        if scale >= kPixelZoomScale:
+            self.paintPixels(painter, option, scale)
+            return
+        level = self.levelForScale(scale)
+
+        # mapping between level pixels and scene coordinates
+        levelSize = self.source.levelSize(level)
+        factorX = self.imageSize.width() / float(levelSize.width())
+        factorY = self.imageSize.height() / float(levelSize.height())
+
+        # exposed area, in level pixels
+        exposed = option.exposedRect.intersected(self.boundingRect())
+        if exposed.isEmpty():
+            return
+        firstColumn = int(exposed.left() / factorX) // self.tileSize
+        lastColumn = min(int(math.ceil(exposed.right() / factorX)), levelSize.width() - 1) // self.tileSize
+        firstRow = int(exposed.top() / factorY) // self.tileSize
+        lastRow = min(int(math.ceil(exposed.bottom() / factorY)), levelSize.height() - 1) // self.tileSize
+
+        # smooth scaling only pays off when the level is shown shrunk
+        painter.setRenderHint(QtGui.QPainter.SmoothPixmapTransform, scale < 1.0)
+
+        for row in range(firstRow, lastRow + 1):
+            for column in range(firstColumn, lastColumn + 1):
+                x = column * self.tileSize
+                y = row * self.tileSize
+                rect = QtCore.QRect(x, y, min(self.tileSize, levelSize.width() - x), min(self.tileSize, levelSize.height() - y))
+                pixmap = self.tilePixmap(level, column, row, rect)
+                target = QtCore.QRectF(x * factorX, y * factorY, rect.width() * factorX, rect.height() * factorY)
+                painter.drawPixmap(target, pixmap, QtCore.QRectF(pixmap.rect()))
+
+        # done
+
+    ## Draw the exposed pixels of the full resolution image, at high magnification
+    #  Only these pixels are taken from the source, so the cost depends on the size of the view alone.
+    #  @param self The object pointer.
+    #  @param painter The painter.
+    #  @param option The style options, with the exposed rectangle.
+    #  @param scale Number of screen pixels per image pixel.
+    def paintPixels(self, painter, option, scale):
+        rect = exposedPixels(option.exposedRect, self.imageSize.width(), self.imageSize.height())
+        if rect.isEmpty():
+            return
+        grid, labels = pixelOverlays(self)
+
+        # sources that show their samples through a mapping can label the pixels with the samples themselves
+        values = None
+        if labels and scale >= kLabelScale and hasattr(self.source, 'pixelValues'):
+            values = self.source.pixelValues(rect)
+        drawPixels(painter, self.source.tileImage(0, rect), rect, grid, labels, values)
+
+        # done
+
+# end
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  tone_mapping.py
+#  @author: Chamin Morikawa
+#
+#  Display of 16-bit, 32-bit and floating point images through a window (the range of values
+#  spread over black to white) and a tone curve. The original samples are kept; only the tiles
+#  that are painted are mapped, with a lookup table for samples of up to 16 bits.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# calculations
+import math
+import numpy
+
+# conversion of results for display
+from mapped_image import arrayToQImage
+
+# constants
+kToneCurves = ("Linear", "Gamma", "Log")
+kGamma = 2.2
+kLogRange = 1000.0
+kWindowSamples = 1 << 20
+kTileSize = 256
+
+## Whether an image needs a window to be shown; 8-bit images are shown as they are
+#  @param array The image array.
+def needsToneMapping(array):
+    return array.dtype != numpy.uint8
+
+## Window covering all values of an image, judged from an evenly spread subset of its pixels
+#  @param array The image array.
+#  @return (low, high), with high > low.
+def autoWindow(array):
+    step = max(1, int(math.sqrt(array.shape[0] * array.shape[1] / float(kWindowSamples))))
+    sample = array[::step, ::step]
+    if sample.dtype.kind == 'f':
+        sample = sample[numpy.isfinite(sample)]
+    if sample.size == 0:
+        return 0.0, 1.0
+    low, high = float(sample.min()), float(sample.max())
+    if high <= low:
+        high = low + (1.0 if array.dtype.kind in 'ui' else 1e-6)
+    return low, high
+
+## ToneMap
+#
+#  Maps sample values to 8-bit display values: the window [low, high] to [0, 1], then through a tone curve.
+#  Instances do not change; a new window is a new ToneMap.
+class ToneMap(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param low The value shown as black.
+    #  @param high The value shown as white.
+    #  @param curve One of kToneCurves.
+    def __init__(self, low, high, curve=kToneCurves[0]):
+        self.low = float(low)
+        self.high = float(high) if high > low else float(low) + 1e-6
+        self.curve = curve
+        self.tables = {}
+
+        # done
+
+    ## The window and curve of an image's full range of values
+    #  @param array The image array.
+    #  @param curve One of kToneCurves.
+    @staticmethod
+    def auto(array, curve=kToneCurves[0]):
+        low, high = autoWindow(array)
+        return ToneMap(low, high, curve)
+
+    ## The same window with another tone curve
+    #  @param self The object pointer.
+    #  @param curve One of kToneCurves.
+    def withCurve(self, curve):
+        return ToneMap(self.low, self.high, curve)
+
+    ## Display values of samples, 0 to 255
+    #  @param self The object pointer.
+    #  @param values Array of samples.
+    def mapValues(self, values):
+        normalized = (values.astype(numpy.float32) - numpy.float32(self.low)) * numpy.float32(1.0 / (self.high - self.low))
+        numpy.clip(normalized, 0.0, 1.0, out=normalized)
+        if self.curve == "Gamma":
+            numpy.power(normalized, 1.0 / kGamma, out=normalized)
+        elif self.curve == "Log":
+            normalized = numpy.log1p(normalized * kLogRange) * numpy.float32(1.0 / math.log1p(kLogRange))
+        # NaN is shown as black
+        return numpy.nan_to_num(normalized * 255.0 + 0.5, copy=False).astype(numpy.uint8)
+
+    ## Lookup table for all values of an integer data type of up to 16 bits, built on first use
+    #  The table is indexed by the unsigned view of the samples.
+    #  @param self The object pointer.
+    #  @param dtype The data type.
+    def lookupTable(self, dtype):
+        table = self.tables.get(dtype.str)
+        if table is None:
+            unsigned = numpy.dtype(dtype.byteorder + 'u' + str(dtype.itemsize))
+            values = numpy.arange(2 ** (8 * dtype.itemsize), dtype=numpy.uint32).astype(unsigned).view(dtype)
+            table = self.tables[dtype.str] = self.mapValues(values)
+        return table
+
+    ## Display values of a region, as 8-bit grey or RGB; an alpha channel is dropped
+    #  @param self The object pointer.
+    #  @param region The region of the image, height x width (x channels).
+    def apply(self, region):
+        if region.ndim == 3 and region.shape[2] == 4:
+            region = region[:, :, :3]
+        if region.dtype.kind in 'ui' and region.dtype.itemsize <= 2:
+            unsigned = numpy.dtype(region.dtype.byteorder + 'u' + str(region.dtype.itemsize))
+            return numpy.take(self.lookupTable(region.dtype), region.view(unsigned))
+        return self.mapValues(region)
+
+    ## The window and curve, for display
+    #  @param self The object pointer.
+    def describe(self):
+        return "window %g to %g (%s)" % (self.low, self.high, self.curve.lower())
+
+## ToneMappedTileSource
+#
+#  Tile source for TiledImageItem that shows an image of any sample type through a ToneMap.
+#  Tiles are mapped only when they are painted, from a strided view of the image;
+#  after a change of the ToneMap, only the tiles painted again are mapped again.
+class ToneMappedTileSource(object):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param array The image array.
+    #  @param toneMap The ToneMap.
+    #  @param tileSize Edge length of a tile, in pixels.
+    def __init__(self, array, toneMap, tileSize=kTileSize):
+        self.array = array
+        self.toneMap = toneMap
+        self.tileSize = tileSize
+        self.height, self.width = array.shape[:2]
+
+        longestSide = max(self.width, self.height, 1)
+        self.numLevels = max(1, int(math.ceil(math.log(float(longestSide) / tileSize, 2))) + 1)
+
+        # done
+
+    ## Size of the full resolution image
+    #  @param self The object pointer.
+    def size(self):
+        return QtCore.QSize(self.width, self.height)
+
+    ## Number of pyramid levels
+    #  @param self The object pointer.
+    def levelCount(self):
+        return self.numLevels
+
+    ## Size of the image at a given pyramid level
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    def levelSize(self, level):
+        factor = 2 ** level
+        return QtCore.QSize(max(1, -(-self.width // factor)), max(1, -(-self.height // factor)))
+
+    ## Image data for one tile
+    #  @param self The object pointer.
+    #  @param level The pyramid level.
+    #  @param rect The tile rectangle, in pixel coordinates of that level.
+    def tileImage(self, level, rect):
+        factor = 2 ** level
+        rows = slice(rect.top() * factor, min((rect.top() + rect.height()) * factor, self.height), factor)
+        columns = slice(rect.left() * factor, min((rect.left() + rect.width()) * factor, self.width), factor)
+        return arrayToQImage(self.toneMap.apply(self.array[rows, columns]))
+
+    ## Original samples of some pixels, for labelling them at high magnification
+    #  @param self The object pointer.
+    #  @param rect The pixels, at full resolution.
+    #  @return Rows of per-pixel lists of samples.
+    def pixelValues(self, rect):
+        region = self.array[rect.top():rect.top() + rect.height(), rect.left():rect.left() + rect.width()]
+        return region.reshape(region.shape[0], region.shape[1], -1).tolist()
+
+# end
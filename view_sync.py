@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  view_sync.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# timed spans and frame rate for the instrumentation display
+from instrumentation import traced, tracer
+
+# constants
+kFrameInterval = 16
+kInfoInterval = 100
+
+## SyncScheduler
+#
+#  Collects pan and zoom requests from mouse events and applies them to the shared viewport model
+#  once per display frame, however many events arrive in between.
+#  Info updates are throttled separately, as they are slower and less urgent.
+class SyncScheduler(QtCore.QObject):
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param model The ViewportModel the synchronized views subscribe to.
+    #  @param referenceView Function returning the view whose visible centre is the starting point for panning,
+    #         as long as the model has no centre yet.
+    #  @param infoCallback Function that updates the info display.
+    #  @param parent The parent object.
+    def __init__(self, model, referenceView, infoCallback, parent=None):
+        super(SyncScheduler, self).__init__(parent)
+        self.model = model
+        self.referenceView = referenceView
+        self.infoCallback = infoCallback
+
+        # pending changes
+        self.pendingZoom = 1.0
+        self.pendingPanX = 0.0
+        self.pendingPanY = 0.0
+        self.pendingCenter = None
+
+        # one frame timer for the views, one for the info
+        self.frameTimer = QtCore.QTimer(self)
+        self.frameTimer.setSingleShot(True)
+        self.frameTimer.timeout.connect(self.applyPending)
+        self.infoTimer = QtCore.QTimer(self)
+        self.infoTimer.setSingleShot(True)
+        self.infoTimer.timeout.connect(self.infoCallback)
+        self.sinceLastFrame = QtCore.QElapsedTimer()
+        self.sinceLastFrame.start()
+
+        # counters
+        self.eventsReceived = 0
+        self.framesApplied = 0
+        self.infoUpdates = 0
+
+        # done
+
+    ## Number of input events that did not need a frame of their own
+    #  @param self The object pointer.
+    def coalescedEvents(self):
+        return self.eventsReceived - self.framesApplied
+
+    ## Zoom by a factor
+    #  @param self The object pointer.
+    #  @param factor The multiplication factor of scale.
+    def addZoom(self, factor):
+        self.pendingZoom *= factor
+        self.requestFrame()
+
+        # done
+
+    ## Move by a distance
+    #  @param self The object pointer.
+    #  @param deltaX The distance to move the image to the right, in scene units.
+    #  @param deltaY The distance to move the image down, in scene units.
+    def addPan(self, deltaX, deltaY):
+        self.pendingPanX += deltaX
+        self.pendingPanY += deltaY
+        self.requestFrame()
+
+        # done
+
+    ## Center on a point; pending pans are discarded
+    #  @param self The object pointer.
+    #  @param point The scene point to center on.
+    def setCenter(self, point):
+        self.pendingCenter = QtCore.QPointF(point)
+        self.pendingPanX = 0.0
+        self.pendingPanY = 0.0
+        self.requestFrame()
+
+        # done
+
+    ## Make sure the pending changes are applied with the next frame
+    #  @param self The object pointer.
+    def requestFrame(self):
+        self.eventsReceived += 1
+        if not self.frameTimer.isActive():
+            # no waiting if the last frame was long ago
+            self.frameTimer.start(max(0, kFrameInterval - self.sinceLastFrame.elapsed()))
+
+        # done
+
+    ## Apply everything that has accumulated since the last frame
+    #  @param self The object pointer.
+    @traced("sync")
+    def applyPending(self):
+        fallbackCenter = None
+        if self.model.center is None:
+            fallbackCenter = self.referenceView().visibleModelRect().center()
+        self.model.update(self.pendingZoom, self.pendingPanX, self.pendingPanY, self.pendingCenter, fallbackCenter)
+        tracer.recordFrame()
+
+        self.pendingZoom = 1.0
+        self.pendingPanX = 0.0
+        self.pendingPanY = 0.0
+        self.pendingCenter = None
+        self.framesApplied += 1
+        self.sinceLastFrame.restart()
+
+        # the info can wait a little longer
+        if not self.infoTimer.isActive():
+            self.infoUpdates += 1
+            self.infoTimer.start(kInfoInterval)
+
+        # done
+
+# end
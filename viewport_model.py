@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+## @package Image Comparison Tool
+#
+#  viewport_model.py
+#  @author: Chamin Morikawa
+#
+#  Copyright Chamin Morikawa 2019. All rights reserved.
+#
+
+# GUI
+from PyQt4 import QtCore
+
+# zoom limits shared with the views
+from image_container import kScaleFactorMin, kScaleFactorMax
+
+# timed spans for the instrumentation display and traces
+from instrumentation import traced
+
+## ViewportModel
+#
+#  The part of the scene that all synchronized views show: a centre point and a scale.
+#  Views subscribe to changed and bring themselves up to date; nobody calls the views one by one.
+class ViewportModel(QtCore.QObject):
+    # emitted once per batch of changes
+    changed = QtCore.pyqtSignal()
+
+    ## The constructor.
+    #  @param self The object pointer.
+    #  @param parent The parent object.
+    def __init__(self, parent=None):
+        super(ViewportModel, self).__init__(parent)
+        self.center = None
+        self.scale = 1.0
+        self.updates = 0
+
+        # done
+
+    ## Apply a batch of changes and notify the views once
+    #  @param self The object pointer.
+    #  @param zoom Multiplication factor of scale; the scale stops at the limits of the allowed range.
+    #  @param panX The distance to move the image to the right, in scene units.
+    #  @param panY The distance to move the image down, in scene units.
+    #  @param center New centre, before panning; None to keep the current one.
+    #  @param fallbackCenter Centre to pan from while the model has none yet.
+    @traced("sync")
+    def update(self, zoom=1.0, panX=0.0, panY=0.0, center=None, fallbackCenter=None):
+        # several wheel steps arrive as one factor; go as far as the limits allow
+        if zoom != 1.0:
+            self.scale = min(kScaleFactorMax, max(kScaleFactorMin, self.scale * zoom))
+
+        if center is None:
+            center = self.center if self.center is not None else fallbackCenter
+        if center is not None:
+            self.center = QtCore.QPointF(center.x() - panX, center.y() - panY)
+
+        self.updates += 1
+        self.changed.emit()
+
+        # done
+
+    ## Forget the centre and go back to 1:1
+    #  @param self The object pointer.
+    def reset(self):
+        self.center = None
+        self.scale = 1.0
+        self.changed.emit()
+
+        # done
+
+# end